@@ -9,12 +9,17 @@ from director import screengrabberpanel
 from director import cameracontrolpanel
 
 from director import transformUtils
+from director import vtkNumpy as vnp
 import numpy as np
 import time
 import scipy.integrate as integrate
 import argparse
 import matplotlib.pyplot as plt
 import shelve
+import os
+import copy
+import threading
+from vtk.util import numpy_support
 
 from PythonQt import QtCore, QtGui
 
@@ -23,6 +28,13 @@ from car import CarPlant
 from sensor import SensorObj
 from sensorApproximator import SensorApproximatorObj
 from controller import ControllerObj
+from trajectoryLog import TrajectoryLog
+from signedDistanceField import SignedDistanceField
+from worldCache import WorldCache
+from tiledWorld import TiledWorld
+from freeSpaceSampler import FreeSpaceSampler
+from lruCache import LRUCache
+from profiler import Profiler, NullProfiler
 
 
 
@@ -30,8 +42,9 @@ class Simulator(object):
 
 
     def __init__(self, percentObsDensity=20, endTime=40, nonRandomWorld=False,
-                 circleRadius=0.7, worldScale=1.0, autoInitialize=True, verbose=True):
+                 circleRadius=0.7, worldScale=1.0, autoInitialize=True, verbose=True, headless=False):
         self.verbose = verbose
+        self.headless = headless
         self.startSimTime = time.time()
         self.collisionThreshold = 0.2
         self.randomSeed = 5
@@ -42,10 +55,18 @@ class Simulator(object):
         self.nonRandomWorld = nonRandomWorld
         self.circleRadius = circleRadius
         self.worldScale = worldScale
-
-        # create the visualizer object
-        self.app = ConsoleApp()
-        self.view = self.app.createView(useGrid=False)
+        self.log = None
+        self.playbackIdx = None
+        self.simulationThread = None
+        self.abortRequested = False
+        self.profiler = NullProfiler()
+
+        # create the visualizer object, a headless simulator only gets one
+        # when setupPlayback is called
+        self.app = None
+        self.view = None
+        if not self.headless:
+            self.createView()
 
         self.initializeOptions()
         self.initializeColorMap()
@@ -53,6 +74,10 @@ class Simulator(object):
         if autoInitialize:
             self.initialize()
 
+    def createView(self):
+        self.app = ConsoleApp()
+        self.view = self.app.createView(useGrid=False)
+
     def initializeOptions(self):
         self.options = dict()
 
@@ -90,21 +115,44 @@ class Simulator(object):
         defaultOptions['World']['nonRandomWorld'] = True
         defaultOptions['World']['circleRadius'] = 1.75
         defaultOptions['World']['scale'] = 2.5
+        defaultOptions['World']['distanceField'] = False
+        defaultOptions['World']['distanceFieldResolution'] = 0.25
+        defaultOptions['World']['worldCache'] = True
+        defaultOptions['World']['tiled'] = False
+        defaultOptions['World']['tileSize'] = 50.0
+        defaultOptions['World']['maxTiles'] = 64
+        defaultOptions['World']['layout'] = 'uniform'
+        defaultOptions['World']['minGap'] = 2.0
 
 
         defaultOptions['Sensor'] = dict()
         defaultOptions['Sensor']['rayLength'] = 20
         defaultOptions['Sensor']['numRays'] = 41
+        defaultOptions['Sensor']['raycaster'] = 'analytic'
+        defaultOptions['Sensor']['raycastCacheMargin'] = 5.0
 
 
         defaultOptions['Car'] = dict()
         defaultOptions['Car']['velocity'] = 20
+        defaultOptions['Car']['integrator'] = 'exact'
+
+        defaultOptions['SensorApproximator'] = dict()
+        defaultOptions['SensorApproximator']['solver'] = 'fast'
+
+        defaultOptions['Controller'] = dict()
+        defaultOptions['Controller']['u_max'] = 4
+        defaultOptions['Controller']['k'] = 5
+        defaultOptions['Controller']['slackParam'] = 0.1
 
         defaultOptions['dt'] = 0.05
 
 
         defaultOptions['runTime'] = dict()
         defaultOptions['runTime']['defaultControllerTime'] = 100
+        defaultOptions['runTime']['initialStateSampler'] = 'rejection'
+        defaultOptions['runTime']['initialStateClearance'] = 2.0
+        defaultOptions['runTime']['profile'] = False
+        defaultOptions['runTime']['profileFilename'] = None
 
 
         for k in defaultOptions:
@@ -133,30 +181,131 @@ class Simulator(object):
         self.Sensor = SensorObj(rayLength=self.options['Sensor']['rayLength'],
                                 numRays=self.options['Sensor']['numRays'])
 
-        self.SensorApproximator = SensorApproximatorObj(numRays=self.options['Sensor']['numRays'], circleRadius=self.options['World']['circleRadius'], )
+        self.SensorApproximator = SensorApproximatorObj(numRays=self.options['Sensor']['numRays'], circleRadius=self.options['World']['circleRadius'],
+                                                        solver=self.options['SensorApproximator']['solver'])
 
-        self.Controller = ControllerObj(self.Sensor, self.SensorApproximator)
+        self.Controller = ControllerObj(self.Sensor, self.SensorApproximator,
+                                        u_max=self.options['Controller']['u_max'])
+        self.Controller.k = self.options['Controller']['k']
+        self.Controller.slackParam = self.options['Controller']['slackParam']
 
         self.Car = CarPlant(controller=self.Controller,
-                            velocity=self.options['Car']['velocity'])
+                            velocity=self.options['Car']['velocity'],
+                            integrator=self.options['Car']['integrator'])
 
         self.Controller.initializeVelocity(self.Car.v)
 
 
 
         # create the things needed for simulation
-        om.removeFromObjectModel(om.findObjectByName('world'))
-        self.world = World.buildCircleWorld(percentObsDensity=self.options['World']['percentObsDensity'],
-                                            circleRadius=self.options['World']['circleRadius'],
-                                            nonRandom=self.options['World']['nonRandomWorld'],
-                                            scale=self.options['World']['scale'],
-                                            randomSeed=self.options['World']['randomSeed'],
-                                            obstaclesInnerFraction=self.options['World']['obstaclesInnerFraction'])
+        if not self.headless:
+            om.removeFromObjectModel(om.findObjectByName('world'))
+        worldParameters = dict(percentObsDensity=self.options['World']['percentObsDensity'],
+                               circleRadius=self.options['World']['circleRadius'],
+                               nonRandom=self.options['World']['nonRandomWorld'],
+                               scale=self.options['World']['scale'],
+                               randomSeed=self.options['World']['randomSeed'],
+                               obstaclesInnerFraction=self.options['World']['obstaclesInnerFraction'],
+                               layout=self.options['World']['layout'],
+                               minGap=self.options['World']['minGap'])
+
+        # a world fixed by its seed is the same every time, so it is loaded
+        # from the world cache instead of being generated again
+        self.worldCache = None
+        if self.options['World']['tiled']:
+            self.world = self.buildTiledWorld()
+        elif self.options['World']['nonRandomWorld'] and self.options['World']['worldCache']:
+            self.worldCache = WorldCache('data/worlds')
+            self.world = self.worldCache.buildCircleWorld(visualize=not self.headless, **worldParameters)
+        else:
+            self.world = World.buildCircleWorld(visualize=not self.headless, **worldParameters)
+
+        # the distance field is baked for the 'distanceField' raycaster or for
+        # clearance queries alone if the World option asks for it
+        self.distanceField = None
+        if self.options['World']['distanceField'] or self.options['Sensor']['raycaster'] == 'distanceField':
+            self.distanceField = self.buildDistanceField()
+
+        if self.options['Sensor']['raycaster'] == 'analytic':
+            self.Sensor.setObstacles(self.world.obstacles)
+            if self.options['Sensor']['raycastCacheMargin'] > 0:
+                self.Sensor.enableRaycastCache(self.options['Sensor']['raycastCacheMargin'])
+        elif self.options['Sensor']['raycaster'] == 'distanceField':
+            self.Sensor.setDistanceField(self.distanceField)
+
+        self.freeSpaceSampler = None
+        self.robotPose = np.zeros(3)
+        self.robot = None
+        self.frame = None
+        self.locator = None
+
+        if not self.headless:
+            self.initializeVisualization()
+        elif self.options['Sensor']['raycaster'] == 'locator':
+            self.locator = self.buildLocator()
+            self.Sensor.setLocator(self.locator)
+
+        self.defaultControllerTime = self.options['runTime']['defaultControllerTime']
+
+        print "Finished initialization"
+
+    def buildDistanceField(self):
+        # a random world is different every time, so only worlds fixed by
+        # their seed are cached on disk
+        cacheDir = None
+        if self.options['World']['nonRandomWorld']:
+            cacheDir = 'data/distanceFields'
+
+        parameters = dict(self.options['World'])
+        parameters.pop('worldCache', None)
+        parameters['builder'] = 'buildCircleWorld'
+        return SignedDistanceField.fromWorld(self.world, parameters, resolution=self.options['World']['distanceFieldResolution'],
+                                             cacheDir=cacheDir)
+
+    def buildTiledWorld(self):
+        # an unbounded world streamed in around the car, only the analytic
+        # raycaster follows the obstacles as they change
+        if self.options['Sensor']['raycaster'] != 'analytic' or self.options['World']['distanceField']:
+            raise ValueError("a tiled world needs the analytic raycaster and no distance field")
+
+        world = TiledWorld(randomSeed=self.options['World']['randomSeed'],
+                           tileSize=self.options['World']['tileSize'],
+                           percentObsDensity=self.options['World']['percentObsDensity'],
+                           circleRadius=self.options['World']['circleRadius'],
+                           loadRadius=self.options['Sensor']['rayLength'],
+                           maxTiles=self.options['World']['maxTiles'])
+        world.update(0.0, 0.0)
+        return world
+
+    def updateTiledWorld(self, x, y):
+        if not self.world.update(x, y):
+            return
+
+        self.Sensor.setObstacles(self.world.obstacles)
+        if self.world.visObj is not None:
+            World.showWorld(self.world)
+
+    def buildLocator(self):
+        if self.worldCache is not None:
+            return self.worldCache.getLocator(self.world)
+        if self.world.visObj is not None:
+            return World.buildCellLocator(self.world.visObj.polyData)
+        return World.buildCellLocator(World.buildWorldPolyData(self.world.obstacles))
+
+    def initializeVisualization(self):
+        # the robot, its frame and the world mesh are only needed to draw the
+        # simulation, a headless simulator builds them when playback starts
+        if self.world.visObj is None:
+            if self.worldCache is not None:
+                self.worldCache.showWorld(self.world)
+            else:
+                World.showWorld(self.world)
 
         om.removeFromObjectModel(om.findObjectByName('robot'))
         self.robot, self.frame = World.buildRobot()
-        self.locator = World.buildCellLocator(self.world.visObj.polyData)
-        self.Sensor.setLocator(self.locator)
+        if self.locator is None:
+            self.locator = self.buildLocator()
+            self.Sensor.setLocator(self.locator)
         self.frame = self.robot.getChildFrame()
         self.frame.setProperty('Scale', 3)
         #self.frame.setProperty('Visible', False)
@@ -167,22 +316,24 @@ class Simulator(object):
         rep.SetRotateAxisEnabled(0, False)
         rep.SetRotateAxisEnabled(1, False)
 
-        self.defaultControllerTime = self.options['runTime']['defaultControllerTime']
-
         self.Car.setFrame(self.frame)
-        print "Finished initialization"
+        self.setRobotFrameState(self.robotPose[0], self.robotPose[1], self.robotPose[2])
 
 
     def runSingleSimulation(self, controllerType='default', simulationCutoff=None):
 
+        # each toc charges the time since the last one to its phase
+        profiler = self.profiler
+        tic = profiler.tic()
 
         self.setRandomCollisionFreeInitialState()
 
         currentCarState = np.copy(self.Car.state)
         nextCarState = np.copy(self.Car.state)
-        self.setRobotFrameState(currentCarState[0], currentCarState[1], currentCarState[2])
-        currentRaycast = self.Sensor.raycastAll(self.frame)
+        self.setRobotPose(currentCarState[0], currentCarState[1], currentCarState[2])
+        currentRaycast = self.Sensor.raycastAllFromPose(currentCarState[0], currentCarState[1], currentCarState[2])
         nextRaycast = np.zeros(self.Sensor.numRays)
+        tic = profiler.toc('reset', tic)
 
         # record the reward data
         runData = dict()
@@ -196,11 +347,15 @@ class Simulator(object):
             x = self.stateOverTime[idx,0]
             y = self.stateOverTime[idx,1]
             theta = self.stateOverTime[idx,2]
-            self.setRobotFrameState(x,y,theta)
+            tic = profiler.toc('logging', tic)
+            self.setRobotPose(x,y,theta)
+            tic = profiler.toc('frame', tic)
             # self.setRobotState(currentCarState[0], currentCarState[1], currentCarState[2])
-            currentRaycast = self.Sensor.raycastAll(self.frame)
+            currentRaycast = self.Sensor.raycastAllFromPose(x,y,theta)
+            tic = profiler.toc('raycast', tic)
             self.raycastData[idx,:] = currentRaycast
             S_current = (currentCarState, currentRaycast)
+            tic = profiler.toc('logging', tic)
 
 
             if controllerType not in self.colorMap.keys():
@@ -215,15 +370,19 @@ class Simulator(object):
                                                                             randomize=False)
 
             self.controlInputData[idx] = controlInput
+            tic = profiler.toc('controller', tic)
 
             nextCarState = self.Car.simulateOneStep(controlInput=controlInput, dt=self.dt)
+            tic = profiler.toc('dynamics', tic)
 
         
             x = nextCarState[0]
             y = nextCarState[1]
             theta = nextCarState[2]
-            self.setRobotFrameState(x,y,theta)
-            nextRaycast = self.Sensor.raycastAll(self.frame)
+            self.setRobotPose(x,y,theta)
+            tic = profiler.toc('frame', tic)
+            nextRaycast = self.Sensor.raycastAllFromPose(x,y,theta)
+            tic = profiler.toc('raycast', tic)
 
 
             # Compute the next control input
@@ -234,6 +393,7 @@ class Simulator(object):
                                                                             currentTime, self.frame,
                                                                             raycastDistance=nextRaycast,
                                                                             randomize=False)
+            tic = profiler.toc('controller', tic)
 
 
             #bookkeeping
@@ -241,18 +401,27 @@ class Simulator(object):
             currentRaycast = nextRaycast
             self.counter+=1
 
+            # rows before self.counter are final, playback may show them
+            self.numPublishedSteps = self.counter
+
             # break if we are in collision
-            if self.checkInCollision(nextRaycast):
+            inCollision = self.checkInCollision(nextRaycast)
+            tic = profiler.toc('collision', tic)
+            if inCollision:
                 if self.verbose: print "Had a collision, terminating simulation"
                 break
 
             if self.counter >= simulationCutoff:
                 break
 
+            if self.abortRequested:
+                break
+
 
         # fill in the last state by hand
         self.stateOverTime[self.counter,:] = currentCarState
         self.raycastData[self.counter,:] = currentRaycast
+        profiler.toc('logging', tic)
 
 
         # this just makes sure we don't get stuck in an infinite loop.
@@ -280,7 +449,14 @@ class Simulator(object):
 
         self.controllerTypeOrder = ['default']
         self.counter = 0
+        self.numPublishedSteps = 0
+        self.abortRequested = False
         self.simulationData = []
+
+        if self.options['runTime']['profile']:
+            self.profiler = Profiler()
+        else:
+            self.profiler = NullProfiler()
     
         self.initializeStatusBar()
 
@@ -292,7 +468,8 @@ class Simulator(object):
         loopStartIdx = self.counter
         simCutoff = min(loopStartIdx + self.defaultControllerTime/dt, self.numTimesteps)
         
-        while ((self.counter - loopStartIdx < self.defaultControllerTime/dt) and self.counter < self.numTimesteps-1):
+        while ((self.counter - loopStartIdx < self.defaultControllerTime/dt) and self.counter < self.numTimesteps-1
+               and not self.abortRequested):
             self.printStatusBar()
             startIdx = self.counter
             runData = self.runSingleSimulation(controllerType='default',
@@ -305,6 +482,13 @@ class Simulator(object):
             numRunsCounter+=1
             self.simulationData.append(runData)
 
+            # the row at self.counter is rewritten by the next run
+            if self.log is not None:
+                tic = self.profiler.tic()
+                self.appendToLog(self.counter)
+                self.profiler.toc('logging', tic)
+            self.profiler.endEpisode(runData['duration'])
+
         # BOOKKEEPING
         # truncate stateOverTime, raycastData, controlInputs to be the correct size
         self.numTimesteps = self.counter + 1
@@ -312,6 +496,19 @@ class Simulator(object):
         self.raycastData = self.raycastData[0:self.counter+1, :]
         self.controlInputData = self.controlInputData[0:self.counter+1]
         self.endTime = 1.0*self.counter/self.numTimesteps*self.endTime
+        self.numPublishedSteps = self.numTimesteps
+
+        if self.log is not None:
+            self.appendToLog(self.counter+1)
+            self.setLogMetadata(self.log)
+            self.log.close()
+            self.log = None
+
+        if self.profiler.enabled:
+            self.profiler.printSummary()
+            if self.options['runTime']['profileFilename'] is not None:
+                self.profiler.writeReport(self.options['runTime']['profileFilename'],
+                                          metadata=dict(options=self.options))
 
 
 
@@ -345,7 +542,7 @@ class Simulator(object):
             theta = 0 #+ np.random.uniform(0,2*np.pi,1)[0] * 0.01
             
             self.Car.setCarState(x,y,theta)
-            self.setRobotFrameState(x,y,theta)
+            self.setRobotPose(x,y,theta)
 
             print "In loop"
 
@@ -355,9 +552,25 @@ class Simulator(object):
         return x,y,theta
 
 
+    def getFreeSpaceSampler(self):
+        if self.freeSpaceSampler is None:
+            if self.options['World']['tiled']:
+                raise ValueError("the free space sampler needs a world whose obstacles do not change")
+            self.freeSpaceSampler = FreeSpaceSampler.fromWorld(self.world, self.options['runTime']['initialStateClearance'])
+        return self.freeSpaceSampler
+
     def setRandomCollisionFreeInitialState(self):
         tol = 5
 
+        # the 'freeSpace' sampler draws a pose with initialStateClearance to
+        # every obstacle directly, instead of raycasting random draws until
+        # the one straight ahead is clear
+        if self.options['runTime']['initialStateSampler'] == 'freeSpace':
+            x, y, theta = self.getFreeSpaceSampler().samplePoses(1)[0]
+            self.Car.setCarState(x,y,theta)
+            self.setRobotPose(x,y,theta)
+            return x,y,theta
+
         while True:
             
             x = np.random.uniform(self.world.Xmin+tol, self.world.Xmax-tol, 1)[0]
@@ -365,14 +578,19 @@ class Simulator(object):
             theta = np.random.uniform(0,2*np.pi,1)[0]
             
             self.Car.setCarState(x,y,theta)
-            self.setRobotFrameState(x,y,theta)
+            self.setRobotPose(x,y,theta)
 
             if not self.checkInCollision():
                 break
 
         return x,y,theta
 
-    def setupPlayback(self):
+    def setupPlayback(self, playbackCacheSize=2000):
+
+        if self.view is None:
+            self.createView()
+        if self.robot is None:
+            self.initializeVisualization()
 
         self.timer = TimerCallback(targetFps=30)
         self.timer.callback = self.tick
@@ -391,12 +609,21 @@ class Simulator(object):
 
         slider = QtGui.QSlider(QtCore.Qt.Horizontal)
         slider.connect('valueChanged(int)', self.onSliderChanged)
-        self.sliderMax = self.numTimesteps
+        self.sliderMax = self.getNumPlaybackSteps()
         slider.setMaximum(self.sliderMax)
         self.slider = slider
 
+        # follow keeps the slider on the newest timestep while a background
+        # simulation runs, abort stops that simulation
+        self.followCheckBox = QtGui.QCheckBox('Follow')
+        self.followCheckBox.checked = self.isSimulating()
+        abortButton = QtGui.QPushButton('Abort')
+        abortButton.connect('clicked()', self.abortSimulation)
+
         l.addWidget(playButton)
         l.addWidget(slider)
+        l.addWidget(self.followCheckBox)
+        l.addWidget(abortButton)
 
         w = QtGui.QWidget()
         l = QtGui.QVBoxLayout(w)
@@ -405,8 +632,23 @@ class Simulator(object):
         l.addWidget(panel)
         w.showMaximized()
 
+        # the rays and poly approximations of logged timesteps are drawn from
+        # raycastData, and the drawings of recently shown timesteps are kept.
+        # The LP fits are small, so one per timestep is kept.
+        self.raysDrawingCache = LRUCache(playbackCacheSize)
+        self.polyApproxDrawingCache = LRUCache(playbackCacheSize)
+        self.polyCoefficientsCache = LRUCache(len(self.stateOverTime))
+
+        # playback raycasts and fits with its own copies, the simulation may
+        # still be using the originals on its thread
+        self.playbackSensor = copy.copy(self.Sensor)
+        self.playbackSensor.disableRaycastCache()
+        self.playbackSensorApproximator = copy.copy(self.SensorApproximator)
+
         self.frame.connectFrameModified(self.updateDrawIntersection)
         self.frame.connectFrameModified(self.updateDrawPolyApprox)
+        self.playbackIdx = self.getPlaybackIndex(slider.value)
+        self.setRobotFrameState(*self.stateOverTime[self.playbackIdx])
         self.updateDrawIntersection(self.frame)
         self.updateDrawPolyApprox(self.frame)
         
@@ -419,6 +661,11 @@ class Simulator(object):
 
         cameracontrolpanel.CameraControlPanel(self.view).widget.show()
 
+        self.streamTimer = TimerCallback(targetFps=10)
+        self.streamTimer.callback = self.onStreamTimer
+        if self.isSimulating():
+            self.streamTimer.start()
+
         elapsed = time.time() - self.startSimTime
         simRate = self.counter/elapsed
         print "Total run time", elapsed
@@ -426,36 +673,139 @@ class Simulator(object):
         print "Number of steps taken", self.counter
         self.app.start()
 
-    def run(self, launchApp=True):
+    def run(self, launchApp=True, background=False):
+        # with background the batch runs on its own thread and playback
+        # starts as soon as the first timestep is in
         self.counter = 1
-        self.runBatchSimulation()
+        if background and launchApp:
+            self.startBackgroundSimulation()
+        else:
+            self.runBatchSimulation()
 
         if launchApp:
             self.setupPlayback()
 
+    def startBackgroundSimulation(self):
+        # runBatchSimulation on a daemon thread. It publishes its progress in
+        # numPublishedSteps, and the rows of stateOverTime, raycastData and
+        # controlInputData before that are never written again, so the UI
+        # thread can read them while the simulation goes on.
+        if self.options['World']['tiled']:
+            raise ValueError("a tiled world can not be simulated in the background, playback moves its tiles")
+
+        self.numPublishedSteps = 0
+        self.simulationThread = threading.Thread(target=self.runBatchSimulation)
+        self.simulationThread.daemon = True
+        self.simulationThread.start()
+
+        while self.numPublishedSteps == 0 and self.simulationThread.is_alive():
+            time.sleep(0.01)
+
+    def isSimulating(self):
+        return self.simulationThread is not None and self.simulationThread.is_alive()
+
+    def abortSimulation(self):
+        # the simulation stops after its current step and finishes the batch
+        # bookkeeping, log included, as if it had reached the end
+        if self.isSimulating():
+            print "aborting simulation at step", self.counter
+        self.abortRequested = True
+
+    def getNumPlaybackSteps(self):
+        if self.isSimulating():
+            return self.numPublishedSteps
+        return len(self.stateOverTime)
+
+    def onStreamTimer(self):
+        # grow the slider as timesteps come in and, in follow mode, show the
+        # newest one
+        simulating = self.isSimulating()
+        numSteps = self.getNumPlaybackSteps()
+        if numSteps != self.sliderMax:
+            self.sliderMax = numSteps
+            self.slider.setMaximum(self.sliderMax)
+
+        if self.followCheckBox.checked and self.slider.value != self.sliderMax:
+            self.sliderMovedByPlayTimer = True
+            self.slider.setSliderPosition(self.sliderMax)
+
+        if not simulating:
+            print "background simulation finished after", self.counter, "steps"
+            self.streamTimer.stop()
+
+    def getLoggedIndex(self, frame):
+        # the playback timestep if the frame is still at its logged pose, None
+        # if there is none or the frame was dragged away from it
+        if self.playbackIdx is None:
+            return None
+
+        x, y, theta = SensorObj.getPoseFromFrame(frame)
+        loggedX, loggedY, loggedTheta = self.stateOverTime[self.playbackIdx]
+        angleError = np.abs(np.mod(theta - loggedTheta + np.pi, 2*np.pi) - np.pi)
+        if max(abs(x - loggedX), abs(y - loggedY), angleError) > 1e-6:
+            return None
+
+        return self.playbackIdx
+
     def updateDrawPolyApprox(self, frame):
-        distances = self.Sensor.raycastAll(frame)
-        polyCoefficients = self.SensorApproximator.polyFitConstrainedLP(distances)
-    
-        d = DebugData()
-        
-        x = self.SensorApproximator.approxThetaVector
-        y = x * 0.0
-        for index,val in enumerate(y):
-            y[index] = self.horner(x[index],polyCoefficients)
-        
-        origin = np.array(frame.transform.GetPosition())
-        origin[2] = -0.001
+        idx = self.getLoggedIndex(frame)
+        if idx is None:
+            x, y, theta = SensorObj.getPoseFromFrame(frame)
+            polyCoefficients = self.playbackSensorApproximator.polyFitConstrainedLP(self.playbackSensor.raycastAllFromPose(x, y, theta))
+            polyData = self.buildPolyApproxPolyData(x, y, theta, polyCoefficients)
+        else:
+            polyData = self.polyApproxDrawingCache.get(idx, lambda: self.buildPolyApproxPolyData(
+                self.stateOverTime[idx,0], self.stateOverTime[idx,1], self.stateOverTime[idx,2],
+                self.getPolyApproxCoefficients(idx)))
+
+        vis.updatePolyData(polyData, 'polyApprox', colorByName='RGB255')
 
-        for i in xrange(self.SensorApproximator.numApproxPoints):
-            if y[i] > 0:
-                ray = self.SensorApproximator.approxRays[:,i]
-                rayTransformed = np.array(frame.transform.TransformNormal(ray))
-                intersection = origin + rayTransformed * y[i]
-                intersection[2] = -0.001
-                d.addLine(origin, intersection, color=[0,0.1,1])
+    def getPolyApproxCoefficients(self, idx):
+        # the LP fit to the logged raycast of a timestep, solved once
+        return self.polyCoefficientsCache.get(idx, lambda: self.playbackSensorApproximator.polyFitConstrainedLP(self.raycastData[idx]))
 
-        vis.updatePolyData(d.getPolyData(), 'polyApprox', colorByName='RGB255')
+    def buildPolyApproxPolyData(self, x, y, theta, polyCoefficients):
+        # the LP has no solution when an obstacle is within circleRadius
+        if polyCoefficients is None:
+            return self.buildLinesPolyData(np.zeros((0,3)), np.zeros((0,3)), np.zeros((0,3)))
+
+        # polyCoefficients are in increasing order, polyval wants decreasing
+        approxY = np.polyval(polyCoefficients[::-1], self.SensorApproximator.approxThetaVector)
+        positive = approxY > 0
+
+        c = np.cos(theta)
+        s = np.sin(theta)
+        rays = self.SensorApproximator.approxRays[:,positive]
+        ends = np.zeros((np.sum(positive),3))
+        ends[:,0] = x + (c*rays[0,:] - s*rays[1,:])*approxY[positive]
+        ends[:,1] = y + (s*rays[0,:] + c*rays[1,:])*approxY[positive]
+        ends[:,2] = -0.001
+        starts = np.zeros_like(ends) + [x, y, -0.001]
+
+        return self.buildLinesPolyData(starts, ends, np.tile([0,0.1,1], (len(ends),1)))
+
+    @staticmethod
+    def buildLinesPolyData(starts, ends, colors):
+        # one polyData with a line from each of the (N,3) starts to its end,
+        # colored like DebugData with an 'RGB255' point array from the (N,3)
+        # colors in [0,1]
+        numLines = len(starts)
+        points = np.empty((2*numLines,3))
+        points[0::2] = starts
+        points[1::2] = ends
+
+        cells = np.empty((numLines,3), dtype=np.int64)
+        cells[:,0] = 2
+        cells[:,1] = 2*np.arange(numLines)
+        cells[:,2] = 2*np.arange(numLines) + 1
+        lines = vtk.vtkCellArray()
+        lines.SetCells(numLines, numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=True))
+
+        polyData = vnp.getVtkPolyDataFromNumpyPoints(points)
+        polyData.SetVerts(vtk.vtkCellArray())
+        polyData.SetLines(lines)
+        vnp.addNumpyToVtk(polyData, (255*np.repeat(colors, 2, axis=0)).astype(np.uint8), 'RGB255')
+        return polyData
 
     def horner(self, x, weights):
         coefficients = weights[::-1]
@@ -466,33 +816,32 @@ class Simulator(object):
         
 
     def updateDrawIntersection(self, frame):
+        idx = self.getLoggedIndex(frame)
+        if idx is None:
+            x, y, theta = SensorObj.getPoseFromFrame(frame)
+            controllerType = self.getControllerTypeFromCounter(self.slider.value)
+            polyData = self.buildRaysPolyData(x, y, theta, self.playbackSensor.raycastAllFromPose(x, y, theta), controllerType)
+        else:
+            controllerType = self.getControllerTypeFromCounter(idx)
+            polyData = self.raysDrawingCache.get(idx, lambda: self.buildRaysPolyData(
+                self.stateOverTime[idx,0], self.stateOverTime[idx,1], self.stateOverTime[idx,2], self.raycastData[idx],
+                controllerType))
 
-        origin = np.array(frame.transform.GetPosition())
-        #print "origin is now at", origin
-        d = DebugData()
-
-        sliderIdx = self.slider.value
-
-        controllerType = self.getControllerTypeFromCounter(sliderIdx)
-        colorMaxRange = self.colorMap[controllerType]
-
-        for i in xrange(self.Sensor.numRays):
-            ray = self.Sensor.rays[:,i]
-            rayTransformed = np.array(frame.transform.TransformNormal(ray))
-            #print "rayTransformed is", rayTransformed
-            intersection = self.Sensor.raycast(self.locator, origin, origin + rayTransformed*self.Sensor.rayLength)
-
-            if intersection is not None:
-                d.addLine(origin, intersection, color=[1,0,0])
-            else:
-                d.addLine(origin, origin+rayTransformed*self.Sensor.rayLength, color=colorMaxRange)
-
-        vis.updatePolyData(d.getPolyData(), 'rays', colorByName='RGB255')
+        vis.updatePolyData(polyData, 'rays', colorByName='RGB255')
 
         #camera = self.view.camera()
         #camera.SetFocalPoint(frame.transform.GetPosition())
         #camera.SetPosition(frame.transform.TransformPoint((-30,0,10)))
 
+    def buildRaysPolyData(self, x, y, theta, distances, controllerType):
+        # rays that hit an obstacle are red, the others have the color of
+        # the controller
+        ends = self.Sensor.invertRaycastsToLocationsFromPose(x, y, theta, distances)
+        starts = np.zeros_like(ends) + [x, y, 0.0]
+        hit = (np.asarray(distances) < self.Sensor.rayLength)[:,np.newaxis]
+        colors = np.where(hit, [1,0,0], self.colorMap[controllerType])
+
+        return self.buildLinesPolyData(starts, ends, colors)
 
     def getControllerTypeFromCounter(self, counter):
         name = self.controllerTypeOrder[0]
@@ -504,17 +853,39 @@ class Simulator(object):
         return name
 
 
+    def setRobotPose(self, x, y, theta):
+        # the sensor raycasts from the pose directly, so simulation only has
+        # to record it. setRobotFrameState also moves the drawn robot frame.
+        self.robotPose = np.array([x, y, theta])
+        if self.options['World']['tiled']:
+            self.updateTiledWorld(x, y)
+
     def setRobotFrameState(self, x, y, theta):
+        self.setRobotPose(x, y, theta)
+        if self.robot is None:
+            return
+
         t = vtk.vtkTransform()
         t.Translate(x,y,0.0)
         t.RotateZ(np.degrees(theta))
         self.robot.getChildFrame().copyFrame(t)
 
     # returns true if we are in collision
+    def getClearance(self, x, y):
+        # distance from (x,y) to the nearest obstacle, negative inside one
+        if self.distanceField is not None:
+            return self.distanceField.distance([x, y])[0]
+        return SignedDistanceField.signedDistances(self.world.obstacles, np.array([[x, y]]))[0]
+
     def checkInCollision(self, raycastDistance=None):
+        # with a distance field and no raycast, the car is in collision if
+        # any obstacle is within collisionThreshold, not just one straight ahead
+        if raycastDistance is None and self.distanceField is not None:
+            return self.getClearance(self.Car.state[0], self.Car.state[1]) < self.collisionThreshold
+
         if raycastDistance is None:
-            self.setRobotFrameState(self.Car.state[0],self.Car.state[1],self.Car.state[2])
-            raycastDistance = self.Sensor.raycastAll(self.frame)
+            self.setRobotPose(self.Car.state[0],self.Car.state[1],self.Car.state[2])
+            raycastDistance = self.Sensor.raycastAllFromPose(self.Car.state[0],self.Car.state[1],self.Car.state[2])
 
         # if np.min(raycastDistance) < self.collisionThreshold:
         #     return True
@@ -555,13 +926,16 @@ class Simulator(object):
     def onSliderChanged(self, value):
         if not self.sliderMovedByPlayTimer:
             self.playTimer.stop()
-        numSteps = len(self.stateOverTime)
-        idx = int(np.floor(numSteps*(1.0*value/self.sliderMax)))
-        idx = min(idx, numSteps-1)
-        x,y,theta = self.stateOverTime[idx]
+        self.playbackIdx = self.getPlaybackIndex(value)
+        x,y,theta = self.stateOverTime[self.playbackIdx]
         self.setRobotFrameState(x,y,theta)
         self.sliderMovedByPlayTimer = False
 
+    def getPlaybackIndex(self, value):
+        numSteps = self.getNumPlaybackSteps()
+        idx = int(np.floor(numSteps*(1.0*value/self.sliderMax)))
+        return min(idx, numSteps-1)
+
     def onPlayButton(self):
 
         if self.playTimer.isActive():
@@ -576,27 +950,73 @@ class Simulator(object):
         print 'pause'
         self.playTimer.stop()
 
+    @staticmethod
+    def getLogPath(filename):
+        return 'data/' + filename + ".log"
+
+    def startLog(self, filename):
+        # stream the next runBatchSimulation to a trajectory log as it runs,
+        # the log is finished and closed when the batch completes
+        self.log = TrajectoryLog.create(self.getLogPath(filename), metadata={'options': self.options})
+        self.addLogColumns(self.log)
+        self.loggedCounter = 0
+
+    def addLogColumns(self, log):
+        log.addColumn('stateOverTime', rowShape=(3,))
+        log.addColumn('raycastData', rowShape=(self.Sensor.numRays,))
+        log.addColumn('controlInputData')
+
+    def appendToLog(self, stopIdx):
+        # append the rows recorded since the last call, up to stopIdx
+        self.log.append('stateOverTime', self.stateOverTime[self.loggedCounter:stopIdx])
+        self.log.append('raycastData', self.raycastData[self.loggedCounter:stopIdx])
+        self.log.append('controlInputData', self.controlInputData[self.loggedCounter:stopIdx])
+        self.log.flush()
+        self.loggedCounter = stopIdx
+
+    def setLogMetadata(self, log):
+        log.setMetadata('simulationData', self.simulationData)
+        log.setMetadata('numTimesteps', self.numTimesteps)
+        log.setMetadata('idxDict', self.idxDict)
+        log.setMetadata('counter', self.counter)
+
     def saveToFile(self, filename):
 
         # should also save the run data if it is available, i.e. stateOverTime, rewardOverTime
 
-        filename = 'data/' + filename + ".out"
-        my_shelf = shelve.open(filename,'n')
+        log = TrajectoryLog.create(self.getLogPath(filename), metadata={'options': self.options})
+        self.addLogColumns(log)
+        log.append('stateOverTime', self.stateOverTime)
+        log.append('raycastData', self.raycastData)
+        log.append('controlInputData', self.controlInputData)
+        self.setLogMetadata(log)
+        log.close()
 
-        my_shelf['options'] = self.options
+    @staticmethod
+    def loadFromFile(filename):
+        # the arrays are memory mapped from the trajectory log, older shelve
+        # files are still read in full
+        if not os.path.isdir(Simulator.getLogPath(filename)):
+            return Simulator.loadFromShelveFile(filename)
 
-        my_shelf['simulationData'] = self.simulationData
-        my_shelf['stateOverTime'] = self.stateOverTime
-        my_shelf['raycastData'] = self.raycastData
-        my_shelf['controlInputData'] = self.controlInputData
-        my_shelf['numTimesteps'] = self.numTimesteps
-        my_shelf['idxDict'] = self.idxDict
-        my_shelf['counter'] = self.counter
-        my_shelf.close()
+        sim = Simulator(autoInitialize=False, verbose=False)
 
+        log = TrajectoryLog.open(Simulator.getLogPath(filename))
+        sim.options = log.metadata['options']
+        sim.initialize()
+
+        sim.simulationData = log.metadata['simulationData']
+        sim.stateOverTime = log.read('stateOverTime')
+        sim.raycastData = log.read('raycastData')
+        sim.controlInputData = log.read('controlInputData')
+        sim.numTimesteps = log.metadata['numTimesteps']
+        sim.idxDict = log.metadata['idxDict']
+        sim.counter = log.metadata['counter']
+
+        return sim
 
     @staticmethod
-    def loadFromFile(filename):
+    def loadFromShelveFile(filename):
         filename = 'data/' + filename + ".out"
         sim = Simulator(autoInitialize=False, verbose=False)
 
@@ -627,6 +1047,8 @@ if __name__ == "__main__":
     parser.add_argument('--nonRandomWorld', action='store_true', default=False)
     parser.add_argument('--circleRadius', type=float, nargs=1, default=0.7)
     parser.add_argument('--worldScale', type=float, nargs=1, default=1.0)
+    parser.add_argument('--background', action='store_true', default=False)
+    parser.add_argument('--profile', type=str, nargs='?', const='data/profile.json', default=None)
     
     argNamespace = parser.parse_args()
     percentObsDensity = argNamespace.percentObsDensity[0]
@@ -639,6 +1061,9 @@ if __name__ == "__main__":
     sim = Simulator(percentObsDensity=percentObsDensity, endTime=endTime, randomizeControl=randomizeControl,
                     nonRandomWorld=nonRandomWorld, circleRadius=circleRadius, worldScale=worldScale,
                     supervisedTrainingTime=supervisedTrainingTime)
-    sim.run()
+    if argNamespace.profile is not None:
+        sim.options['runTime']['profile'] = True
+        sim.options['runTime']['profileFilename'] = argNamespace.profile
+    sim.run(background=argNamespace.background)
 
 
@@ -200,44 +200,20 @@ class Simulator(object):
         x_trajectory_to_check = self.ActionSet.p_x_trajectories[traj_index[0]]
         y_trajectory_to_check = self.ActionSet.p_y_trajectories[traj_index[1]]
 
-
-        #check if anything is too close to the center of the circles
-        #print self.world.list_of_circles
-        for i in range(len(x_trajectory_to_check)):
-            point = ( x_trajectory_to_check[i], y_trajectory_to_check[i]  )
-            if not self.CheckIfCollisionFreePoint(point):
-                #print "trajectory wasn't free"
-                return False 
-
-
-        return True
+        # check every point of the trajectory at once
+        points = np.column_stack((np.ravel(x_trajectory_to_check), np.ravel(y_trajectory_to_check)))
+        return np.all(self.CheckIfCollisionFreePoints(points))
 
     def CheckIfCollisionFreePoint(self, point):
-
-        for circle_center in self.world.list_of_circles:
-            #print "circle centers first"
-            #print circle_center[0], circle_center[1]
-            #print self.circleRadius
-            #print point[0], point[1]
-            #print (circle_center[0] - point[0])**2 + (circle_center[1]-point[1])**2
-            if  ( (circle_center[0] - point[0])**2 + (circle_center[1]-point[1])**2 < self.circleRadius**2):
-                #print "I found a point in a circle"
-                return False
-
-        if point[0] > self.world.Xmax:
-            #print "I would have gone past top wall"
-            return False
-        if point[0] < self.world.Xmin:
-            #print "I would have gone below bottom wall"
-            return False
-        if point[1] > self.world.Ymax:
-            #print "I would have gone to the right of the side wall"
-            return False    
-        if point[1] < self.world.Ymin:
-            #print "I would have gone to the left of the side wall"
-            return False
-
-        return True
+        return self.CheckIfCollisionFreePoints(np.array([point[0:2]], dtype=float))[0]
+
+    def CheckIfCollisionFreePoints(self, points):
+        # points is an (N,2) array, true for the points that are outside every
+        # circle and inside the walls. Only the circles in the grid cells around
+        # each point are tested.
+        inBounds = ((points[:,0] <= self.world.Xmax) & (points[:,0] >= self.world.Xmin) &
+                    (points[:,1] <= self.world.Ymax) & (points[:,1] >= self.world.Ymin))
+        return inBounds & ~self.world.obstacles.pointsInCollision(points)
 
 
 
@@ -6,6 +6,8 @@ from director.debugVis import DebugData
 
 import numpy as np
 
+from obstacles import ObstacleTable
+
 from PythonQt import QtCore, QtGui
 
 class World(object):
@@ -184,6 +186,12 @@ class World(object):
         world.percentObsDensity = percentObsDensity
         world.list_of_circles = list_of_circles
 
+        # grid indexed copy of the circles for the collision checks
+        world.obstacles = ObstacleTable(numSides=None)
+        if len(list_of_circles) > 0:
+            world.obstacles.addCircles(list_of_circles, circleRadius)
+            world.obstacles.buildIndex()
+
         return world
 
     @staticmethod
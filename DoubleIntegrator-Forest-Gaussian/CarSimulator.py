@@ -170,61 +170,58 @@ class Simulator(object):
         x_trajectory_to_check = self.ActionSet.p_x_trajectories[traj_index[0]]
         y_trajectory_to_check = self.ActionSet.p_y_trajectories[traj_index[1]]
 
+        # check every point of the trajectory at once
+        points = np.column_stack((np.ravel(x_trajectory_to_check), np.ravel(y_trajectory_to_check)))
+        return np.all(self.CheckIfCollisionFreePoints(points))
 
-        #check if anything is too close to the center of the circles
-        #print self.world.list_of_circles
-        for i in range(len(x_trajectory_to_check)):
-            point = ( x_trajectory_to_check[i], y_trajectory_to_check[i]  )
-            if not self.CheckIfCollisionFreePoint(point):
-                #print "trajectory wasn't free"
-                return False 
+    def CheckIfCollisionFreePoint(self, point):
+        return self.CheckIfCollisionFreePoints(np.array([point[0:2]], dtype=float))[0]
 
+    def CheckIfCollisionFreePoints(self, points):
+        # points is an (N,2) array, true for the points that are outside every
+        # circle and inside the walls. Only the circles in the grid cells around
+        # each point are tested.
+        inBounds = ((points[:,0] <= self.world.Xmax) & (points[:,0] >= self.world.Xmin) &
+                    (points[:,1] <= self.world.Ymax) & (points[:,1] >= self.world.Ymin))
+        return inBounds & ~self.world.obstacles.pointsInCollision(points)
 
-        return True
+    def computeProbabilitiesOfCollisionAllTrajectories(self, currentRaycastIntersectionLocations, speed_allowed_matrix):
+        probability_tensor = self.computeProbabilityOfCollisionTensor(currentRaycastIntersectionLocations)
 
-    def CheckIfCollisionFreePoint(self, point):
+        # a trajectory is collision free only if it misses every obstacle at every step
+        probability_no_collision = np.prod(np.prod(1 - probability_tensor, axis=3), axis=2)
+        probability_matrix = 1.0 - probability_no_collision
+        probability_matrix[np.logical_not(speed_allowed_matrix)] = 1.0
 
-        for circle_center in self.world.list_of_circles:
-            #print "circle centers first"
-            #print circle_center[0], circle_center[1]
-            #print self.circleRadius
-            #print point[0], point[1]
-            #print (circle_center[0] - point[0])**2 + (circle_center[1]-point[1])**2
-            if  ( (circle_center[0] - point[0])**2 + (circle_center[1]-point[1])**2 < self.circleRadius**2):
-                #print "I found a point in a circle"
-                return False
-
-        if point[0] > self.world.Xmax:
-            #print "I would have gone past top wall"
-            return False
-        if point[0] < self.world.Xmin:
-            #print "I would have gone below bottom wall"
-            return False
-        if point[1] > self.world.Ymax:
-            #print "I would have gone to the right of the side wall"
-            return False    
-        if point[1] < self.world.Ymin:
-            #print "I would have gone to the left of the side wall"
-            return False
-
-        return True
+        indices_vector = [[x_index, y_index] for x_index in xrange(self.ActionSet.num_x_bins)
+                          for y_index in xrange(self.ActionSet.num_y_bins)]
 
-    def computeProbabilitiesOfCollisionAllTrajectories(self, currentRaycastIntersectionLocations, speed_allowed_matrix):
-        probability_vector = []
-        indices_vector = []
-        for x_index in xrange(self.ActionSet.num_x_bins):
-            for y_index in xrange(self.ActionSet.num_y_bins):
-                if not speed_allowed_matrix[x_index, y_index]:
-                    probability_vector.append(1.0)
+        return probability_matrix.ravel(), indices_vector
 
-                else:
-                    probability_of_collision = self.computeProbabilityOfCollisionOneTrajectory(x_index, y_index, currentRaycastIntersectionLocations)
-                    probability_vector.append(probability_of_collision)
+    def computeProbabilityOfCollisionTensor(self, currentRaycastIntersectionLocations):
+        # same as computeProbabilityOfCollisionOneStepOneObstacle for every
+        # (x action, y action, time step, obstacle) at once, returns an array of
+        # shape (num_x_bins, num_y_bins, numPointsToDraw, numObstacles). The
+        # covariance is diagonal and only depends on the time step, so the
+        # Mahalanobis distance separates into x, y and z terms.
+        volume = 4.18
+        obstacle_centers = np.array(currentRaycastIntersectionLocations, dtype=float).reshape(-1,3)
+        t = self.ActionSet.t_vector
 
-                indices_vector.append([x_index, y_index])
+        variance_x = (2.5 + abs(self.current_initial_velocity_x*0.1))*t+0.01
+        variance_y = (2.5 + abs(self.current_initial_velocity_y*0.1))*t+0.01
+        variance_z = (1.5)*t+0.01
 
-        return np.array(probability_vector), indices_vector
-        
+        denominator = np.sqrt((2*np.pi)**3 * variance_x * variance_y * variance_z)
+
+        x = self.ActionSet.p_x_trajectories[:,:,np.newaxis]
+        y = self.ActionSet.p_y_trajectories[:,:,np.newaxis]
+        exponent_x = (x - obstacle_centers[:,0])**2 / variance_x[:,np.newaxis]
+        exponent_y = (y - obstacle_centers[:,1])**2 / variance_y[:,np.newaxis]
+        exponent_z = obstacle_centers[:,2]**2 / variance_z[:,np.newaxis]
+
+        exponent = -0.5 * (exponent_x[:,np.newaxis] + exponent_y[np.newaxis,:] + exponent_z)
+        return volume / denominator[:,np.newaxis] * np.exp(exponent)
 
     def computeProbabilityOfCollisionOneTrajectory(self, x_index, y_index, currentRaycastIntersectionLocations):
         probability_no_collision = 1
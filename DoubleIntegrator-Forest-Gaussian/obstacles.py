@@ -0,0 +1,602 @@
+import numpy as np
+
+
+class ObstacleTable(object):
+
+    # Analytic copy of the obstacles in a world, kept alongside the VTK mesh so
+    # sensors can raycast in numpy instead of going through a vtkCellLocator.
+    #
+    # circles  - (N,3) array of [x, y, radius] for vertical cylinders
+    # segments - (K,4) array of [x1, y1, x2, y2] zero thickness walls
+    # tubes    - (T,5) array of [x1, y1, x2, y2, radius] for the thick walls
+    #            added through addThickSegment, kept so the mesh can be rebuilt
+    #
+    # Everything lives in the z=0 plane the car drives in. Cylinders built with
+    # DebugData.addLine(radius=r) are tessellated by vtkTubeFilter into 24-gons
+    # with vertices at multiples of 15 degrees, so by default circles are
+    # intersected as that same polygon to reproduce the locator distances.
+    # Set numSides=None to intersect against exact circles instead.
+    #
+    # buildIndex puts the circles in a uniform grid so that raycasts and the
+    # collision and nearest obstacle queries only touch nearby cells, which
+    # keeps them independent of the total number of circles.
+
+    def __init__(self, circles=None, segments=None, numSides=24):
+        self.numSides = numSides
+        self.circles = np.zeros((0,3))
+        self.segments = np.zeros((0,4))
+        self.tubes = np.zeros((0,5))
+        self.gridStarts = None
+
+        if circles is not None:
+            self.circles = np.array(circles, dtype=float).reshape(-1,3)
+
+        if segments is not None:
+            self.segments = np.array(segments, dtype=float).reshape(-1,4)
+
+        self.initializePolygonPlanes()
+
+    def initializePolygonPlanes(self):
+        if self.numSides is None:
+            return
+
+        # outward normals of the polygon edges, and the distance from the
+        # center to each edge as a fraction of the circumradius
+        edgeAngles = (np.arange(self.numSides) + 0.5) * 2*np.pi/self.numSides
+        self.polygonNormals = np.vstack((np.cos(edgeAngles), np.sin(edgeAngles))).T
+        self.polygonApothem = np.cos(np.pi/self.numSides)
+
+    @property
+    def numCircles(self):
+        return len(self.circles)
+
+    @property
+    def numSegments(self):
+        return len(self.segments)
+
+    def addCircle(self, x, y, radius):
+        self.circles = np.vstack((self.circles, [x, y, radius]))
+        self.gridStarts = None
+
+    def addCircles(self, centers, radii):
+        centers = np.array(centers, dtype=float).reshape(-1,2)
+        radii = np.ones(len(centers)) * radii
+        self.circles = np.vstack((self.circles, np.column_stack((centers, radii))))
+        self.gridStarts = None
+
+    def addSegment(self, firstEndpt, secondEndpt):
+        self.segments = np.vstack((self.segments, [firstEndpt[0], firstEndpt[1], secondEndpt[0], secondEndpt[1]]))
+
+    def addThickSegment(self, firstEndpt, secondEndpt, radius):
+        # a capped tube lying in the z=0 plane has a rectangular cross section
+        # of half width radius, so store the four edges of that rectangle
+        p1 = np.array(firstEndpt[0:2], dtype=float)
+        p2 = np.array(secondEndpt[0:2], dtype=float)
+        direction = p2 - p1
+        length = np.linalg.norm(direction)
+        if length == 0:
+            return
+
+        normal = np.array([-direction[1], direction[0]]) / length * radius
+        corners = np.array([p1 + normal, p2 + normal, p2 - normal, p1 - normal])
+        edges = np.hstack((corners, np.roll(corners, -1, axis=0)))
+        self.segments = np.vstack((self.segments, edges))
+        self.tubes = np.vstack((self.tubes, [p1[0], p1[1], p2[0], p2[1], radius]))
+
+    def buildIndex(self, cellSize=None):
+        # Uniform grid over the circles, each circle is listed in every cell
+        # its bounding box overlaps. The circles of cell k = ix*gridShape[1] + iy
+        # are gridCircles[gridStarts[k]:gridStarts[k+1]]. The default cell
+        # size holds about one circle per cell.
+        if self.numCircles == 0:
+            self.gridStarts = None
+            return
+
+        centers = self.circles[:,0:2]
+        radii = self.circles[:,2]
+        lower = np.min(centers - radii[:,np.newaxis], axis=0)
+        upper = np.max(centers + radii[:,np.newaxis], axis=0)
+        if cellSize is None:
+            area = np.prod(np.maximum(upper - lower, 1e-6))
+            cellSize = max(2*np.max(radii), np.sqrt(area/self.numCircles))
+
+        self.gridCellSize = float(cellSize)
+        self.gridOrigin = lower
+        self.gridShape = (np.floor((upper - lower)/self.gridCellSize) + 1).astype(int)
+
+        queries, cells = self.cellsInBoxes(centers - radii[:,np.newaxis], centers + radii[:,np.newaxis])
+        order = np.argsort(cells, kind='mergesort')
+        self.gridCircles = queries[order]
+        self.gridStarts = np.searchsorted(cells[order], np.arange(np.prod(self.gridShape) + 1))
+
+    def cellsInBoxes(self, lower, upper):
+        # (queryIdx, cellIdx) pairs for the grid cells overlapping each of the
+        # (N,2) boxes [lower, upper]
+        first = np.floor((lower - self.gridOrigin)/self.gridCellSize).astype(int)
+        last = np.floor((upper - self.gridOrigin)/self.gridCellSize).astype(int)
+        outside = np.any((last < 0) | (first >= self.gridShape), axis=1)
+        first = np.clip(first, 0, self.gridShape - 1)
+        last = np.clip(last, 0, self.gridShape - 1)
+
+        size = last - first + 1
+        numCells = size[:,0]*size[:,1]
+        numCells[outside] = 0
+        queries = np.repeat(np.arange(len(lower)), numCells)
+        local = np.arange(np.sum(numCells)) - np.repeat(np.cumsum(numCells) - numCells, numCells)
+        cellX = first[queries,0] + local // size[queries,1]
+        cellY = first[queries,1] + local % size[queries,1]
+        return queries, cellX*self.gridShape[1] + cellY
+
+    def circlesInBoxes(self, lower, upper):
+        # (queryIdx, circleIdx) pairs for every circle listed in a grid cell
+        # overlapping each of the (N,2) boxes [lower, upper]. This includes
+        # every circle whose bounding box overlaps the box, and a circle can
+        # appear more than once for the same query.
+        if self.gridStarts is None:
+            self.buildIndex()
+        if self.gridStarts is None:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        queries, cells = self.cellsInBoxes(np.atleast_2d(lower), np.atleast_2d(upper))
+        counts = self.gridStarts[cells+1] - self.gridStarts[cells]
+        pairQueries = np.repeat(queries, counts)
+        local = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return pairQueries, self.gridCircles[np.repeat(self.gridStarts[cells], counts) + local]
+
+    def pointsInCollision(self, points, clearance=0.0):
+        # true for each of the (N,2) points that is within clearance of an
+        # obstacle, i.e. strictly inside a circle or thick wall inflated by
+        # clearance
+        points = np.atleast_2d(points)[:,0:2]
+        inCollision = np.zeros(len(points), dtype=bool)
+
+        if self.numCircles > 0:
+            queries, circles = self.circlesInBoxes(points - clearance, points + clearance)
+            delta = points[queries] - self.circles[circles,0:2]
+            hit = np.sum(delta**2, axis=1) < (self.circles[circles,2] + clearance)**2
+            inCollision[queries[hit]] = True
+
+        if len(self.tubes) > 0:
+            distances = self.pointSegmentDistances(points, self.tubes[:,0:4])
+            inCollision |= np.any(distances < self.tubes[:,4] + clearance, axis=1)
+
+        if clearance > 0 and self.numSegments > 0:
+            inCollision |= np.any(self.pointSegmentDistances(points, self.segments) < clearance, axis=1)
+
+        return inCollision
+
+    def segmentsInCollision(self, starts, ends, clearance=0.0):
+        # true for each of the segments starts[i] -> ends[i] that passes within
+        # clearance of an obstacle, e.g. the steps of a trajectory
+        starts = np.atleast_2d(starts)[:,0:2]
+        ends = np.atleast_2d(ends)[:,0:2]
+        inCollision = np.zeros(len(starts), dtype=bool)
+
+        if self.numCircles > 0:
+            lower = np.minimum(starts, ends) - clearance
+            upper = np.maximum(starts, ends) + clearance
+            queries, circles = self.circlesInBoxes(lower, upper)
+            distances = self.pointSegmentDistances(self.circles[circles,0:2], np.hstack((starts[queries], ends[queries])),
+                                                   pairwise=True)
+            hit = distances < self.circles[circles,2] + clearance
+            inCollision[queries[hit]] = True
+
+        if len(self.tubes) > 0:
+            distances = self.segmentSegmentDistances(starts, ends, self.tubes[:,0:4])
+            inCollision |= np.any(distances < self.tubes[:,4] + clearance, axis=1)
+
+        if self.numSegments > 0:
+            distances = self.segmentSegmentDistances(starts, ends, self.segments)
+            inCollision |= np.any(distances <= clearance, axis=1)
+
+        return inCollision
+
+    def nearestCircles(self, points, k=1):
+        # distances from each of the (N,2) points to the surfaces of its k
+        # nearest circles (negative inside a circle) and the indices of those
+        # circles, both (N,k). The search box around each point grows until
+        # nothing outside it can be closer than the k-th circle found.
+        points = np.atleast_2d(points)[:,0:2]
+        numPoints = len(points)
+        k = min(k, self.numCircles)
+        distances = np.ones((numPoints, k))*np.inf
+        indices = np.zeros((numPoints, k), dtype=int)
+        if k == 0:
+            return distances, indices
+
+        if self.gridStarts is None:
+            self.buildIndex()
+        maxRadius = np.max(self.circles[:,2])
+        gridSize = np.max(self.gridShape)*self.gridCellSize
+        halfWidth = self.gridCellSize*np.ones(numPoints)
+        remaining = np.arange(numPoints)
+
+        while len(remaining) > 0:
+            queries, circles = self.circlesInBoxes(points[remaining] - halfWidth[remaining,np.newaxis],
+                                                   points[remaining] + halfWidth[remaining,np.newaxis])
+
+            # drop duplicates then sort each query's candidates by distance
+            keys = np.unique(queries*self.numCircles + circles)
+            queries = keys // self.numCircles
+            circles = keys % self.numCircles
+            candidateDistances = (np.sqrt(np.sum((points[remaining[queries]] - self.circles[circles,0:2])**2, axis=1)) -
+                                  self.circles[circles,2])
+            order = np.lexsort((candidateDistances, queries))
+            queries = queries[order]
+            circles = circles[order]
+            candidateDistances = candidateDistances[order]
+
+            counts = np.bincount(queries, minlength=len(remaining))
+            firsts = np.cumsum(counts) - counts
+            rank = np.arange(len(queries)) - firsts[queries]
+            best = rank < k
+            distances[remaining[queries[best]], rank[best]] = candidateDistances[best]
+            indices[remaining[queries[best]], rank[best]] = circles[best]
+
+            # a circle outside the box has its center at least halfWidth away
+            kthDistance = distances[remaining, k-1]
+            done = (kthDistance <= halfWidth[remaining] - maxRadius) | (halfWidth[remaining] >= gridSize)
+            remaining = remaining[~done]
+            halfWidth[remaining] *= 2
+
+        return distances, indices
+
+    @staticmethod
+    def pointSegmentDistances(points, segments, pairwise=False):
+        # distances from the (N,2) points to the (K,4) segments [x1,y1,x2,y2],
+        # an (N,K) array, or (N,) for pairwise point/segment distances
+        if not pairwise:
+            points = points[:,np.newaxis,:]
+            segments = segments[np.newaxis,:,:]
+        ex = segments[...,2] - segments[...,0]
+        ey = segments[...,3] - segments[...,1]
+        wx = points[...,0] - segments[...,0]
+        wy = points[...,1] - segments[...,1]
+        lengthSquared = ex**2 + ey**2
+        u = np.clip((wx*ex + wy*ey) / np.where(lengthSquared > 0, lengthSquared, 1.0), 0.0, 1.0)
+        return np.sqrt((wx - u*ex)**2 + (wy - u*ey)**2)
+
+    @staticmethod
+    def segmentSegmentDistances(starts, ends, segments):
+        # (N,K) distances between the segments starts -> ends and the (K,4)
+        # segments, zero where they cross
+        queries = np.hstack((starts, ends))
+        distances = np.minimum(ObstacleTable.pointSegmentDistances(starts, segments),
+                               ObstacleTable.pointSegmentDistances(ends, segments))
+        distances = np.minimum(distances, ObstacleTable.pointSegmentDistances(segments[:,0:2], queries).T)
+        distances = np.minimum(distances, ObstacleTable.pointSegmentDistances(segments[:,2:4], queries).T)
+
+        # proper crossings
+        dx = (ends[:,0] - starts[:,0])[:,np.newaxis]
+        dy = (ends[:,1] - starts[:,1])[:,np.newaxis]
+        ex = segments[:,2] - segments[:,0]
+        ey = segments[:,3] - segments[:,1]
+        wx = segments[:,0] - starts[:,0:1]
+        wy = segments[:,1] - starts[:,1:2]
+        denom = dx*ey - dy*ex
+        parallel = denom == 0
+        denom = np.where(parallel, 1.0, denom)
+        t = (wx*ey - wy*ex) / denom
+        u = (wx*dy - wy*dx) / denom
+        crossing = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        distances[crossing] = 0.0
+        return distances
+
+    def raycast(self, origins, directions, rayLength):
+        # origins and directions are (numRays,2) or (numRays,3) arrays, the
+        # directions must be unit length. Returns the distance along each ray
+        # to the first obstacle, or rayLength if nothing is hit.
+        origins = np.atleast_2d(origins)[:,0:2]
+        directions = np.atleast_2d(directions)[:,0:2]
+
+        distances = np.ones(len(origins)) * rayLength
+
+        if self.numCircles > 0:
+            circles = self.circlesNearRays(origins, directions, rayLength)
+            if len(circles) > 0:
+                distances = np.minimum(distances, self.raycastCircles(origins, directions, rayLength, circles))
+
+        if self.numSegments > 0:
+            segments = self.segmentsNearRays(origins, directions, rayLength)
+            if len(segments) > 0:
+                distances = np.minimum(distances, self.raycastSegments(origins, directions, rayLength, segments))
+
+        return distances
+
+    def raycastFans(self, poses, angles, rayLength):
+        # Raycast a fan of rays from each of a batch of poses. poses is an
+        # (N,3) array of [x, y, theta] and angles the evenly spaced ray angles
+        # in the sensor frame, a ray at angle a points along theta - a as in
+        # SensorObj.rays. Returns an (N,numRays) array of distances.
+        poses = np.atleast_2d(poses)
+        numPoses = len(poses)
+        numRays = len(angles)
+        distances = np.ones((numPoses, numRays)) * rayLength
+
+        # a single ray has no angle step to index the fan by
+        if numRays == 1:
+            worldAngles = poses[:,2] - angles[0]
+            directions = np.column_stack((np.cos(worldAngles), np.sin(worldAngles)))
+            return self.raycast(poses[:,0:2], directions, rayLength).reshape(numPoses, 1)
+
+        if self.numCircles > 0:
+            distances = np.minimum(distances, self.raycastFansCircles(poses, angles, rayLength))
+
+        if self.numSegments > 0:
+            worldAngles = poses[:,2:3] - angles
+            origins = np.repeat(poses[:,0:2], numRays, axis=0)
+            directions = np.column_stack((np.cos(worldAngles).ravel(), np.sin(worldAngles).ravel()))
+            segments = self.segmentsNearRays(origins, directions, rayLength)
+            if len(segments) > 0:
+                t = self.raycastSegments(origins, directions, rayLength, segments)
+                distances = np.minimum(distances, t.reshape(numPoses, numRays))
+
+        return distances
+
+    def raycastFansCircles(self, poses, angles, rayLength):
+        numPoses = len(poses)
+        numRays = len(angles)
+        angleMin = angles[0]
+        angleStep = (angles[-1] - angles[0]) / max(numRays - 1, 1)
+
+        # (pose, circle) pairs within reach of the pose, from the grid cells
+        # around each pose if the index has been built
+        if self.gridStarts is not None:
+            poseIdx, circleIdx = self.circlesInBoxes(poses[:,0:2] - rayLength, poses[:,0:2] + rayLength)
+            keys = np.unique(poseIdx*self.numCircles + circleIdx)
+            poseIdx = keys // self.numCircles
+            circleIdx = keys % self.numCircles
+            deltaX = self.circles[circleIdx,0] - poses[poseIdx,0]
+            deltaY = self.circles[circleIdx,1] - poses[poseIdx,1]
+            distSquared = deltaX**2 + deltaY**2
+            reach = np.flatnonzero(distSquared <= (rayLength + self.circles[circleIdx,2])**2)
+            poseIdx = poseIdx[reach]
+            circleIdx = circleIdx[reach]
+            deltaX = deltaX[reach]
+            deltaY = deltaY[reach]
+            distSquared = distSquared[reach]
+        else:
+            deltaX = self.circles[:,0] - poses[:,0:1]
+            deltaY = self.circles[:,1] - poses[:,1:2]
+            distSquared = deltaX**2 + deltaY**2
+            poseIdx, circleIdx = np.nonzero(distSquared <= (rayLength + self.circles[:,2])**2)
+            deltaX = deltaX[poseIdx, circleIdx]
+            deltaY = deltaY[poseIdx, circleIdx]
+            distSquared = distSquared[poseIdx, circleIdx]
+
+        if len(poseIdx) == 0:
+            return np.ones((numPoses, numRays)) * rayLength
+
+        radii = self.circles[circleIdx,2]
+
+        # each circle only covers the rays within its angular radius of its
+        # bearing, so only those (pose, circle, ray) triples are expanded. A
+        # pose inside the circumcircle gets every ray.
+        ratio = radii / np.maximum(np.sqrt(distSquared), 1e-12)
+        inside = ratio >= 1
+        angularRadius = np.arcsin(np.minimum(ratio, 1.0)) + 1e-9
+        bearing = poses[poseIdx,2] - np.arctan2(deltaY, deltaX)
+        bearing = (bearing + np.pi) % (2*np.pi) - np.pi
+
+        firstRays = []
+        lastRays = []
+        pairs = []
+        for wrap in (-2*np.pi, 0.0, 2*np.pi):
+            first = np.ceil((bearing + wrap - angularRadius - angleMin)/angleStep - 1e-9).astype(int)
+            last = np.floor((bearing + wrap + angularRadius - angleMin)/angleStep + 1e-9).astype(int)
+            if wrap == 0.0:
+                first[inside] = 0
+                last[inside] = numRays - 1
+            else:
+                first[inside] = numRays
+            first = np.maximum(first, 0)
+            last = np.minimum(last, numRays - 1)
+            keep = np.flatnonzero(first <= last)
+            firstRays.append(first[keep])
+            lastRays.append(last[keep])
+            pairs.append(keep)
+
+        firstRays = np.concatenate(firstRays)
+        pairs = np.concatenate(pairs)
+        counts = np.concatenate(lastRays) - firstRays + 1
+        offsets = np.cumsum(counts) - counts
+
+        pair = np.repeat(pairs, counts)
+        rayIdx = np.repeat(firstRays - offsets, counts) + np.arange(np.sum(counts))
+        rayPose = poseIdx[pair]
+        keys = rayPose*numRays + rayIdx
+
+        worldAngles = poses[rayPose,2] - angles[rayIdx]
+        directionsX = np.cos(worldAngles)
+        directionsY = np.sin(worldAngles)
+        along = directionsX*deltaX[pair] + directionsY*deltaY[pair]
+        acrossSquared = (directionsX*deltaY[pair] - directionsY*deltaX[pair])**2
+
+        # same circumcircle test and inscribed circle pruning as raycastCircles
+        radiusSquared = radii[pair]**2
+        disc = radiusSquared - acrossSquared
+        sqrtDisc = np.sqrt(np.maximum(disc, 0.0))
+        tEnter = along - sqrtDisc
+        tExit = along + sqrtDisc
+        hit = (disc >= 0) & (tExit >= 0) & (tEnter <= rayLength)
+
+        if self.numSides is None:
+            t = self.firstHit(tEnter, tExit, hit, rayLength)
+            return self.groupMin(keys, t, numPoses*numRays, rayLength).reshape(numPoses, numRays)
+
+        discInner = radiusSquared*self.polygonApothem**2 - acrossSquared
+        sqrtDiscInner = np.sqrt(np.maximum(discInner, 0.0))
+        hitInner = hit & (discInner >= 0) & (along + sqrtDiscInner >= 0)
+        upper = np.where(tEnter >= 0, along - sqrtDiscInner, tExit)
+        upper[~hitInner] = rayLength
+        bestUpper = self.groupMin(keys, upper, numPoses*numRays, rayLength)
+        hit &= tEnter <= bestUpper[keys]
+
+        hitIdx = np.flatnonzero(hit)
+        origins = poses[rayPose[hitIdx],0:2]
+        directions = np.column_stack((directionsX[hitIdx], directionsY[hitIdx]))
+        t = self.raycastPolygons(origins, directions, self.circles[circleIdx[pair[hitIdx]]], rayLength)
+        return self.groupMin(keys[hitIdx], t, numPoses*numRays, rayLength).reshape(numPoses, numRays)
+
+    @staticmethod
+    def groupMin(keys, values, size, fill):
+        # out[k] = min of the values with key k, or fill if there are none
+        out = np.ones(size) * fill
+        if len(keys) == 0:
+            return out
+
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        out[keys[starts]] = np.minimum.reduceat(values[order], starts)
+        return out
+
+    def circlesNearRays(self, origins, directions, rayLength):
+        centers = self.circles[:,0:2]
+        radii = self.circles[:,2]
+
+        # a single sensor only needs the circles within reach of its origin
+        # that overlap the angular sector swept by its rays
+        if np.all(origins == origins[0]):
+            if self.gridStarts is not None:
+                queryIdx, circleIdx = self.circlesInBoxes(origins[0:1,0:2] - rayLength, origins[0:1,0:2] + rayLength)
+                circleIdx = np.unique(circleIdx)
+                centers = centers[circleIdx]
+                radii = radii[circleIdx]
+
+            delta = centers - origins[0,0:2]
+            distSquared = delta[:,0]**2 + delta[:,1]**2
+            mask = distSquared <= (rayLength + radii)**2
+            circles = np.column_stack((centers, radii))[mask]
+
+            heading = np.sum(directions, axis=0)
+            headingNorm = np.linalg.norm(heading)
+            if headingNorm == 0:
+                return circles
+            heading = heading / headingNorm
+            rayAngles = np.arctan2(directions[:,1]*heading[0] - directions[:,0]*heading[1],
+                                   np.dot(directions, heading))
+            halfWidth = np.max(np.abs(rayAngles))
+            if halfWidth >= np.pi/2:
+                return circles
+
+            delta = delta[mask]
+            dist = np.sqrt(distSquared[mask])
+            circleAngles = np.arctan2(delta[:,1]*heading[0] - delta[:,0]*heading[1], np.dot(delta, heading))
+            # keep every circle the sensor is inside of, whatever its bearing
+            ratio = circles[:,2] / np.maximum(dist, 1e-12)
+            angularRadius = np.where(ratio < 1, np.arcsin(np.minimum(ratio, 1.0)), np.pi)
+            return circles[np.abs(circleAngles) <= halfWidth + angularRadius]
+
+        # otherwise cull to the bounding box of all the rays
+        endpoints = origins + directions*rayLength
+        lower = np.minimum(origins.min(axis=0), endpoints.min(axis=0))
+        upper = np.maximum(origins.max(axis=0), endpoints.max(axis=0))
+        mask = np.all((centers + radii[:,np.newaxis] >= lower) & (centers - radii[:,np.newaxis] <= upper), axis=1)
+        return self.circles[mask]
+
+    def segmentsNearRays(self, origins, directions, rayLength):
+        endpoints = origins + directions*rayLength
+        lower = np.minimum(origins.min(axis=0), endpoints.min(axis=0))
+        upper = np.maximum(origins.max(axis=0), endpoints.max(axis=0))
+
+        segments = self.segments
+        mask = ((np.maximum(segments[:,0], segments[:,2]) >= lower[0]) &
+                (np.minimum(segments[:,0], segments[:,2]) <= upper[0]) &
+                (np.maximum(segments[:,1], segments[:,3]) >= lower[1]) &
+                (np.minimum(segments[:,1], segments[:,3]) <= upper[1]))
+        return segments[mask]
+
+    def raycastCircles(self, origins, directions, rayLength, circles):
+        # (numRays, numCircles) arrays of the ray parameters where each ray
+        # enters and leaves the circumscribed circle of each obstacle. The
+        # center of each circle is split into components along and across each
+        # ray, which is two matrix products for the whole batch.
+        normals = np.column_stack((-directions[:,1], directions[:,0]))
+        centers = circles[:,0:2].T
+        along = np.dot(directions, centers) - np.sum(origins*directions, axis=1)[:,np.newaxis]
+        acrossSquared = (np.dot(normals, centers) - np.sum(origins*normals, axis=1)[:,np.newaxis])**2
+
+        radiusSquared = circles[:,2]**2
+        disc = radiusSquared - acrossSquared
+        hit = disc >= 0
+        sqrtDisc = np.sqrt(np.maximum(disc, 0.0))
+        tEnter = along - sqrtDisc
+        tExit = along + sqrtDisc
+        hit &= (tExit >= 0) & (tEnter <= rayLength)
+
+        if self.numSides is None:
+            return self.firstHit(tEnter, tExit, hit, rayLength)
+
+        # The polygon lies between its inscribed and circumscribed circles. For
+        # a ray that passes through the inscribed circle, the polygon hit comes
+        # no later than entering the inscribed circle (or leaving the outer
+        # circle if the ray starts inside it), and no earlier than entering the
+        # outer circle. Only the pairs that can beat the best upper bound along
+        # their ray get clipped against the polygon itself.
+        discInner = radiusSquared*self.polygonApothem**2 - acrossSquared
+        sqrtDiscInner = np.sqrt(np.maximum(discInner, 0.0))
+        hitInner = hit & (discInner >= 0) & (along + sqrtDiscInner >= 0)
+        upper = np.where(tEnter >= 0, along - sqrtDiscInner, tExit)
+        upper[~hitInner] = rayLength
+        bestUpper = np.min(upper, axis=1)
+        hit &= tEnter <= bestUpper[:,np.newaxis]
+
+        rayIdx, circleIdx = np.nonzero(hit)
+        t = np.ones(np.shape(hit)) * rayLength
+        if len(rayIdx) > 0:
+            t[rayIdx, circleIdx] = self.raycastPolygons(origins[rayIdx], directions[rayIdx],
+                                                        circles[circleIdx], rayLength)
+
+        return np.min(t, axis=1)
+
+    def raycastPolygons(self, origins, directions, circles, rayLength):
+        # clip ray k against the half planes n.x <= apothem*r of polygon k
+        # (Cyrus-Beck), the arrays are (numPairs, numSides)
+        normals = self.polygonNormals
+        num = circles[:,2:3]*self.polygonApothem + np.dot(circles[:,0:2] - origins, normals.T)
+        denom = np.dot(directions, normals.T)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tPlane = num / denom
+
+        tEnter = np.max(np.where(denom < 0, tPlane, -np.inf), axis=1)
+        tExit = np.min(np.where(denom > 0, tPlane, np.inf), axis=1)
+
+        # a ray parallel to an edge and outside of it can't hit the polygon
+        parallelMiss = np.any((denom == 0) & (num < 0), axis=1)
+        hit = (tEnter <= tExit) & ~parallelMiss
+
+        return self.firstHit(tEnter, tExit, hit, rayLength)
+
+    @staticmethod
+    def firstHit(tEnter, tExit, hit, rayLength):
+        # if the ray starts inside an obstacle the locator reports the wall
+        # it leaves through, so fall back to the exit distance in that case
+        t = np.where(tEnter >= 0, tEnter, tExit)
+        valid = hit & (t >= 0) & (t <= rayLength)
+        t = np.where(valid, t, rayLength)
+        if t.ndim > 1:
+            t = np.min(t, axis=1)
+        return t
+
+    @staticmethod
+    def raycastSegments(origins, directions, rayLength, segments):
+        # solve o + t*d = a + u*(b - a) for every (ray, segment) pair
+        ex = segments[:,2] - segments[:,0]
+        ey = segments[:,3] - segments[:,1]
+        dx = directions[:,0:1]
+        dy = directions[:,1:2]
+        wx = segments[:,0] - origins[:,0:1]
+        wy = segments[:,1] - origins[:,1:2]
+
+        denom = dx*ey - dy*ex
+        parallel = denom == 0
+        denom[parallel] = 1.0
+
+        t = (wx*ey - wy*ex) / denom
+        u = (wx*dy - wy*dx) / denom
+
+        valid = ~parallel & (t >= 0) & (t <= rayLength) & (u >= 0) & (u <= 1)
+        t[~valid] = rayLength
+        return np.min(t, axis=1)
@@ -0,0 +1,271 @@
+import numpy as np
+import argparse
+import json
+import os
+import subprocess
+import time
+
+from YTapeGenerator import YTapeGenerator
+from segmentRaycaster import SegmentRaycaster
+
+
+class BatchYTapeGenerator(YTapeGenerator):
+
+    # Same rollouts as YTapeGenerator.GenerateYTape, but for a (K,numRays)
+    # batch of initial scans at once. Each rollout gets its own line segment
+    # world built from its initial scan, and all K are stepped together: one
+    # batched controller evaluation, one closed form dynamics update and one
+    # raycast of every rollout against its own world per step.
+    #
+    # The yaw rate is held constant over each step, so the unicycle is
+    # integrated exactly along a circular arc instead of through odeint.
+
+    def __init__(self, FOV=90.0, numRays=21, rayLength=20, dt=0.05):
+        YTapeGenerator.__init__(self, FOV=FOV, numRays=numRays, rayLength=rayLength)
+        self.dt = dt
+
+    def GenerateYTapes(self, initial_distances):
+        initial_distances = np.atleast_2d(initial_distances)
+        numTapes = len(initial_distances)
+
+        YTapes = np.zeros((numTapes, self.numSteps+1, self.numRays))
+        segments = self.buildLineSegmentWorlds(initial_distances)
+
+        laser_distances = initial_distances
+        YTapes[:,0,:] = laser_distances
+        states = np.tile(np.array(self.initial_state[0:3], dtype=float), (numTapes,1))
+
+        for step in range(0,self.numSteps):
+            control_inputs = self.ComputeControlInputs(laser_distances)
+            states = self.simulateOneStepBatch(states, control_inputs)
+            laser_distances = SegmentRaycaster.raycastWorlds(states, self.rays, self.rayLength, segments)
+            YTapes[:,1+step,:] = laser_distances
+
+        return YTapes
+
+    def buildLineSegmentWorlds(self, initial_distances):
+        # (K,numRays+1,4) segments, the batched version of
+        # invertRaycastsToLocations followed by setLineSegmentWorld
+        numTapes = len(initial_distances)
+        endpoints = np.zeros((numTapes, self.numRays+2, 2))
+        endpoints[:,0,:] = [-0.4, 0.0]
+        endpoints[:,-1,:] = [-0.4, 0.0]
+        endpoints[:,1:-1,0] = self.initial_state[0] + self.rays[0,:]*initial_distances
+        endpoints[:,1:-1,1] = self.initial_state[1] + self.rays[1,:]*initial_distances
+
+        return np.concatenate((endpoints[:,:-1,:], endpoints[:,1:,:]), axis=2)
+
+    def ComputeControlInputs(self, laser_distances):
+        # countInverseDistancesController for every row
+        midpoint = int(np.floor(self.numRays/2.0))
+        numLeft = np.sum((1.0/laser_distances[:,0:midpoint])**2, axis=1)
+        numRight = np.sum((1.0/laser_distances[:,midpoint:])**2, axis=1)
+
+        return np.where(numLeft >= numRight, -self.u_max, self.u_max)
+
+    def simulateOneStepBatch(self, states, control_inputs):
+        # the chord of the arc has length v*dt*sinc(u*dt/2) and points along
+        # the heading at the middle of the step
+        dtheta = control_inputs*self.dt
+        chord = self.v*self.dt*np.sinc(dtheta/(2*np.pi))
+        midTheta = states[:,2] + dtheta/2
+
+        newStates = np.zeros_like(states)
+        newStates[:,0] = states[:,0] + chord*np.cos(midTheta)
+        newStates[:,1] = states[:,1] + chord*np.sin(midTheta)
+        newStates[:,2] = states[:,2] + dtheta
+        return newStates
+
+    def getParameters(self):
+        parameters = dict()
+        parameters['numSteps'] = self.numSteps
+        parameters['numRays'] = self.numRays
+        parameters['rayLength'] = self.rayLength
+        parameters['angleMin'] = self.angleMin
+        parameters['angleMax'] = self.angleMax
+        parameters['initial_state'] = list(self.initial_state)
+        parameters['u_max'] = self.u_max
+        parameters['v'] = self.v
+        parameters['dt'] = self.dt
+        parameters['controller'] = 'countInverseDistancesController'
+        parameters['integrator'] = 'exact'
+        return parameters
+
+
+class YTapeDataset(object):
+
+    # A directory of .npy shards of shape (shardSize, numSteps+1, numRays)
+    # plus a metadata.json with the generator parameters, the seed, the code
+    # revision and the shard list. Shards are written through memory maps
+    # and read back with mmap_mode='r', so a dataset of millions of tapes
+    # never has to fit in memory.
+    #
+    #   dataset = YTapeDataset.create('../data/ytapes', tapeShape, metadata)
+    #   dataset.append(tapes)
+    #   dataset.close()
+    #
+    #   dataset = YTapeDataset.open('../data/ytapes')
+    #   tapes = dataset.getTapes(0, 1000)
+
+    metadataFilename = 'metadata.json'
+
+    def __init__(self, path, tapeShape, shardSize, dtype, metadata=None):
+        self.path = path
+        self.tapeShape = tuple(tapeShape)
+        self.shardSize = shardSize
+        self.dtype = np.dtype(dtype)
+        self.metadata = dict() if metadata is None else metadata
+        self.shards = []
+        self.currentShard = None
+
+    @staticmethod
+    def create(path, tapeShape, metadata=None, shardSize=10000, dtype=np.float32):
+        if os.path.exists(os.path.join(path, YTapeDataset.metadataFilename)):
+            raise ValueError("a dataset already exists at " + path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        dataset = YTapeDataset(path, tapeShape, shardSize, dtype, metadata)
+        dataset.writeMetadata()
+        return dataset
+
+    @staticmethod
+    def open(path):
+        with open(os.path.join(path, YTapeDataset.metadataFilename), 'r') as f:
+            header = json.load(f)
+
+        dataset = YTapeDataset(path, header['tapeShape'], header['shardSize'], str(header['dtype']), header['metadata'])
+        dataset.shards = header['shards']
+        return dataset
+
+    @property
+    def numTapes(self):
+        return sum(shard['numTapes'] for shard in self.shards)
+
+    def append(self, tapes):
+        # write a (N,numSteps+1,numRays) batch, filling the current shard
+        # before starting a new one
+        tapes = np.asarray(tapes)
+        if tapes.shape[1:] != self.tapeShape:
+            raise ValueError("tapes of shape " + str(tapes.shape[1:]) + " do not match the dataset shape " +
+                             str(self.tapeShape))
+
+        while len(tapes) > 0:
+            if self.currentShard is None or self.shards[-1]['numTapes'] == self.shardSize:
+                self.startShard()
+
+            shard = self.shards[-1]
+            numToWrite = min(len(tapes), self.shardSize - shard['numTapes'])
+            self.currentShard[shard['numTapes']:shard['numTapes']+numToWrite] = tapes[0:numToWrite]
+            shard['numTapes'] += numToWrite
+            tapes = tapes[numToWrite:]
+
+        self.currentShard.flush()
+        self.writeMetadata()
+
+    def startShard(self):
+        if self.currentShard is not None:
+            self.finishShard()
+
+        filename = 'shard_%05d.npy' % len(self.shards)
+        self.currentShard = np.lib.format.open_memmap(os.path.join(self.path, filename), mode='w+',
+                                                      dtype=self.dtype, shape=(self.shardSize,) + self.tapeShape)
+        self.shards.append({'filename': filename, 'numTapes': 0})
+
+    def finishShard(self):
+        # a partly filled last shard keeps its full size on disk, only the
+        # first numTapes entries are valid
+        self.currentShard.flush()
+        self.currentShard = None
+
+    def close(self):
+        if self.currentShard is not None:
+            self.finishShard()
+        self.writeMetadata()
+
+    def getTapes(self, start=0, stop=None):
+        # tapes [start, stop) across shards, a view into a single shard when
+        # the range does not cross a shard boundary
+        if stop is None:
+            stop = self.numTapes
+
+        pieces = []
+        shardStart = 0
+        for shard in self.shards:
+            shardStop = shardStart + shard['numTapes']
+            if shardStop > start and shardStart < stop:
+                data = np.load(os.path.join(self.path, shard['filename']), mmap_mode='r')
+                pieces.append(data[max(start, shardStart)-shardStart:min(stop, shardStop)-shardStart])
+            shardStart = shardStop
+
+        if len(pieces) == 0:
+            return np.zeros((0,) + self.tapeShape, dtype=self.dtype)
+        if len(pieces) == 1:
+            return pieces[0]
+        return np.concatenate(pieces)
+
+    def writeMetadata(self):
+        header = dict()
+        header['tapeShape'] = list(self.tapeShape)
+        header['shardSize'] = self.shardSize
+        header['dtype'] = self.dtype.str
+        header['numTapes'] = self.numTapes
+        header['shards'] = self.shards
+        header['metadata'] = self.metadata
+
+        filename = os.path.join(self.path, self.metadataFilename)
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(header, f, indent=2, sort_keys=True)
+        os.rename(filename + '.tmp', filename)
+
+
+def randomInitialDistances(numTapes, numRays, rayLength, numHits=3, minDistance=3.0):
+    # scans like the hand written one in YTapeGenerator.py, a few random rays
+    # hit something closer than rayLength and the rest see nothing
+    distances = np.ones((numTapes, numRays)) * rayLength
+    rows = np.repeat(np.arange(numTapes), numHits)
+    columns = np.argsort(np.random.rand(numTapes, numRays), axis=1)[:,0:numHits].ravel()
+    distances[rows, columns] = np.random.uniform(minDistance, rayLength, numTapes*numHits)
+    return distances
+
+
+def getCodeRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='generate a sharded dataset of Y-tapes from random initial scans')
+    parser.add_argument('--numTapes', type=int, default=100000)
+    parser.add_argument('--batchSize', type=int, default=5000)
+    parser.add_argument('--shardSize', type=int, default=50000)
+    parser.add_argument('--numHits', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default='../data/YTapes')
+    argNamespace = parser.parse_args()
+
+    generator = BatchYTapeGenerator()
+    np.random.seed(argNamespace.seed)
+
+    metadata = dict()
+    metadata['generator'] = generator.getParameters()
+    metadata['initialDistances'] = {'sampler': 'randomInitialDistances', 'numHits': argNamespace.numHits,
+                                    'seed': argNamespace.seed}
+    metadata['codeRevision'] = getCodeRevision()
+    metadata['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+    dataset = YTapeDataset.create(argNamespace.output, (generator.numSteps+1, generator.numRays), metadata,
+                                  shardSize=argNamespace.shardSize)
+
+    start = time.time()
+    for batchStart in xrange(0, argNamespace.numTapes, argNamespace.batchSize):
+        numTapes = min(argNamespace.batchSize, argNamespace.numTapes - batchStart)
+        initial_distances = randomInitialDistances(numTapes, generator.numRays, generator.rayLength,
+                                                   numHits=argNamespace.numHits)
+        dataset.append(generator.GenerateYTapes(initial_distances))
+        print dataset.numTapes, "tapes in", time.time() - start, "seconds"
+
+    dataset.close()
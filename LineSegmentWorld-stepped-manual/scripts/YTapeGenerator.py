@@ -1,5 +1,10 @@
 import numpy as np
 import scipy.integrate as integrate
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from segmentRaycaster import SegmentRaycaster
 
 class YTapeGenerator(object):
 
@@ -99,6 +104,7 @@ class YTapeGenerator(object):
         self.LineSegmentEndpoints[-1,:] = [firstX, firstY, firstZ]
 
         self.numLineSegmentEndpoints = np.shape(self.LineSegmentEndpoints)[0]
+        self.segments = SegmentRaycaster.polylineSegments(self.LineSegmentEndpoints)
         #print "####################"
         #print "LineSegmentEndpoints"
         #print self.LineSegmentEndpoints
@@ -217,78 +223,45 @@ class YTapeGenerator(object):
 
 
     def raycastAllManual(self, state):
-        distances = np.zeros(self.numRays)
-
-        origin = np.array([state[0], state[1], 0.0])
-        
-        # iterate through each laser
-
-        for i in range(self.numRays):
-
-            # transform the ray and find the max range location
-
-            ray = self.rays[:,i]
-            theta = state[2]
-            xnew, ynew = self.rotateByTheta(ray, theta)
-            rayTransformed = np.array([xnew, ynew, 0.0])
-
-            maxRangeLocation = origin + rayTransformed*self.rayLength
-
-
-            # initialize a vector of all of the possible intersections
-            laserWithEachWorldSegment = np.zeros((self.numLineSegmentEndpoints-1))
-            
-
-            # find intersections with this laser with each line segment in the world 
-            for j in range(self.numLineSegmentEndpoints-1):
-
-                 length = self.IntersectionDistance(origin[0], origin[1], maxRangeLocation[0], maxRangeLocation[1], self.LineSegmentEndpoints[j,0], self.LineSegmentEndpoints[j,1], self.LineSegmentEndpoints[j+1,0], self.LineSegmentEndpoints[j+1,1])
-                 if length is None:
-                    length = self.rayLength
-                 laserWithEachWorldSegment[j] = length
-
-
-            # choose the smallest distance
-
-            distances[i] = np.min(laserWithEachWorldSegment)
-
-        return distances
+        # all the rays against all the segments at once, see SegmentRaycaster
+        return SegmentRaycaster.raycastFromPose(state[0], state[1], state[2], self.rays, self.rayLength, self.segments)
 
 
 
 
 
-my_generator = YTapeGenerator()
+if __name__ == "__main__":
+    my_generator = YTapeGenerator()
 
 
-initial_distances = np.ones((21)) * 20.0
-initial_distances[5] = 13.0
-initial_distances[6] = 8.0
-initial_distances[17] = 15.0
-#print "Using for my initial_distances, the one input into this function:"
-#print initial_distances
+    initial_distances = np.ones((21)) * 20.0
+    initial_distances[5] = 13.0
+    initial_distances[6] = 8.0
+    initial_distances[17] = 15.0
+    #print "Using for my initial_distances, the one input into this function:"
+    #print initial_distances
 
 
-import time
-start = time.time()
+    import time
+    start = time.time()
 
-YTape = my_generator.GenerateYTape(initial_distances)
+    YTape = my_generator.GenerateYTape(initial_distances)
 
-end = time.time()
-print(end - start), "is how long it took in seconds"
-# print np.shape(YTape), "is shape of YTape"
-# print
-# print
-# print "YTape is:"
-# print YTape
+    end = time.time()
+    print(end - start), "is how long it took in seconds"
+    # print np.shape(YTape), "is shape of YTape"
+    # print
+    # print
+    # print "YTape is:"
+    # print YTape
 
 
 
 
-import shelve
-filename = "YTape"
-filename = '../data/' + filename + ".out"
-my_shelf = shelve.open(filename,'n')
+    import shelve
+    filename = "YTape"
+    filename = '../data/' + filename + ".out"
+    my_shelf = shelve.open(filename,'n')
 
-my_shelf['raycastData'] = YTape
-my_shelf.close()
+    my_shelf['raycastData'] = YTape
+    my_shelf.close()
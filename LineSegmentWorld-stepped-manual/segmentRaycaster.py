@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class SegmentRaycaster(object):
+
+    # Raycasting against a world made of 2D line segments, shared by
+    # SensorObjManual and scripts/YTapeGenerator.py. All the ray/segment
+    # pairs are solved at once as (numRays, numSegments) arrays instead of
+    # one IntersectionDistance call per pair.
+    #
+    # segments is a (K,4) array of [x1, y1, x2, y2]. A ray from origin along
+    # the unit direction d is the segment origin -> origin + d*rayLength, and
+    # like IntersectionIsOnSegments an intersection at either end of either
+    # segment counts as a hit. Parallel segments never intersect.
+
+    @staticmethod
+    def polylineSegments(endpoints):
+        # segments joining consecutive rows of an (N,2) or (N,3) array of
+        # endpoints, as in LineSegmentEndpoints
+        endpoints = np.asarray(endpoints, dtype=float)
+        return np.hstack((endpoints[:-1,0:2], endpoints[1:,0:2]))
+
+    @staticmethod
+    def raycast(origins, directions, rayLength, segments):
+        # origins is a single point or one point per ray, directions is
+        # (numRays,2) or (numRays,3). Returns the distance along each ray to
+        # the nearest segment, or rayLength if it hits nothing.
+        origins = np.atleast_2d(origins)[:,0:2]
+        directions = np.atleast_2d(directions)[:,0:2]
+        distances = np.ones(len(directions)) * rayLength
+        if len(segments) == 0:
+            return distances
+
+        rayX = (directions[:,0] * rayLength)[:,np.newaxis]
+        rayY = (directions[:,1] * rayLength)[:,np.newaxis]
+        segmentX = segments[:,2] - segments[:,0]
+        segmentY = segments[:,3] - segments[:,1]
+        offsetX = segments[:,0] - origins[:,0:1]
+        offsetY = segments[:,1] - origins[:,1:2]
+
+        # origin + t*ray = start + s*segment, with t and s in [0,1]
+        denominator = rayX*segmentY - rayY*segmentX
+        parallel = denominator == 0
+        denominator = np.where(parallel, 1.0, denominator)
+        t = (offsetX*segmentY - offsetY*segmentX) / denominator
+        s = (offsetX*rayY - offsetY*rayX) / denominator
+
+        hit = ~parallel & (t >= 0) & (t <= 1) & (s >= 0) & (s <= 1)
+        t = np.where(hit, t, 1.0)
+        return np.minimum(distances, np.min(t, axis=1) * rayLength)
+
+    @staticmethod
+    def raycastWorlds(poses, rays, rayLength, segments):
+        # K sensors each in its own world, poses is a (K,3) array of
+        # [x, y, theta] and segments a (K,numSegments,4) array. Returns a
+        # (K,numRays) array of distances.
+        c = np.cos(poses[:,2:3])
+        s = np.sin(poses[:,2:3])
+        rayX = (c*rays[0,:] - s*rays[1,:])[:,:,np.newaxis] * rayLength
+        rayY = (s*rays[0,:] + c*rays[1,:])[:,:,np.newaxis] * rayLength
+        segmentX = (segments[:,:,2] - segments[:,:,0])[:,np.newaxis,:]
+        segmentY = (segments[:,:,3] - segments[:,:,1])[:,np.newaxis,:]
+        offsetX = (segments[:,:,0] - poses[:,0:1])[:,np.newaxis,:]
+        offsetY = (segments[:,:,1] - poses[:,1:2])[:,np.newaxis,:]
+
+        denominator = rayX*segmentY - rayY*segmentX
+        parallel = denominator == 0
+        denominator = np.where(parallel, 1.0, denominator)
+        t = (offsetX*segmentY - offsetY*segmentX) / denominator
+        u = (offsetX*rayY - offsetY*rayX) / denominator
+
+        hit = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+        t = np.where(hit, t, 1.0)
+        return np.min(t, axis=2) * rayLength
+
+    @staticmethod
+    def raycastFromPose(x, y, theta, rays, rayLength, segments):
+        # rays is the (3,numRays) array of unit rays in the sensor frame, as
+        # in SensorObj.rays, rotated by theta about z
+        c = np.cos(theta)
+        s = np.sin(theta)
+        directions = np.column_stack((c*rays[0,:] - s*rays[1,:], s*rays[0,:] + c*rays[1,:]))
+        return SegmentRaycaster.raycast(np.array([x, y]), directions, rayLength, segments)
@@ -1,5 +1,7 @@
 import numpy as np
 
+from segmentRaycaster import SegmentRaycaster
+
 
 class SensorObjManual(object):
 
@@ -39,6 +41,7 @@ class SensorObjManual(object):
         self.LineSegmentEndpoints[-1,:] = [firstX, firstY, firstZ]
 
         self.numLineSegmentEndpoints = np.shape(self.LineSegmentEndpoints)[0]
+        self.segments = SegmentRaycaster.polylineSegments(self.LineSegmentEndpoints)
         print self.LineSegmentEndpoints
 
     def CastPointsToDouble(self, x1, y1, x2, y2, x3, y3, x4, y4):
@@ -112,43 +115,8 @@ class SensorObjManual(object):
 
 
     def raycastAllManual(self,frame):
-        distances = np.zeros(self.numRays)
-
+        # all the rays against all the segments at once, see SegmentRaycaster
         origin = np.array(frame.transform.GetPosition())
-        
-        # iterate through each laser
-
-        for i in range(self.numRays):
-
-            # transform the ray and find the max range location
-
-            ray = self.rays[:,i]
-            rayTransformed = np.array(frame.transform.TransformNormal(ray))
-            maxRangeLocation = origin + rayTransformed*self.rayLength
-
-
-            # initialize a vector of all of the possible intersections
-
-            laserWithEachWorldSegment = np.zeros((self.numLineSegmentEndpoints-1))
-            
-
-            # find intersections with this laser with each line segment in the world 
-
-            for j in range(self.numLineSegmentEndpoints-1):
-
-                 length = self.IntersectionDistance(origin[0], origin[1], maxRangeLocation[0], maxRangeLocation[1], self.LineSegmentEndpoints[j,0], self.LineSegmentEndpoints[j,1], self.LineSegmentEndpoints[j+1,0], self.LineSegmentEndpoints[j+1,1])
-                 if length is None:
-                    length = self.rayLength
-                 laserWithEachWorldSegment[j] = length
-
-
-            # choose the smallest distance
-
-            distances[i] = np.min(laserWithEachWorldSegment)
-
-
-        return distances
-
-
-
+        directions = np.array([frame.transform.TransformNormal(ray) for ray in self.rays.T])
 
+        return SegmentRaycaster.raycast(origin, directions, self.rayLength, self.segments)
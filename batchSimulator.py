@@ -0,0 +1,140 @@
+import numpy as np
+import time
+
+from car import CarPlant
+
+
+class BatchSimulator(object):
+
+    # Steps N independent cars in lockstep through the world of an initialized
+    # Simulator. The cars share the Simulator's world, sensor, controller and
+    # options, their states are kept as one (N,3) array and every step does
+    # one batched raycast, one controller call on the (N,numRays) raycast
+    # matrix and one vectorized dynamics update. Cars that collide are
+    # deactivated through the active mask and can be reset independently.
+    #
+    # A headless Simulator is the natural base, e.g.
+    #
+    #   sim = Simulator(autoInitialize=False, verbose=False, headless=True)
+    #   sim.initialize()
+    #   batch = BatchSimulator(sim, numCars=1000)
+    #   batch.run(numSteps=2000)
+
+    def __init__(self, simulator, numCars=100):
+        self.Simulator = simulator
+        self.world = simulator.world
+        self.Sensor = simulator.Sensor
+        self.Controller = simulator.Controller
+        self.Car = simulator.Car
+
+        self.numCars = numCars
+        self.dt = simulator.options['dt']
+        self.collisionThreshold = simulator.collisionThreshold
+
+        self.states = np.zeros((numCars, 3))
+        self.raycasts = np.zeros((numCars, self.Sensor.numRays))
+        self.controlInputs = np.zeros(numCars)
+        self.active = np.zeros(numCars, dtype=bool)
+        self.stepCount = np.zeros(numCars, dtype=int)
+
+        self.t = 0.0
+        self.episodeLengths = []
+
+    def sampleCollisionFreeStates(self, numStates, tol=5, maxRounds=1000):
+        # vectorized version of Simulator.setRandomCollisionFreeInitialState,
+        # draws candidates in batches and keeps the collision free ones
+        states = np.zeros((0,3))
+
+        for i in xrange(maxRounds):
+            numDraws = 2*(numStates - len(states))
+            candidates = np.zeros((numDraws, 3))
+            candidates[:,0] = np.random.uniform(self.world.Xmin+tol, self.world.Xmax-tol, numDraws)
+            candidates[:,1] = np.random.uniform(self.world.Ymin+tol, self.world.Ymax-tol, numDraws)
+            candidates[:,2] = np.random.uniform(0, 2*np.pi, numDraws)
+
+            inCollision = self.checkInCollision(self.Sensor.raycastAllFromPoses(candidates))
+            states = np.vstack((states, candidates[~inCollision]))
+
+            if len(states) >= numStates:
+                return states[0:numStates]
+
+        raise ValueError("could not find " + str(numStates) + " collision free states in " + str(maxRounds) + " rounds")
+
+    def reset(self, mask=None, states=None):
+        # reset the cars in mask (all of them by default) to the given states,
+        # or to random collision free states if none are given
+        if mask is None:
+            mask = np.ones(self.numCars, dtype=bool)
+
+        idx = np.flatnonzero(mask)
+        if len(idx) == 0:
+            return
+
+        if states is None:
+            states = self.sampleCollisionFreeStates(len(idx))
+
+        self.states[idx,:] = states
+        self.raycasts[idx,:] = self.Sensor.raycastAllFromPoses(self.states[idx,:])
+        self.active[idx] = True
+        self.stepCount[idx] = 0
+
+    def checkInCollision(self, raycasts):
+        # same test as Simulator.checkInCollision, one row per car
+        return raycasts[:,(self.Sensor.numRays+1)/2] < self.collisionThreshold
+
+    def step(self):
+        idx = np.flatnonzero(self.active)
+        if len(idx) == 0:
+            return np.zeros(self.numCars, dtype=bool)
+
+        u, actionIdx = self.Controller.computeControlInputBatch(self.states[idx,:], self.t, self.raycasts[idx,:])
+        self.controlInputs[idx] = u
+
+        self.states[idx,:] = self.integrate(self.states[idx,:], u)
+        self.raycasts[idx,:] = self.Sensor.raycastAllFromPoses(self.states[idx,:])
+        self.stepCount[idx] += 1
+        self.t += self.dt
+
+        collided = np.zeros(self.numCars, dtype=bool)
+        collided[idx] = self.checkInCollision(self.raycasts[idx,:])
+        self.active[collided] = False
+        return collided
+
+    def integrate(self, states, u):
+        if self.Car.integrator == 'exact':
+            return CarPlant.stepExact(states, self.Car.v, self.dt, u)
+        elif self.Car.integrator == 'euler':
+            return CarPlant.stepSemiImplicitEuler(states, self.Car.v, self.dt, u)
+
+        newStates = np.zeros_like(states)
+        for i in xrange(len(states)):
+            newStates[i,:] = self.Car.integrateOneStep(states[i,:], self.t, self.dt, u[i])
+        return newStates
+
+    def run(self, numSteps, autoReset=False, verbose=True):
+        # advance every car for numSteps steps. With autoReset collided cars
+        # are restarted from a new random state, otherwise they stay stopped.
+        # Returns the list of finished episode lengths, in steps.
+        if not np.any(self.active):
+            self.reset()
+
+        startTime = time.time()
+        numStepsTaken = 0
+        for i in xrange(numSteps):
+            collided = self.step()
+            numStepsTaken += 1
+
+            if np.any(collided):
+                self.episodeLengths.extend(self.stepCount[collided].tolist())
+                if autoReset:
+                    self.reset(collided)
+
+            if not np.any(self.active):
+                break
+
+        if verbose:
+            elapsed = time.time() - startTime
+            print "Simulated", self.numCars, "cars for", numStepsTaken, "steps in", elapsed, "seconds"
+            print "Finished episodes:", len(self.episodeLengths), "still running:", np.sum(self.active)
+
+        return self.episodeLengths
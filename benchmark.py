@@ -0,0 +1,293 @@
+import numpy as np
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import argparse
+from timeit import default_timer
+
+
+resultPrefix = 'BENCHMARK_RESULT '
+rateColumns = ['raycastsPerSecond', 'fitsPerSecond', 'integratorStepsPerSecond', 'simStepsPerSecond']
+
+
+def getPeakMemory():
+    # peak resident set size of this process in MB, ru_maxrss is in KB on
+    # linux and in bytes on mac
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 2.0**20
+    return peak / 2.0**10
+
+
+def runVariant(variantDir, numSamples=500, simulationTime=20.0, seed=0):
+    # runs in its own process with variantDir as working directory, so the
+    # variant's CarSimulator, sensor, car, ... are the ones imported and the
+    # peak memory is that variant's alone. Only the interface every variant
+    # shares is used: Simulator(autoInitialize=False), setRobotFrameState,
+    # Sensor.raycastAll(frame), SensorApproximator.polyFitConstrainedLP and
+    # Car.simulateOneStep.
+    result = dict()
+    result['variant'] = os.path.basename(os.path.abspath(variantDir))
+
+    try:
+        sys.path.insert(0, os.path.abspath(variantDir))
+        os.chdir(variantDir)
+        from CarSimulator import Simulator
+
+        startTime = default_timer()
+        np.random.seed(seed)
+        sim = Simulator(autoInitialize=False, verbose=False)
+        sim.options['World']['randomSeed'] = seed
+        sim.options['World']['nonRandomWorld'] = True
+        sim.nonRandomWorld = True
+        sim.randomSeed = seed
+        sim.initialize()
+        result['initializeTime'] = default_timer() - startTime
+
+        # end to end, the default controller from random initial states
+        np.random.seed(seed)
+        sim.defaultControllerTime = simulationTime
+        startTime = default_timer()
+        sim.runBatchSimulation()
+        elapsed = default_timer() - startTime
+        result['simSteps'] = int(sim.counter)
+        result['simStepsPerSecond'] = sim.counter / max(elapsed, 1e-9)
+
+        # the same poses for every variant with a world of the same bounds
+        rng = np.random.RandomState(seed)
+        poses = np.column_stack((rng.uniform(sim.world.Xmin, sim.world.Xmax, numSamples),
+                                 rng.uniform(sim.world.Ymin, sim.world.Ymax, numSamples),
+                                 rng.uniform(0, 2*np.pi, numSamples)))
+
+        raycasts = []
+        elapsed = 0.0
+        for x, y, theta in poses:
+            sim.setRobotFrameState(x, y, theta)
+            startTime = default_timer()
+            raycasts.append(sim.Sensor.raycastAll(sim.frame))
+            elapsed += default_timer() - startTime
+        result['numRays'] = int(sim.Sensor.numRays)
+        result['raycastsPerSecond'] = numSamples / max(elapsed, 1e-9)
+
+        startTime = default_timer()
+        for raycast in raycasts:
+            sim.SensorApproximator.polyFitConstrainedLP(raycast)
+        result['fitsPerSecond'] = numSamples / max(default_timer() - startTime, 1e-9)
+
+        # each step starts from the same state with the first control the
+        # simulation logged, so the integrator sees a realistic input
+        state = np.copy(sim.Car.state)
+        controlInput = sim.controlInputData[0]
+        elapsed = 0.0
+        for i in xrange(numSamples):
+            sim.Car.state = np.copy(state)
+            startTime = default_timer()
+            sim.Car.simulateOneStep(controlInput=controlInput, dt=sim.dt)
+            elapsed += default_timer() - startTime
+        result['integratorStepsPerSecond'] = numSamples / max(elapsed, 1e-9)
+
+        result['peakMemoryMB'] = getPeakMemory()
+        result['error'] = ''
+    except Exception:
+        result['error'] = traceback.format_exc().strip().splitlines()[-1]
+
+    return result
+
+
+class VariantBenchmark(object):
+
+    # Runs runVariant on every simulator directory, each in a fresh
+    # interpreter with Qt rendering offscreen, and collects one row per
+    # variant. With a baseline table from an earlier run, any rate that
+    # dropped by more than tolerance is reported as a regression, e.g.
+    #
+    #   benchmark = VariantBenchmark(VariantBenchmark.findVariants('.'))
+    #   benchmark.run()
+    #   benchmark.writeTable('data/benchmark.csv')
+    #   regressions = benchmark.compareToBaseline('data/benchmark-baseline.csv')
+
+    def __init__(self, variantDirs, numSamples=500, simulationTime=20.0, seed=0, python=None, timeout=1800):
+        self.variantDirs = variantDirs
+        self.numSamples = numSamples
+        self.simulationTime = simulationTime
+        self.seed = seed
+        self.python = python if python is not None else sys.executable
+        self.timeout = timeout
+        self.results = []
+
+    @staticmethod
+    def findVariants(rootDir):
+        # rootDir itself and every directory directly below it with a
+        # CarSimulator.py
+        variantDirs = [os.path.abspath(rootDir)]
+        for name in sorted(os.listdir(rootDir)):
+            path = os.path.abspath(os.path.join(rootDir, name))
+            if os.path.isfile(os.path.join(path, 'CarSimulator.py')):
+                variantDirs.append(path)
+        return variantDirs
+
+    def runInSubprocess(self, variantDir):
+        command = [self.python, os.path.abspath(__file__), '--runVariant', variantDir,
+                   '--numSamples', str(self.numSamples), '--simulationTime', str(self.simulationTime),
+                   '--seed', str(self.seed)]
+        env = dict(os.environ)
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+
+        # the output goes to a file rather than a pipe, some variants print
+        # every step and would block on a full pipe that is only read once
+        # they exit
+        with tempfile.TemporaryFile() as outputFile:
+            process = subprocess.Popen(command, cwd=variantDir, env=env, stdout=outputFile,
+                                       stderr=subprocess.STDOUT)
+            startTime = time.time()
+            while process.poll() is None:
+                if time.time() - startTime > self.timeout:
+                    process.kill()
+                    process.wait()
+                    break
+                time.sleep(0.1)
+            outputFile.seek(0)
+            output = outputFile.read()
+
+        for line in reversed(output.splitlines()):
+            if line.startswith(resultPrefix):
+                return json.loads(line[len(resultPrefix):])
+
+        result = dict(variant=os.path.basename(variantDir))
+        if process.returncode is None or process.returncode < 0:
+            result['error'] = 'timed out after ' + str(self.timeout) + ' seconds'
+        else:
+            lines = output.strip().splitlines()
+            result['error'] = lines[-1] if lines else 'exited with ' + str(process.returncode)
+        return result
+
+    def run(self, verbose=True):
+        self.results = []
+        for variantDir in self.variantDirs:
+            if verbose:
+                print "benchmarking", os.path.basename(variantDir)
+            result = self.runInSubprocess(variantDir)
+            self.results.append(result)
+            if verbose and result.get('error'):
+                print "error:", result['error']
+        return self.results
+
+    def getColumns(self):
+        columns = ['variant'] + rateColumns + ['peakMemoryMB', 'numRays', 'simSteps', 'initializeTime', 'error']
+        for result in self.results:
+            for key in sorted(result.keys()):
+                if key not in columns:
+                    columns.append(key)
+        return columns
+
+    def writeTable(self, filename):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        with open(filename, 'wb') as f:
+            writer = csv.DictWriter(f, fieldnames=self.getColumns())
+            writer.writeheader()
+            for result in self.results:
+                writer.writerow(result)
+
+    @staticmethod
+    def readTable(filename):
+        with open(filename, 'rb') as f:
+            return list(csv.DictReader(f))
+
+    def compareToBaseline(self, filename, tolerance=0.2):
+        # sets result['ratio'] to the worst current/baseline rate of each
+        # variant and returns (variant, column, ratio) for every rate below
+        # 1 - tolerance
+        baseline = dict((row['variant'], row) for row in VariantBenchmark.readTable(filename))
+        regressions = []
+
+        for result in self.results:
+            row = baseline.get(result['variant'])
+            if row is None or result.get('error') or row.get('error'):
+                continue
+
+            ratios = []
+            for column in rateColumns:
+                if not row.get(column) or column not in result:
+                    continue
+                ratio = result[column] / float(row[column])
+                ratios.append(ratio)
+                if ratio < 1.0 - tolerance:
+                    regressions.append((result['variant'], column, ratio))
+
+            if ratios:
+                result['ratio'] = min(ratios)
+
+        return regressions
+
+    def printTable(self):
+        header = "%-44s %12s %10s %12s %12s %10s %8s" % ('variant', 'raycasts/s', 'fits/s', 'integrator/s',
+                                                        'sim steps/s', 'peak MB', 'ratio')
+        print header
+        print "-" * len(header)
+        for result in self.results:
+            if result.get('error'):
+                print "%-44s %s" % (result['variant'], 'error: ' + result['error'])
+                continue
+
+            ratio = "%8.2f" % result['ratio'] if 'ratio' in result else "%8s" % '-'
+            print "%-44s %12.1f %10.1f %12.1f %12.1f %10.1f %s" % (result['variant'], result['raycastsPerSecond'],
+                                                                 result['fitsPerSecond'],
+                                                                 result['integratorStepsPerSecond'],
+                                                                 result['simStepsPerSecond'],
+                                                                 result['peakMemoryMB'], ratio)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark every simulator variant headlessly')
+    parser.add_argument('--variants', type=str, nargs='*', default=None)
+    parser.add_argument('--numSamples', type=int, default=500)
+    parser.add_argument('--simulationTime', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--python', type=str, default=None)
+    parser.add_argument('--output', type=str, default='data/benchmark.csv')
+    parser.add_argument('--baseline', type=str, default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--runVariant', type=str, default=None)
+    argNamespace = parser.parse_args()
+
+    # the child process benchmarks a single variant and prints its result,
+    # os._exit skips the interpreter teardown that can hang with a Qt app
+    # still alive
+    if argNamespace.runVariant is not None:
+        result = runVariant(argNamespace.runVariant, numSamples=argNamespace.numSamples,
+                            simulationTime=argNamespace.simulationTime, seed=argNamespace.seed)
+        print resultPrefix + json.dumps(result)
+        sys.stdout.flush()
+        os._exit(0)
+
+    rootDir = os.path.dirname(os.path.abspath(__file__))
+    if argNamespace.variants:
+        variantDirs = [os.path.abspath(variant) for variant in argNamespace.variants]
+    else:
+        variantDirs = VariantBenchmark.findVariants(rootDir)
+
+    benchmark = VariantBenchmark(variantDirs, numSamples=argNamespace.numSamples,
+                                 simulationTime=argNamespace.simulationTime, seed=argNamespace.seed,
+                                 python=argNamespace.python)
+    benchmark.run()
+
+    regressions = []
+    if argNamespace.baseline is not None:
+        regressions = benchmark.compareToBaseline(argNamespace.baseline, tolerance=argNamespace.tolerance)
+
+    benchmark.printTable()
+    benchmark.writeTable(os.path.join(rootDir, argNamespace.output))
+
+    for variant, column, ratio in regressions:
+        print "regression:", variant, column, "at %.2f of baseline" % ratio
+    if regressions:
+        sys.exit(1)
@@ -1,9 +1,10 @@
 import numpy as np
 import scipy.integrate as integrate
+import time
 
 class CarPlant(object):
 
-    def __init__(self, controller=None, velocity=12):
+    def __init__(self, controller=None, velocity=12, integrator='exact'):
         # if dt is None:
         #     raise ValueError("must specify timestep dt when constructing CarPlant")
         # initial state
@@ -20,6 +21,9 @@ class CarPlant(object):
 
         self.Controller = controller
 
+        # how simulateOneStep advances the state, one of CarPlant.integrators
+        self.setIntegrator(integrator)
+
 
     def dynamics(self, state, t, controlInput=None):
 
@@ -32,7 +36,7 @@ class CarPlant(object):
             if self.Controller is None:
                 u = np.sin(t)
             else:
-                u = self.Controller.computeControlInput(state, t, self.frame)
+                u = self.Controller.computeControlInput(state, t, None)
 
         dqdt[0] = self.v*np.cos(state[2])
         dqdt[1] = self.v*np.sin(state[2])
@@ -57,8 +61,105 @@ class CarPlant(object):
         print "Shape is", np.shape(newState)
         return newState
 
+    integrators = ['exact', 'rk4', 'euler', 'odeint']
+
+    def setIntegrator(self, integrator):
+        if integrator not in CarPlant.integrators:
+            raise ValueError("unknown integrator " + str(integrator) + ", must be one of " + str(CarPlant.integrators))
+        self.integrator = integrator
+
     def simulateOneStep(self, startTime=0.0, dt=0.05, controlInput=None):
-        t = np.linspace(startTime, startTime+dt, 2)
-        newState = integrate.odeint(self.dynamics, self.state, t, args=(controlInput,))
-        self.state = newState[-1,:]
-        return self.state
\ No newline at end of file
+        self.state = self.integrateOneStep(self.state, startTime, dt, controlInput)
+        return self.state
+
+    def integrateOneStep(self, state, startTime=0.0, dt=0.05, controlInput=None, integrator=None):
+        if integrator is None:
+            integrator = self.integrator
+
+        if integrator == 'odeint':
+            t = np.linspace(startTime, startTime+dt, 2)
+            newState = integrate.odeint(self.dynamics, state, t, args=(controlInput,))
+            return newState[-1,:]
+
+        # the fixed step integrators hold the control constant over the step,
+        # which is also what the simulator does when it passes controlInput
+        if controlInput is None:
+            if self.Controller is None:
+                controlInput = np.sin(startTime)
+            else:
+                controlInput = self.Controller.computeControlInput(state, startTime, None)[0]
+
+        if integrator == 'exact':
+            return CarPlant.stepExact(state, self.v, dt, controlInput)
+        elif integrator == 'rk4':
+            return self.stepRK4(state, startTime, dt, controlInput)
+        else:
+            return CarPlant.stepSemiImplicitEuler(state, self.v, dt, controlInput)
+
+    @staticmethod
+    def stepExact(state, v, dt, u):
+        # with constant speed and yaw rate the car drives along a circular arc,
+        # written with sinc so that u = 0 (a straight line) needs no branch.
+        # state can also be an (N,3) array with u an array of N yaw rates.
+        state = np.asarray(state, dtype=float)
+        halfAngle = 0.5*u*dt
+        chord = v*dt*np.sinc(halfAngle/np.pi)
+        midTheta = state[...,2] + halfAngle
+
+        newState = np.empty_like(state)
+        newState[...,0] = state[...,0] + chord*np.cos(midTheta)
+        newState[...,1] = state[...,1] + chord*np.sin(midTheta)
+        newState[...,2] = state[...,2] + u*dt
+        return newState
+
+    @staticmethod
+    def stepSemiImplicitEuler(state, v, dt, u):
+        # update the heading first then move along the new heading
+        state = np.asarray(state, dtype=float)
+        newState = np.empty_like(state)
+        newState[...,2] = state[...,2] + u*dt
+        newState[...,0] = state[...,0] + v*dt*np.cos(newState[...,2])
+        newState[...,1] = state[...,1] + v*dt*np.sin(newState[...,2])
+        return newState
+
+    def stepRK4(self, state, startTime, dt, controlInput):
+        k1 = self.dynamics(state, startTime, controlInput)
+        k2 = self.dynamics(state + 0.5*dt*k1, startTime + 0.5*dt, controlInput)
+        k3 = self.dynamics(state + 0.5*dt*k2, startTime + 0.5*dt, controlInput)
+        k4 = self.dynamics(state + dt*k3, startTime + dt, controlInput)
+        return state + dt/6.0*(k1 + 2*k2 + 2*k3 + k4)
+
+    def integratorErrorReport(self, controlInputs, dt=0.05, initialState=None, verbose=True):
+        # roll out the same control sequence with every integrator and compare
+        # against odeint, returns a dict of the max state error and the time
+        # per step for each integrator
+        if initialState is None:
+            initialState = np.copy(self.state)
+
+        trajectories = dict()
+        report = dict()
+        for integrator in CarPlant.integrators:
+            state = np.array(initialState, dtype=float)
+            trajectory = np.zeros((len(controlInputs)+1, len(state)))
+            trajectory[0,:] = state
+
+            startTime = time.time()
+            for idx, u in enumerate(controlInputs):
+                state = self.integrateOneStep(state, idx*dt, dt, u, integrator=integrator)
+                trajectory[idx+1,:] = state
+            elapsed = time.time() - startTime
+
+            trajectories[integrator] = trajectory
+            report[integrator] = dict()
+            report[integrator]['timePerStep'] = elapsed/max(len(controlInputs), 1)
+
+        for integrator in CarPlant.integrators:
+            error = np.abs(trajectories[integrator] - trajectories['odeint'])
+            report[integrator]['maxPositionError'] = np.max(np.sqrt(error[:,0]**2 + error[:,1]**2))
+            report[integrator]['maxStateError'] = np.max(error)
+
+            if verbose:
+                print integrator, "max position error", report[integrator]['maxPositionError'],
+                print "time per step", report[integrator]['timePerStep']
+
+        return report
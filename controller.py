@@ -28,7 +28,10 @@ class ControllerObj(object):
         # test cases
         # u = 0
         # u = np.sin(t)
-        if raycastDistance is None:
+        # without a frame the sensor raycasts from the state itself
+        if raycastDistance is None and frame is None:
+            self.distances = self.Sensor.raycastAllFromPose(state[0], state[1], state[2])
+        elif raycastDistance is None:
             self.distances = self.Sensor.raycastAll(frame)
         else:
             self.distances = raycastDistance
@@ -51,6 +54,20 @@ class ControllerObj(object):
 
         return u, actionIdx
 
+    def computeControlInputBatch(self, states, t, raycastDistances):
+        # one control input per row of the (N,numRays) raycastDistances,
+        # same as polyController but with all the fits done at once
+        polyCoefficients = self.SensorApproximator.polyFitConstrainedLPBatch(raycastDistances)
+        c0 = polyCoefficients[:,0]
+        c1 = polyCoefficients[:,1]
+
+        u = np.zeros(len(raycastDistances))
+        valid = ~np.isnan(c0) & (c0 <= 12) & (c1 != 0)
+        u[valid] = self.k * (self.velocity + self.slackParam) / (c0[valid] * c1[valid])
+        u = np.clip(u, -self.u_max, self.u_max)
+
+        return -u, np.zeros(len(raycastDistances), dtype=int)
+
 
     def threeController(self):
         mid_index = (len(self.distances)+1)/2
@@ -114,7 +131,7 @@ class ControllerObj(object):
     def polyController(self):
         polyCoefficients = self.SensorApproximator.polyFitConstrainedLP(self.distances)
 
-        if polyCoefficients == None:
+        if polyCoefficients is None:
             u = 0
         elif polyCoefficients[0] > 12:
             u = 0
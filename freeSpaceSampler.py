@@ -0,0 +1,65 @@
+import numpy as np
+
+
+class FreeSpaceSampler(object):
+
+    # Draws positions and poses at least minClearance from every obstacle,
+    # without rejection. The box to draw from is covered by squares of side
+    # resolution, and a square is kept if its center is clear of every
+    # obstacle by minClearance plus half the square's diagonal, which makes
+    # every point of the square clear by minClearance. Samples are uniform
+    # over the kept squares, so a thin band along the edge of free space is
+    # never drawn.
+    #
+    #   sampler = FreeSpaceSampler.fromWorld(world, minClearance=2.0)
+    #   poses = sampler.samplePoses(100)
+
+    def __init__(self, cellCenters, resolution, lower, upper, minClearance):
+        self.cellCenters = np.asarray(cellCenters, dtype=float).reshape(-1,2)
+        self.resolution = resolution
+        self.minClearance = minClearance
+
+        # the squares at the edge of the box are clipped to it
+        self.cellLower = np.maximum(self.cellCenters - 0.5*resolution, lower)
+        self.cellUpper = np.minimum(self.cellCenters + 0.5*resolution, upper)
+        self.cumulativeArea = np.cumsum(np.prod(self.cellUpper - self.cellLower, axis=1))
+
+    @staticmethod
+    def fromWorld(world, minClearance, margin=5.0, resolution=0.5, chunkSize=20000):
+        # positions inside the world bounds shrunk by margin, the same box
+        # setRandomCollisionFreeInitialState draws from
+        lower = np.array([world.Xmin + margin, world.Ymin + margin])
+        upper = np.array([world.Xmax - margin, world.Ymax - margin])
+        shape = np.ceil((upper - lower)/resolution).astype(int)
+        x = lower[0] + resolution*(np.arange(shape[0]) + 0.5)
+        y = lower[1] + resolution*(np.arange(shape[1]) + 0.5)
+        points = np.column_stack((np.repeat(x, shape[1]), np.tile(y, shape[0])))
+
+        clearance = minClearance + resolution/np.sqrt(2.0)
+        free = np.zeros(len(points), dtype=bool)
+        for start in xrange(0, len(points), chunkSize):
+            free[start:start+chunkSize] = ~world.obstacles.pointsInCollision(points[start:start+chunkSize], clearance)
+
+        return FreeSpaceSampler(points[free], resolution, lower, upper, minClearance)
+
+    @property
+    def freeArea(self):
+        if len(self.cumulativeArea) == 0:
+            return 0.0
+        return self.cumulativeArea[-1]
+
+    def samplePositions(self, numSamples):
+        # (numSamples,2) array of positions
+        if len(self.cellCenters) == 0:
+            raise ValueError("no free space with clearance " + str(self.minClearance))
+
+        cells = np.searchsorted(self.cumulativeArea, np.random.rand(numSamples)*self.freeArea, side='right')
+        cells = np.minimum(cells, len(self.cellCenters) - 1)
+        fraction = np.random.rand(numSamples, 2)
+        return self.cellLower[cells] + fraction*(self.cellUpper[cells] - self.cellLower[cells])
+
+    def samplePoses(self, numSamples):
+        # (numSamples,3) array of [x, y, theta] with a uniform heading
+        positions = self.samplePositions(numSamples)
+        theta = np.random.uniform(0, 2*np.pi, numSamples)
+        return np.column_stack((positions, theta))
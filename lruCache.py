@@ -0,0 +1,45 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+    # A dict of at most maxSize entries that drops the least recently used
+    # one when full. get(key, build) returns the cached value or calls
+    # build() to make it, e.g.
+    #
+    #   cache = LRUCache(1000)
+    #   polyData = cache.get(idx, lambda: self.buildRaysPolyData(idx))
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.numHits = 0
+        self.numMisses = 0
+        self.numEvicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, build):
+        if key in self.entries:
+            value = self.entries.pop(key)
+            self.numHits += 1
+        else:
+            value = build()
+            self.numMisses += 1
+
+        self.entries[key] = value
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+            self.numEvicted += 1
+
+        return value
+
+    def values(self):
+        return self.entries.values()
+
+    def clear(self):
+        self.entries.clear()
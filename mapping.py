@@ -8,47 +8,210 @@ from director.debugVis import DebugData
 
 class MappingObj(object):
 
-    def __init__(self):
-        self.numX = 5
-        self.numY = 5
-        self.numZ = 5
-
-        self.voxelSize = 1.0 # in meters
-
-        self.occMap = np.zeros((self.numX, self.numY, self.numZ))
-        self.debugFill()
-
-    def debugFill(self):
-
+    # 2D occupancy grid built from the sensor scans. Cells are resolution
+    # meters on a side, cell (i,j) covers [i, i+1)*resolution in x and
+    # [j, j+1)*resolution in y, and each cell holds the log-odds of being
+    # occupied. The grid is stored sparsely as chunkSize x chunkSize chunks
+    # created on first touch, so the map grows with the area the car has
+    # seen rather than the size of the world.
+    #
+    # insertScan traces every ray of a scan through the grid at once (an
+    # exact DDA traversal, vectorized over rays), lowers the log-odds of the
+    # cells each ray passes through and raises the ones where it ended on
+    # an obstacle. raycast answers sensor queries against the map itself.
+
+    def __init__(self, resolution=0.25, chunkSize=32):
+        self.resolution = resolution
+        self.chunkSize = chunkSize
+        self.chunks = dict()
+
+        self.logOddsHit = 0.85
+        self.logOddsMiss = -0.4
+        self.logOddsMin = -2.0
+        self.logOddsMax = 3.5
+        self.occupiedThreshold = 0.0
+
+    @property
+    def numChunks(self):
+        return len(self.chunks)
+
+    def getCells(self, points):
+        # (N,2) integer cell indices of the points
+        return np.floor(np.atleast_2d(points)[:,0:2] / self.resolution).astype(int)
+
+    def traverseRays(self, starts, ends):
+        # Every cell crossed by each of the segments starts[i] -> ends[i], in
+        # order along the segment. Returns (rayIdx, cells, tEnter, tExit) with
+        # one entry per (segment, cell), where tEnter and tExit are the
+        # fractions of the segment at which it enters and leaves the cell.
+        p0 = np.atleast_2d(starts)[:,0:2] / self.resolution
+        p1 = np.atleast_2d(ends)[:,0:2] / self.resolution
+        delta = p1 - p0
+        first = np.floor(p0).astype(int)
+        last = np.floor(p1).astype(int)
+        numRays = len(p0)
+
+        # the parameter t at which each ray crosses each grid line between
+        # its first and last cell, plus t=0 for the first cell
+        rayIdx = [np.arange(numRays)]
+        t = [np.zeros(numRays)]
+        for axis in (0, 1):
+            numCrossings = np.abs(last[:,axis] - first[:,axis])
+            crossingRays = np.repeat(np.arange(numRays), numCrossings)
+            k = np.arange(np.sum(numCrossings)) - np.repeat(np.cumsum(numCrossings) - numCrossings, numCrossings)
+            forward = delta[crossingRays,axis] > 0
+            gridLines = np.where(forward, first[crossingRays,axis] + k + 1, first[crossingRays,axis] - k)
+            rayIdx.append(crossingRays)
+            t.append((gridLines - p0[crossingRays,axis]) / delta[crossingRays,axis])
+
+        rayIdx = np.concatenate(rayIdx)
+        t = np.clip(np.concatenate(t), 0.0, 1.0)
+        order = np.lexsort((t, rayIdx))
+        rayIdx = rayIdx[order]
+        tEnter = t[order]
+
+        isLast = np.ones(len(rayIdx), dtype=bool)
+        isLast[:-1] = rayIdx[1:] != rayIdx[:-1]
+        tExit = np.ones(len(rayIdx))
+        tExit[~isLast] = tEnter[1:][~isLast[:-1]]
+
+        # a ray through a grid corner crosses both lines at the same t, which
+        # leaves an empty interval to drop
+        keep = (tExit > tEnter) | isLast
+        rayIdx = rayIdx[keep]
+        tEnter = tEnter[keep]
+        tExit = tExit[keep]
+
+        tMiddle = 0.5*(tEnter + tExit)
+        cells = np.floor(p0[rayIdx] + tMiddle[:,np.newaxis]*delta[rayIdx]).astype(int)
+        return rayIdx, cells, tEnter, tExit
+
+    def insertScan(self, pose, distances, angles, rayLength):
+        # pose is [x, y, theta] and distances one scan from SensorObj, a ray
+        # at angle a points along theta - a. Rays that reach rayLength only
+        # clear the cells they pass through.
+        angles = np.asarray(angles)
+        distances = np.asarray(distances, dtype=float)
+        worldAngles = pose[2] - angles
+        starts = np.tile(np.asarray(pose[0:2], dtype=float), (len(angles),1))
+        ends = starts + distances[:,np.newaxis]*np.column_stack((np.cos(worldAngles), np.sin(worldAngles)))
+
+        rayIdx, cells, tEnter, tExit = self.traverseRays(starts, ends)
+        isHit = distances < rayLength - 1e-6
+        isEnd = np.ones(len(rayIdx), dtype=bool)
+        isEnd[:-1] = rayIdx[1:] != rayIdx[:-1]
+        occupied = isEnd & isHit[rayIdx]
+
+        # each cell is updated once per scan, and a hit wins over a miss
+        hitCells = self.uniqueCells(cells[occupied])
+        freeCells = self.uniqueCells(cells[~occupied])
+        if len(hitCells) > 0 and len(freeCells) > 0:
+            freeCells = freeCells[~self.isMember(freeCells, hitCells)]
+
+        self.updateCells(freeCells, self.logOddsMiss)
+        self.updateCells(hitCells, self.logOddsHit)
+
+    @staticmethod
+    def uniqueCells(cells):
+        if len(cells) == 0:
+            return cells.reshape(0,2)
+        return np.unique(cells, axis=0)
+
+    @staticmethod
+    def isMember(cells, otherCells):
+        # true for the rows of cells that are also rows of otherCells
+        offset = min(cells.min(), otherCells.min())
+        width = max(cells.max(), otherCells.max()) - offset + 1
+        keys = (cells[:,0] - offset)*width + (cells[:,1] - offset)
+        otherKeys = (otherCells[:,0] - offset)*width + (otherCells[:,1] - offset)
+        return np.in1d(keys, otherKeys)
+
+    def groupByChunk(self, cells):
+        # (chunkKeys, inverse, localCells) so that cells[inverse == k] lie in
+        # chunk chunkKeys[k] at localCells
+        chunkCells = cells // self.chunkSize
+        chunkKeys, inverse = np.unique(chunkCells, axis=0, return_inverse=True)
+        return chunkKeys, inverse, cells - chunkCells*self.chunkSize
+
+    def updateCells(self, cells, logOdds):
+        if len(cells) == 0:
+            return
+
+        chunkKeys, inverse, localCells = self.groupByChunk(cells)
+        for k in xrange(len(chunkKeys)):
+            key = (chunkKeys[k,0], chunkKeys[k,1])
+            if key not in self.chunks:
+                self.chunks[key] = np.zeros((self.chunkSize, self.chunkSize), dtype=np.float32)
+
+            chunk = self.chunks[key]
+            local = localCells[inverse == k]
+            chunk[local[:,0], local[:,1]] = np.clip(chunk[local[:,0], local[:,1]] + logOdds,
+                                                    self.logOddsMin, self.logOddsMax)
+
+    def getLogOddsOfCells(self, cells):
+        # zero, i.e. probability 0.5, for cells that were never observed
+        logOdds = np.zeros(len(cells))
+        if len(cells) == 0:
+            return logOdds
+
+        chunkKeys, inverse, localCells = self.groupByChunk(cells)
+        for k in xrange(len(chunkKeys)):
+            chunk = self.chunks.get((chunkKeys[k,0], chunkKeys[k,1]))
+            if chunk is None:
+                continue
+            inChunk = np.flatnonzero(inverse == k)
+            logOdds[inChunk] = chunk[localCells[inChunk,0], localCells[inChunk,1]]
+
+        return logOdds
+
+    def getLogOdds(self, points):
+        return self.getLogOddsOfCells(self.getCells(points))
+
+    def getProbability(self, points):
+        return 1.0 - 1.0/(1.0 + np.exp(self.getLogOdds(points)))
+
+    def isOccupied(self, points):
+        return self.getLogOdds(points) > self.occupiedThreshold
+
+    def raycast(self, origins, directions, rayLength):
+        # distance along each ray to the first occupied cell of the map, or
+        # rayLength if there is none. origins is one point per ray or a single
+        # point for all of them. A ray starting in an occupied cell returns 0.
+        directions = np.atleast_2d(directions)[:,0:2]
+        origins = np.atleast_2d(origins)[:,0:2] + np.zeros_like(directions)
+        distances = np.ones(len(origins)) * rayLength
+        if len(self.chunks) == 0:
+            return distances
+
+        rayIdx, cells, tEnter, tExit = self.traverseRays(origins, origins + directions*rayLength)
+        occupied = np.flatnonzero(self.getLogOddsOfCells(cells) > self.occupiedThreshold)
+
+        # the entries are in order along each ray, so the first occupied
+        # entry of each ray is its hit
+        rays, firstIdx = np.unique(rayIdx[occupied], return_index=True)
+        distances[rays] = tEnter[occupied[firstIdx]] * rayLength
+        return distances
+
+    def raycastFromPose(self, pose, angles, rayLength):
+        worldAngles = pose[2] - np.asarray(angles)
+        directions = np.column_stack((np.cos(worldAngles), np.sin(worldAngles)))
+        return self.raycast(np.asarray(pose[0:2], dtype=float), directions, rayLength)
+
+    def getOccupiedCells(self):
+        cells = []
+        for key, chunk in self.chunks.iteritems():
+            local = np.argwhere(chunk > self.occupiedThreshold)
+            cells.append(local + np.array(key)*self.chunkSize)
+        if len(cells) == 0:
+            return np.zeros((0,2), dtype=int)
+        return np.vstack(cells)
+
+    def drawMap(self):
+        # one polyData with a short post at every occupied cell
         d = DebugData()
+        for i, j in self.getOccupiedCells():
+            x = (i + 0.5)*self.resolution
+            y = (j + 0.5)*self.resolution
+            d.addLine((x, y, -0.1), (x, y, 0.1), radius=0.4*self.resolution)
 
-        print "got here"
-
-        for i in xrange(self.numX):
-            print "and here"
-            for j in xrange(self.numY):
-                print "and even here"
-                for k in xrange(self.numZ):
-                    firstEndpt = (i,j,k-0.1)
-                    secondEndpt = (i,j,k+0.1)
-                    d.addLine(firstEndpt, secondEndpt, radius=0.2)
-                    obj = vis.showPolyData(d.getPolyData(), 'world')
-
-
-    def checkOccupied(self, x, y, z):
-
-        if self.occMap[x,y,z] != 1:
-            self.occMap[x,y,z] = 1
-            self.drawOccupied(x, y, z)
-
-    def drawOccupied(self, x, y, z):
-
-        d = DebugData()
-
-        firstEndpt = (x,y,z-0.1)
-        secondEndpt = (x,y,z+0.1)
-
-        #d.addLine(firstEndpt, secondEndpt, radius=0.2)
-        #obj = vis.showPolyData(d.getPolyData(), 'world')
-        
-        
\ No newline at end of file
+        return vis.updatePolyData(d.getPolyData(), 'occupancy map', color=[0.2, 0.2, 0.8])
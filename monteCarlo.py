@@ -0,0 +1,209 @@
+import numpy as np
+import copy
+import csv
+import itertools
+import multiprocessing
+import time
+import traceback
+import argparse
+import sys
+
+
+def runConfiguration(config):
+    # runs in a worker process, so it must be a module level function. Builds
+    # a headless Simulator with config['options'] set over its own options,
+    # runs the default controller and returns a flat dict of results and
+    # timings.
+    result = dict()
+    result['runIdx'] = config['runIdx']
+    result['repeat'] = config['repeat']
+    for key, value in config['parameters'].iteritems():
+        result[key] = value
+
+    try:
+        from CarSimulator import Simulator
+
+        startTime = time.time()
+        sim = Simulator(autoInitialize=False, verbose=False, headless=True)
+        for name, value in MonteCarloRunner.flattenOptions(config['options']).iteritems():
+            MonteCarloRunner.setOption(sim.options, name, value)
+        sim.initialize()
+        initializeTime = time.time() - startTime
+
+        # seeded after initialize, a nonRandomWorld reseeds numpy while it is
+        # built, so seeding before would give every repeat the same states
+        np.random.seed(config['seed'])
+        startTime = time.time()
+        sim.runBatchSimulation()
+        simulationTime = time.time() - startTime
+
+        durations = np.array([runData['duration'] for runData in sim.simulationData])
+        result['numEpisodes'] = len(durations)
+        result['numSteps'] = sim.counter
+        result['meanEpisodeSteps'] = np.mean(durations) if len(durations) > 0 else 0.0
+        result['medianEpisodeSteps'] = np.median(durations) if len(durations) > 0 else 0.0
+        result['maxEpisodeSteps'] = np.max(durations) if len(durations) > 0 else 0
+        result['initializeTime'] = initializeTime
+        result['simulationTime'] = simulationTime
+        result['stepsPerSecond'] = sim.counter / max(simulationTime, 1e-9)
+        result['error'] = ''
+    except Exception:
+        result['error'] = traceback.format_exc().strip().splitlines()[-1]
+
+    return result
+
+
+class MonteCarloRunner(object):
+
+    # Fans a grid of Simulator options out to a process pool. grid maps
+    # 'Section.key' option names (or top level keys like 'dt') to lists of
+    # values, e.g.
+    #
+    #   grid = {'World.percentObsDensity': [10, 20, 30],
+    #           'World.randomSeed': range(10),
+    #           'Controller.k': [2, 5, 10]}
+    #
+    # Every combination is run numRepeats times with a different numpy seed
+    # for the initial states, and the results are collected into one table.
+
+    def __init__(self, baseOptions=None, grid=None, numRepeats=1, numProcesses=None, seed=0):
+        if baseOptions is None:
+            baseOptions = dict()
+        if grid is None:
+            grid = dict()
+
+        self.baseOptions = baseOptions
+        self.grid = grid
+        self.numRepeats = numRepeats
+        self.numProcesses = numProcesses
+        self.seed = seed
+        self.results = []
+
+    @staticmethod
+    def flattenOptions(options, prefix=''):
+        # {'World': {'randomSeed': 5}, 'dt': 0.1} -> {'World.randomSeed': 5, 'dt': 0.1}
+        names = dict()
+        for key, value in options.iteritems():
+            if isinstance(value, dict):
+                names.update(MonteCarloRunner.flattenOptions(value, prefix + key + '.'))
+            else:
+                names[prefix + key] = value
+        return names
+
+    @staticmethod
+    def setOption(options, name, value):
+        keys = name.split('.')
+        d = options
+        for key in keys[:-1]:
+            d = d.setdefault(key, dict())
+        d[keys[-1]] = value
+
+    def buildConfigurations(self):
+        names = sorted(self.grid.keys())
+        configurations = []
+
+        for values in itertools.product(*[self.grid[name] for name in names]):
+            parameters = dict(zip(names, values))
+            options = copy.deepcopy(self.baseOptions)
+            for name, value in parameters.iteritems():
+                MonteCarloRunner.setOption(options, name, value)
+
+            for repeat in xrange(self.numRepeats):
+                config = dict()
+                config['runIdx'] = len(configurations)
+                config['repeat'] = repeat
+                config['seed'] = self.seed + len(configurations)
+                config['parameters'] = parameters
+                config['options'] = options
+                configurations.append(config)
+
+        return configurations
+
+    def run(self, verbose=True):
+        configurations = self.buildConfigurations()
+        numProcesses = self.numProcesses
+        if numProcesses is None:
+            numProcesses = multiprocessing.cpu_count()
+        numProcesses = max(1, min(numProcesses, len(configurations)))
+
+        if verbose:
+            print "Running", len(configurations), "configurations on", numProcesses, "processes"
+
+        startTime = time.time()
+        self.results = []
+
+        if numProcesses == 1:
+            resultIterator = itertools.imap(runConfiguration, configurations)
+        else:
+            pool = multiprocessing.Pool(numProcesses)
+            resultIterator = pool.imap_unordered(runConfiguration, configurations)
+
+        for result in resultIterator:
+            self.results.append(result)
+            if verbose:
+                print "finished run", result['runIdx'], "(", len(self.results), "of", len(configurations), ")",
+                if result['error']:
+                    print "error:", result['error']
+                else:
+                    print "simulationTime", result['simulationTime']
+
+        if numProcesses > 1:
+            pool.close()
+            pool.join()
+
+        self.results.sort(key=lambda result: result['runIdx'])
+        self.totalTime = time.time() - startTime
+
+        if verbose:
+            print "Finished", len(self.results), "runs in", self.totalTime, "seconds"
+
+        return self.results
+
+    def getColumns(self):
+        columns = ['runIdx', 'repeat'] + sorted(self.grid.keys())
+        for result in self.results:
+            for key in sorted(result.keys()):
+                if key not in columns:
+                    columns.append(key)
+        return columns
+
+    def writeTable(self, filename):
+        columns = self.getColumns()
+        with open(filename, 'wb') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for result in self.results:
+                writer.writerow(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='run a grid of simulations on a process pool')
+    parser.add_argument('--numProcesses', type=int, default=None)
+    parser.add_argument('--numRepeats', type=int, default=1)
+    parser.add_argument('--defaultControllerTime', type=float, default=100)
+    parser.add_argument('--output', type=str, default='data/monteCarlo.csv')
+    parser.add_argument('--check', action='store_true', default=False)
+    argNamespace = parser.parse_args()
+
+    baseOptions = dict()
+    baseOptions['runTime'] = dict()
+    baseOptions['runTime']['defaultControllerTime'] = argNamespace.defaultControllerTime
+
+    grid = dict()
+    grid['World.percentObsDensity'] = [10, 20, 30]
+    grid['World.randomSeed'] = range(5)
+
+    runner = MonteCarloRunner(baseOptions, grid, numRepeats=argNamespace.numRepeats,
+                              numProcesses=argNamespace.numProcesses)
+
+    # run the first configuration in this process and stop on any error,
+    # before handing the whole grid to the pool
+    if argNamespace.check:
+        result = runConfiguration(runner.buildConfigurations()[0])
+        if result['error']:
+            raise ValueError("configuration 0 failed: " + result['error'])
+        print "configuration 0 ran", result['numSteps'], "steps in", result['numEpisodes'], "episodes"
+        sys.exit(0)
+
+    runner.run()
+    runner.writeTable(argNamespace.output)
@@ -0,0 +1,135 @@
+import numpy as np
+import json
+import os
+from timeit import default_timer
+
+
+class Profiler(object):
+
+    # Wall clock time spent in each phase of the simulation loop. Timing is
+    # chained: toc charges the time since the previous tic or toc to its
+    # phase and returns the clock for the next phase, so every step costs one
+    # clock read per phase and the phases add up to the whole loop.
+    #
+    #   tic = profiler.tic()
+    #   raycast = sensor.raycastAllFromPose(x, y, theta)
+    #   tic = profiler.toc('raycast', tic)
+    #
+    # endEpisode closes an episode, keeping the totals of each phase and a
+    # histogram of its per call times over log spaced bins. getReport sums
+    # the episodes into a dict and writeReport saves that as JSON.
+    # NullProfiler has the same interface and does nothing.
+
+    enabled = True
+
+    def __init__(self, binEdges=None):
+        if binEdges is None:
+            # 1 microsecond to 10 seconds, four bins per decade
+            binEdges = np.logspace(-6, 1, 29)
+        self.binEdges = np.asarray(binEdges, dtype=float)
+        self.clear()
+
+    def clear(self):
+        self.phases = []
+        self.samples = dict()
+        self.episodes = []
+
+    def tic(self):
+        return default_timer()
+
+    def toc(self, phase, tic):
+        now = default_timer()
+        samples = self.samples.get(phase)
+        if samples is None:
+            samples = self.samples[phase] = []
+            if phase not in self.phases:
+                self.phases.append(phase)
+        samples.append(now - tic)
+        return now
+
+    def endEpisode(self, numSteps):
+        episode = dict(numSteps=numSteps, phases=dict())
+        for phase, samples in self.samples.iteritems():
+            samples = np.asarray(samples)
+            histogram, _ = np.histogram(np.clip(samples, self.binEdges[0], self.binEdges[-1]), self.binEdges)
+            episode['phases'][phase] = dict(count=len(samples), total=float(np.sum(samples)),
+                                            min=float(np.min(samples)), max=float(np.max(samples)),
+                                            histogram=histogram.tolist())
+
+        episode['duration'] = sum(p['total'] for p in episode['phases'].values())
+        self.episodes.append(episode)
+        self.samples = dict()
+        return episode
+
+    def getPercentile(self, histogram, q):
+        # upper edge of the bin holding the q-th percentile
+        cumulative = np.cumsum(histogram)
+        idx = np.searchsorted(cumulative, q/100.0*cumulative[-1])
+        return float(self.binEdges[idx+1])
+
+    def getReport(self):
+        totalTime = sum(episode['duration'] for episode in self.episodes)
+        numSteps = sum(episode['numSteps'] for episode in self.episodes)
+
+        phases = dict()
+        for phase in self.phases:
+            records = [episode['phases'][phase] for episode in self.episodes if phase in episode['phases']]
+            if len(records) == 0:
+                continue
+
+            histogram = np.sum([record['histogram'] for record in records], axis=0)
+            count = sum(record['count'] for record in records)
+            total = sum(record['total'] for record in records)
+            phases[phase] = dict(count=count, total=total, mean=total/count,
+                                 fraction=total/totalTime if totalTime > 0 else 0.0,
+                                 min=min(record['min'] for record in records),
+                                 max=max(record['max'] for record in records),
+                                 p50=self.getPercentile(histogram, 50), p90=self.getPercentile(histogram, 90),
+                                 p99=self.getPercentile(histogram, 99), histogram=histogram.tolist())
+
+        return dict(phaseOrder=[phase for phase in self.phases if phase in phases], phases=phases,
+                    numEpisodes=len(self.episodes), numSteps=numSteps, totalTime=totalTime,
+                    stepsPerSecond=numSteps/totalTime if totalTime > 0 else 0.0,
+                    binEdges=self.binEdges.tolist(), episodes=self.episodes)
+
+    def printSummary(self):
+        report = self.getReport()
+        print "profile of", report['numSteps'], "steps in", report['numEpisodes'], "episodes,", \
+            "%.1f steps/s" % report['stepsPerSecond']
+        print "%-12s %10s %7s %10s %10s %10s" % ('phase', 'total (s)', '%', 'mean (us)', 'p50 (us)', 'p99 (us)')
+        for phase in report['phaseOrder']:
+            p = report['phases'][phase]
+            print "%-12s %10.3f %7.1f %10.1f %10.1f %10.1f" % (phase, p['total'], 100*p['fraction'], 1e6*p['mean'],
+                                                              1e6*p['p50'], 1e6*p['p99'])
+
+    def writeReport(self, filename, metadata=None):
+        report = self.getReport()
+        if metadata is not None:
+            report['metadata'] = metadata
+
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+class NullProfiler(object):
+
+    # Stands in for Profiler when profiling is off. tic and toc return a
+    # constant without reading the clock, so the instrumented loop only pays
+    # for the calls.
+
+    enabled = False
+
+    def clear(self):
+        pass
+
+    def tic(self):
+        return 0.0
+
+    def toc(self, phase, tic):
+        return 0.0
+
+    def endEpisode(self, numSteps):
+        return None
@@ -3,6 +3,8 @@ import director.vtkAll as vtk
 import numpy as np
 import director.objectmodel as om
 
+from obstacles import RaycastCache
+
 
 class SensorObj(object):
 
@@ -20,23 +22,125 @@ class SensorObj(object):
         self.rays[0,:] = np.cos(self.angleGrid)
         self.rays[1,:] = -np.sin(self.angleGrid)
 
+        self.locator = None
+        self.obstacles = None
+        self.raycastCache = None
+        self.distanceField = None
+
     def setLocator(self, locator):
         self.locator = locator
 
-    def raycastAll(self,frame):
+    def setObstacles(self, obstacles):
+        self.obstacles = obstacles
+        if self.raycastCache is not None:
+            self.enableRaycastCache(self.raycastCache.margin)
+
+    def setDistanceField(self, distanceField):
+        # sphere trace through a SignedDistanceField instead of using the
+        # obstacles or the locator
+        self.distanceField = distanceField
 
-        distances = np.zeros(self.numRays)
+    def enableRaycastCache(self, margin=5.0):
+        # reuse the obstacles near the last sensor position while it moves
+        # less than margin, see RaycastCache. Only the analytic raycaster
+        # is cached.
+        self.raycastCache = RaycastCache(self.obstacles, self.rayLength, margin)
 
-        origin = np.array(frame.transform.GetPosition())
+    def disableRaycastCache(self):
+        self.raycastCache = None
+
+    def raycastAll(self,frame):
+        # the frame of a car moving in the plane, see raycastAllFromPose
+        return self.raycastAllFromPose(*self.getPoseFromFrame(frame))
+
+    @staticmethod
+    def getPoseFromFrame(frame):
+        # [x, y, theta] of a frame rotated only about z
+        position = frame.transform.GetPosition()
+        matrix = frame.transform.GetMatrix()
+        return position[0], position[1], np.arctan2(matrix.GetElement(1,0), matrix.GetElement(0,0))
+
+    def getRayDirections(self, theta):
+        # (numRays,3) unit rays of a sensor with heading theta, in world
+        # coordinates
+        c = np.cos(theta)
+        s = np.sin(theta)
+        directions = np.zeros((self.numRays,3))
+        directions[:,0] = c*self.rays[0,:] - s*self.rays[1,:]
+        directions[:,1] = s*self.rays[0,:] + c*self.rays[1,:]
+        return directions
+
+    def getRayDirectionsFromPoses(self, poses):
+        # (N,numRays,3) unit rays for an (N,3) array of poses
+        c = np.cos(poses[:,2:3])
+        s = np.sin(poses[:,2:3])
+        directions = np.zeros((len(poses), self.numRays, 3))
+        directions[:,:,0] = c*self.rays[0,:] - s*self.rays[1,:]
+        directions[:,:,1] = s*self.rays[0,:] + c*self.rays[1,:]
+        return directions
+
+    def raycastAllFromPose(self, x, y, theta):
+        # distances along each ray of a sensor at the planar pose (x,y,theta)
+        origins = np.zeros((self.numRays,3))
+        origins[:,0] = x
+        origins[:,1] = y
+
+        return self.raycastBatch(origins, self.getRayDirections(theta))
+
+    def raycastAllLocations(self, frame):
+        return self.raycastAllLocationsFromPose(*self.getPoseFromFrame(frame))
+
+    def raycastAllLocationsFromPose(self, x, y, theta):
+        # (numRays,3) world points where the rays end, on an obstacle or at
+        # rayLength
+        return self.invertRaycastsToLocationsFromPose(x, y, theta, self.raycastAllFromPose(x, y, theta))
+
+    def invertRaycastsToLocations(self, frame, raycasts):
+        x, y, theta = self.getPoseFromFrame(frame)
+        return self.invertRaycastsToLocationsFromPose(x, y, theta, raycasts)
+
+    def invertRaycastsToLocationsFromPose(self, x, y, theta, raycasts):
+        # (numRays,3) world points at the given distances along each ray
+        return np.array([x, y, 0.0]) + self.getRayDirections(theta)*np.asarray(raycasts)[:,np.newaxis]
+
+    def invertRaycastsToLocationsFromPoses(self, poses, raycasts):
+        # (N,numRays,3) for an (N,3) array of poses and (N,numRays) distances
+        poses = np.atleast_2d(poses)
+        origins = np.column_stack((poses[:,0:2], np.zeros(len(poses))))
+        return origins[:,np.newaxis,:] + self.getRayDirectionsFromPoses(poses)*np.atleast_2d(raycasts)[:,:,np.newaxis]
+
+    def raycastAllFromPoses(self, poses):
+        # poses is an (N,3) array of [x, y, theta], returns an (N,numRays)
+        # array of distances
+        poses = np.atleast_2d(poses)
+
+        if self.distanceField is not None:
+            return self.distanceField.raycastFans(poses, self.angleGrid, self.rayLength)
+        if self.obstacles is not None:
+            return self.obstacles.raycastFans(poses, self.angleGrid, self.rayLength)
+
+        distances = np.zeros((len(poses), self.numRays))
+        for i in xrange(len(poses)):
+            distances[i,:] = self.raycastAllFromPose(poses[i,0], poses[i,1], poses[i,2])
+
+        return distances
 
-        for i in range(0,self.numRays):
-            ray = self.rays[:,i]
-            rayTransformed = np.array(frame.transform.TransformNormal(ray))
-            intersection = self.raycast(self.locator, origin, origin + rayTransformed*self.rayLength)
+    def raycastBatch(self, origins, directions):
+        # origins and directions are (numRays,3) arrays in world coordinates
+        if self.distanceField is not None:
+            return self.distanceField.raycast(origins, directions, self.rayLength)
+        if self.raycastCache is not None and self.obstacles is not None:
+            return self.raycastCache.raycast(origins, directions)
+        if self.obstacles is not None:
+            return self.obstacles.raycast(origins, directions, self.rayLength)
+
+        distances = np.zeros(len(origins))
+        for i in xrange(len(origins)):
+            intersection = self.raycast(self.locator, origins[i], origins[i] + directions[i]*self.rayLength)
             if intersection is None:
                 distances[i] = self.rayLength
             else:
-                distances[i] = np.linalg.norm(intersection - origin)
+                distances[i] = np.linalg.norm(intersection - origins[i])
 
         return distances
 
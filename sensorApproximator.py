@@ -1,20 +1,55 @@
 import numpy as np
 import scipy.optimize as opt
-from linear_regression import LinearRegression
 import cvxopt
 import math
+import itertools
 from director.debugVis import DebugData
 import director.visualization as vis
 
 class SensorApproximatorObj(object):
 
-    def __init__(self, numRays, circleRadius):
+    def __init__(self, numRays, circleRadius, solver='fast'):
         self.N = 1
         self.numRays = numRays
         self.circleRadius = circleRadius
 
+        # 'fast' solves the LP directly in numpy, 'cvxopt' goes through
+        # cvxopt.solvers.lp as before
+        self.solver = solver
+
+        # the LP constrains c_0 >= c0LowerBound
+        self.c0LowerBound = -0.1
+
     def initializeThetaVector(self,thetaVector):
         self.thetaVector = thetaVector
+        self.initializeOptimization()
+
+    def initializeOptimization(self):
+        # everything in the fit that only depends on the ray angles and the
+        # polynomial degree, so each scan only has to fill in its depths
+        self.optimizationN = self.N
+
+        # phi is the Vandermonde matrix, phi[i,k] = theta_i^k
+        self.phi = np.power(np.asarray(self.thetaVector, dtype=float)[:,np.newaxis], np.arange(self.N+1))
+
+        # G = [phi; -e_0], the last row restricts c_0 >= c0LowerBound
+        G_add = np.zeros((1,self.N+1))
+        G_add[0,0] = -1
+        self.G = cvxopt.matrix(np.vstack((self.phi, G_add)))
+
+        # c for LP, maximize the sum of the polynomial over the rays
+        self.c = cvxopt.matrix(-np.sum(self.phi, axis=0)[:,np.newaxis])
+
+        self.linearLP = None
+        if self.N == 1:
+            self.linearLP = SensorApproximatorObj.buildLinearLP(self.thetaVector)
+
+        # built on first use, enumerating the bases is only cheap for small N
+        self.vertexBases = None
+
+    def checkOptimizationInitialized(self):
+        if self.optimizationN != self.N:
+            self.initializeOptimization()
 
     def initializeApproxThetaVector(self, angleMin, angleMax):
         self.numApproxPoints = 200
@@ -28,85 +63,257 @@ class SensorApproximatorObj(object):
         self.laserDepths = np.array(distances) - np.ones((np.shape(distances)))*self.circleRadius # decrease each sensor by the circle radius (i.e., inflate all obstacles)
         #self.laserDepths[0] = 0.1
         #self.laserDepths[-1] = 0.1
-        self.setUpOptimization()
-        self.constrainedLP()
+        self.checkOptimizationInitialized()
+        if self.solver == 'cvxopt' or self.N > 3:
+            self.setUpOptimization()
+            self.constrainedLP()
+            return self.polyCoefficientsLP
+
+        polyCoefficients = self.fastConstrainedLP(self.laserDepths[np.newaxis,:])[0]
+        if np.isnan(polyCoefficients[0]):
+            self.polyCoefficientsLP = None
+        else:
+            self.polyCoefficientsLP = polyCoefficients
         return self.polyCoefficientsLP
 
+    def polyFitConstrainedLPBatch(self, distances):
+        # fits every row of a (K,numRays) array of distances at once, returns
+        # a (K,N+1) array of coefficients with rows of nan where the LP is
+        # infeasible or unbounded
+        laserDepths = np.atleast_2d(distances) - self.circleRadius
+        self.checkOptimizationInitialized()
+        if self.solver == 'cvxopt' or self.N > 3:
+            polyCoefficients = np.zeros((len(laserDepths), self.N+1))
+            for i in xrange(len(laserDepths)):
+                self.laserDepths = laserDepths[i,:]
+                self.setUpOptimization()
+                self.constrainedLP()
+                if self.polyCoefficientsLP is None:
+                    polyCoefficients[i,:] = np.nan
+                else:
+                    polyCoefficients[i,:] = np.array(self.polyCoefficientsLP).ravel()
+            return polyCoefficients
 
-    def setUpOptimization(self):
-        
-        lr = LinearRegression(self.thetaVector,self.laserDepths,self.N)
-        A_pete = lr.phi
-        
-        #W = weighting matrix
-        weights = self.laserDepths * 1.0
-        for index, value in enumerate(weights):
-            weights[index] = (1/value)**4
-        W_pete = np.diag(weights)
-        
-        #b = vector of sensor measurements
-        b_pete = self.laserDepths
+        return self.fastConstrainedLP(laserDepths)
 
-        A_pete = np.matrix(A_pete)
-        W_pete = np.matrix(W_pete)
-        b_pete = np.matrix(b_pete)
+    def fastConstrainedLP(self, laserDepths):
+        if self.N == 1:
+            return SensorApproximatorObj.solveLinearLP(self.linearLP, laserDepths, self.c0LowerBound)
 
-        # P = A^T W A
-        self.P = cvxopt.matrix(A_pete.T * W_pete * A_pete)
+        if self.vertexBases is None:
+            self.vertexBases = SensorApproximatorObj.buildVertexBases(self.thetaVector, self.N)
+        return SensorApproximatorObj.solveLPByVertices(self.vertexBases, laserDepths, self.c0LowerBound)
 
-        # q^T = -b^T A
-        # q = -A^T b
-        self.q = cvxopt.matrix(- A_pete.T * W_pete *b_pete.T)
+    @staticmethod
+    def buildLinearLP(thetaVector, tol=1e-9):
+        # Precomputes the angle dependent terms of solveLinearLP, which solves
+        # the N=1 LP of constrainedLP
+        #
+        #   max  sum_i (c_0 + c_1 theta_i)
+        #   s.t. c_0 + c_1 theta_i <= b_i,  c_0 >= c0LowerBound
+        #
+        # For fixed c_1 the best c_0 is g(c_1) = min_i (b_i - theta_i c_1), so
+        # the LP is the maximization of the concave piecewise linear function
+        # h(c_1) = n*g(c_1) + S_1*c_1 = min_i (n b_i + sigma_i c_1), where
+        # sigma_i = S_1 - n theta_i. Its maximum is the smallest crossing of a
+        # rising and a falling line, or the smallest flat line.
+        thetaVector = np.asarray(thetaVector, dtype=float)
+        linearLP = dict()
+        linearLP['thetaVector'] = thetaVector
+        linearLP['n'] = float(len(thetaVector))
+        linearLP['S1'] = np.sum(thetaVector)
+        sigma = linearLP['S1'] - linearLP['n']*thetaVector
+        linearLP['sigma'] = sigma
 
-        # G = A
-        
-        # no restrictions on coefficients
-        # self.G = cvxopt.matrix(A_pete)
+        rising = np.flatnonzero(sigma > tol)
+        falling = np.flatnonzero(sigma < -tol)
+        linearLP['rising'] = rising
+        linearLP['falling'] = falling
+        linearLP['flat'] = np.flatnonzero(np.abs(sigma) <= tol)
+        linearLP['sloped'] = np.flatnonzero(np.abs(sigma) > tol)
 
-        # restrict c_1 to be in nice tangent domain
-        # G_pete_add = np.zeros((2,self.N+1))
-        # G_pete_add[0,1] = 1
-        # G_pete_add[1,1] = -1
-        # G_pete_ineq = np.vstack((A_pete, G_pete_add))
-        # self.G = cvxopt.matrix(G_pete_ineq)
+        # the crossing of rising line i and falling line j is at height
+        # a_j*fallingWeights[i,j] + a_i*risingWeights[i,j]
+        sigmaRising = sigma[rising][:,np.newaxis]
+        sigmaFalling = sigma[falling][np.newaxis,:]
+        linearLP['fallingWeights'] = (sigmaRising / (sigmaRising - sigmaFalling)).ravel()
+        linearLP['risingWeights'] = (-sigmaFalling / (sigmaRising - sigmaFalling)).ravel()
+        linearLP['crossingFalling'] = np.tile(falling, len(rising))
+        linearLP['crossingRising'] = np.repeat(rising, len(falling))
 
-        # # restrict c_0 to be positive
-        G_pete_add = np.zeros((1,self.N+1))
-        G_pete_add[0,0] = -1
-        G_pete_ineq = np.vstack((A_pete, G_pete_add))
-        self.G = cvxopt.matrix(G_pete_ineq)
+        # rays that bound c_1 from below and above through c_0 >= c0LowerBound
+        linearLP['negative'] = np.flatnonzero(thetaVector < 0)
+        linearLP['positive'] = np.flatnonzero(thetaVector > 0)
+        linearLP['center'] = np.flatnonzero(thetaVector == 0)
 
+        # if h has no maximum it grows towards +inf when every line rises
+        linearLP['direction'] = np.inf if len(rising) > 0 else -np.inf
+        return linearLP
 
-        # h = b_pete
+    @staticmethod
+    def solveLinearLP(linearLP, laserDepths, c0LowerBound=-0.1, tol=1e-9, maxIterations=50):
+        # Solves the LP described in buildLinearLP for each row b of
+        # laserDepths. When a flat line is optimal (the center ray for a
+        # symmetric fan) the optimal c_1 is a whole interval, and we return its
+        # analytic center, which is where an interior point solver heads for.
+        laserDepths = np.atleast_2d(laserDepths)
+        numScans = len(laserDepths)
+        thetaVector = linearLP['thetaVector']
+        n = linearLP['n']
+        S1 = linearLP['S1']
+        sigma = linearLP['sigma']
+        rising = linearLP['rising']
+        falling = linearLP['falling']
+        flat = linearLP['flat']
+        a = n*laserDepths
 
-        # no restrictions on coefficents
-        self.h = cvxopt.matrix(b_pete.T)
+        optimum = np.ones(numScans)*np.inf
+        if len(rising) > 0 and len(falling) > 0:
+            crossings = (a[:,linearLP['crossingFalling']]*linearLP['fallingWeights'] +
+                         a[:,linearLP['crossingRising']]*linearLP['risingWeights'])
+            optimum = np.min(crossings, axis=1)
+        if len(flat) > 0:
+            optimum = np.minimum(optimum, np.min(a[:,flat], axis=1))
+
+        # interval of maximizers of h, at +-inf if h is unbounded
+        unbounded = np.isinf(optimum)
+        lower = np.ones(numScans)*-np.inf
+        upper = np.ones(numScans)*np.inf
+        if len(rising) > 0:
+            lower = np.max((optimum[:,np.newaxis] - a[:,rising]) / sigma[rising], axis=1)
+        if len(falling) > 0:
+            upper = np.min((optimum[:,np.newaxis] - a[:,falling]) / sigma[falling], axis=1)
+        if np.any(unbounded):
+            lower[unbounded] = linearLP['direction']
+            upper[unbounded] = linearLP['direction']
+
+        # the c_0 >= c0LowerBound constraint limits c_1 to [feasibleLower, feasibleUpper]
+        feasibleLower = np.ones(numScans)*-np.inf
+        feasibleUpper = np.ones(numScans)*np.inf
+        if len(linearLP['negative']) > 0:
+            negative = linearLP['negative']
+            feasibleLower = np.max((laserDepths[:,negative] - c0LowerBound) / thetaVector[negative], axis=1)
+        if len(linearLP['positive']) > 0:
+            positive = linearLP['positive']
+            feasibleUpper = np.min((laserDepths[:,positive] - c0LowerBound) / thetaVector[positive], axis=1)
+        feasible = feasibleLower <= feasibleUpper
+        if len(linearLP['center']) > 0:
+            feasible &= np.min(laserDepths[:,linearLP['center']], axis=1) >= c0LowerBound
 
-        # restrict c_1 to be in nice tangent doman
-        # h_add = np.zeros((1,2))
-        # h_add[0,0] = math.pi/2
-        # h_add[0,1] = math.pi/2
-        # h_pete_ineq = np.hstack((b_pete, h_add))
-        # self.h = cvxopt.matrix(h_pete_ineq.T)
+        # a concave function on an interval is maximized at the projection of
+        # its maximizers onto that interval
+        lower = np.clip(lower, feasibleLower, feasibleUpper)
+        upper = np.clip(upper, feasibleLower, feasibleUpper)
+        failed = ~feasible | np.isinf(lower) | np.isinf(upper)
+        if np.any(failed):
+            lower[failed] = 0.0
+            upper[failed] = 0.0
+
+        c1 = 0.5*(lower + upper)
+
+        degenerate = upper - lower > tol
+        if np.any(degenerate):
+            # maximize sum_i log(slack_i) over the optimal face with a Newton
+            # iteration safeguarded by bisection, the flat lines have constant
+            # slack there so they drop out
+            slopes = sigma[linearLP['sloped']]
+            a = a[degenerate][:,linearLP['sloped']]
+            lower = lower[degenerate]
+            upper = upper[degenerate]
+            faceValue = np.min(a + slopes*lower[:,np.newaxis], axis=1)
+            middle = 0.5*(lower + upper)
+            for i in xrange(maxIterations):
+                slack = a + slopes*middle[:,np.newaxis] - faceValue[:,np.newaxis]
+                derivative = np.sum(slopes/slack, axis=1)
+                curvature = -np.sum((slopes/slack)**2, axis=1)
+                if S1 != 0:
+                    c0Slack = (faceValue - S1*middle)/n - c0LowerBound
+                    derivative -= (S1/n)/c0Slack
+                    curvature -= ((S1/n)/c0Slack)**2
+
+                increasing = derivative > 0
+                lower = np.where(increasing, middle, lower)
+                upper = np.where(increasing, upper, middle)
+                newton = middle - derivative/curvature
+                newMiddle = np.where((newton > lower) & (newton < upper), newton, 0.5*(lower + upper))
+                converged = np.abs(newMiddle - middle) <= tol*(1.0 + np.abs(middle))
+                middle = newMiddle
+                if np.all(converged):
+                    break
+            c1[degenerate] = middle
+
+        c0 = np.min(laserDepths - thetaVector*c1[:,np.newaxis], axis=1)
+        polyCoefficients = np.column_stack((c0, c1))
+        polyCoefficients[failed,:] = np.nan
+        return polyCoefficients
+
+    @staticmethod
+    def buildVertexBases(thetaVector, N, tol=1e-9):
+        # Precomputes what solveLPByVertices needs for the degree N version
+        # of the LP, max sum_i phi_i.c s.t. phi_i.c <= b_i, c_0 >= c0LowerBound.
+        # A basis of N+1 constraints is optimal when its vertex is feasible
+        # and its dual multipliers are nonnegative. The multipliers only
+        # depend on the ray angles, so only the dual feasible bases are kept
+        # together with the inverses of their constraint matrices.
+        phi = np.power(np.asarray(thetaVector, dtype=float)[:,np.newaxis], np.arange(N+1))
+        G = np.vstack((phi, -np.eye(1, N+1)))
+        objective = np.sum(phi, axis=0)
+
+        bases = np.array(list(itertools.combinations(xrange(len(G)), N+1)))
+        A = G[bases]
+        nonsingular = np.abs(np.linalg.det(A)) > tol
+        bases = bases[nonsingular]
+        inverses = np.linalg.inv(A[nonsingular])
+
+        duals = np.einsum('bji,j->bi', inverses, objective)
+        dualFeasible = np.all(duals >= -tol, axis=1)
+
+        vertexBases = dict()
+        vertexBases['G'] = G
+        vertexBases['bases'] = bases[dualFeasible]
+        vertexBases['inverses'] = inverses[dualFeasible]
+        return vertexBases
+
+    @staticmethod
+    def solveLPByVertices(vertexBases, laserDepths, c0LowerBound=-0.1):
+        # Solves the LP for each row of laserDepths by checking the vertices
+        # of the dual feasible bases from buildVertexBases. If several of them
+        # are feasible their mean, a point on the optimal face, is returned.
+        # Rows are nan where the LP is infeasible or unbounded.
+        laserDepths = np.atleast_2d(laserDepths)
+        G = vertexBases['G']
+        bases = vertexBases['bases']
+        h = np.column_stack((laserDepths, -c0LowerBound*np.ones(len(laserDepths))))
+
+        vertices = np.einsum('bij,kbj->kbi', vertexBases['inverses'], h[:,bases])
+        violation = np.einsum('kbi,ji->kbj', vertices, G) - h[:,np.newaxis,:]
+        feasible = np.all(violation <= 1e-7*(1.0 + np.abs(h[:,np.newaxis,:])), axis=2)
+
+        numFeasible = np.sum(feasible, axis=1)
+        polyCoefficients = np.sum(vertices*feasible[:,:,np.newaxis], axis=1) / np.maximum(numFeasible, 1)[:,np.newaxis]
+        polyCoefficients[numFeasible == 0,:] = np.nan
+        return polyCoefficients
+
+    def setUpOptimization(self):
+        # only h depends on the measurements, phi, G and c are built once in
+        # initializeOptimization
+
+        # no restrictions on coefficents
+        # self.h = cvxopt.matrix(self.laserDepths)
 
         # #restrict c_0 to be positive
-        h_add = np.zeros((1,1))
-        h_add[0,0] = 0.1
-        h_pete_ineq = np.hstack((b_pete, h_add))
-        self.h = cvxopt.matrix(h_pete_ineq.T)
-
-        # c for LP
-        c = np.zeros((self.N+1,1))
-        for index, row in enumerate(c):
-            total = 0
-            for i in range(self.numRays):
-                total = total + self.thetaVector[i]**index
-            c[index] = -total
-
-        self.c = cvxopt.matrix(c)
-        
+        self.checkOptimizationInitialized()
+        self.h = cvxopt.matrix(np.hstack((self.laserDepths, [-self.c0LowerBound])))
+
+    def setUpQP(self):
+        # P = A^T W A and q = -A^T W b with W = diag(1/b_i^4)
+        weights = 1.0/self.laserDepths**4
+        weightedPhi = self.phi * weights[:,np.newaxis]
+        self.P = cvxopt.matrix(np.dot(weightedPhi.T, self.phi))
+        self.q = cvxopt.matrix(-np.dot(weightedPhi.T, self.laserDepths)[:,np.newaxis])
 
     def constrainedQP(self):
+        self.setUpQP()
         cvxopt.solvers.options['show_progress'] = False
         solution = cvxopt.solvers.qp(self.P, self.q, self.G, self.h)
         self.polyCoefficientsQP = np.array(solution['x'])
@@ -0,0 +1,171 @@
+import numpy as np
+import hashlib
+import json
+import os
+
+from obstacles import ObstacleTable
+
+
+class SignedDistanceField(object):
+
+    # A world baked into a 2D grid of signed distances to the nearest
+    # obstacle, negative inside obstacles. values[i,j] is the distance at
+    # origin + resolution*(i,j). Lookups are bilinear, so distance, gradient
+    # and the clearance checks built on them cost the same whatever the
+    # number of obstacles, and raycasts are sphere traced through the grid.
+    #
+    # Circles are exact circles rather than the 24-gons of the mesh and thick
+    # walls are rectangles, so raycast distances agree with the analytic
+    # raycaster to about the grid resolution. Rays that graze an obstacle
+    # within about a cell of its edge can hit or miss it either way.
+    #
+    #   field = SignedDistanceField.fromObstacles(world.obstacles, lower, upper, resolution=0.25)
+    #   field.distance(points), field.gradient(points)
+    #   field.raycastFans(poses, sensor.angleGrid, sensor.rayLength)
+
+    def __init__(self, values, origin, resolution):
+        self.values = np.asarray(values, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+        self.resolution = float(resolution)
+        self.gradientX, self.gradientY = np.gradient(self.values, self.resolution)
+
+    @staticmethod
+    def fromObstacles(obstacles, lower, upper, resolution=0.25, chunkSize=20000):
+        # bake the grid covering the box [lower, upper]
+        lower = np.asarray(lower, dtype=float)
+        shape = (np.ceil((np.asarray(upper, dtype=float) - lower)/resolution) + 1).astype(int)
+        x = lower[0] + resolution*np.arange(shape[0])
+        y = lower[1] + resolution*np.arange(shape[1])
+        points = np.column_stack((np.repeat(x, shape[1]), np.tile(y, shape[0])))
+
+        values = np.ones(len(points)) * np.inf
+        for start in xrange(0, len(points), chunkSize):
+            values[start:start+chunkSize] = SignedDistanceField.signedDistances(obstacles, points[start:start+chunkSize])
+
+        return SignedDistanceField(values.reshape(shape), lower, resolution)
+
+    @staticmethod
+    def signedDistances(obstacles, points):
+        # exact signed distances from the (N,2) points to the obstacles
+        distances = np.ones(len(points)) * np.inf
+
+        if obstacles.numCircles > 0:
+            distances = np.minimum(distances, obstacles.nearestCircles(points, 1)[0][:,0])
+
+        if len(obstacles.tubes) > 0:
+            distances = np.minimum(distances, np.min(SignedDistanceField.rectangleDistances(points, obstacles.tubes), axis=1))
+
+        if obstacles.numSegments > 0:
+            distances = np.minimum(distances, np.min(ObstacleTable.pointSegmentDistances(points, obstacles.segments), axis=1))
+
+        return distances
+
+    @staticmethod
+    def rectangleDistances(points, tubes):
+        # (N,T) signed distances to the rectangles of half width radius around
+        # each [x1, y1, x2, y2, radius] tube
+        centerX = 0.5*(tubes[:,0] + tubes[:,2])
+        centerY = 0.5*(tubes[:,1] + tubes[:,3])
+        axisX = tubes[:,2] - tubes[:,0]
+        axisY = tubes[:,3] - tubes[:,1]
+        halfLength = 0.5*np.sqrt(axisX**2 + axisY**2)
+        axisX = axisX / np.maximum(2*halfLength, 1e-12)
+        axisY = axisY / np.maximum(2*halfLength, 1e-12)
+
+        offsetX = points[:,0:1] - centerX
+        offsetY = points[:,1:2] - centerY
+        alongX = np.abs(offsetX*axisX + offsetY*axisY) - halfLength
+        acrossY = np.abs(offsetY*axisX - offsetX*axisY) - tubes[:,4]
+
+        outside = np.sqrt(np.maximum(alongX, 0)**2 + np.maximum(acrossY, 0)**2)
+        return outside + np.minimum(np.maximum(alongX, acrossY), 0)
+
+    @staticmethod
+    def getCacheFilename(cacheDir, parameters, resolution):
+        # the cache key is a hash of the parameters that determine the world,
+        # e.g. the World options including the seed
+        key = json.dumps({'parameters': parameters, 'resolution': resolution}, sort_keys=True)
+        return os.path.join(cacheDir, hashlib.sha1(key).hexdigest() + '.npz')
+
+    @staticmethod
+    def fromWorld(world, parameters=None, resolution=0.25, padding=5.0, cacheDir=None):
+        # bake world.obstacles over the world bounds plus padding. With a
+        # cacheDir and parameters the field is loaded from disk if it was
+        # baked before, otherwise it is baked and saved there.
+        filename = None
+        if cacheDir is not None and parameters is not None:
+            filename = SignedDistanceField.getCacheFilename(cacheDir, parameters, resolution)
+            if os.path.isfile(filename):
+                return SignedDistanceField.load(filename)
+
+        lower = [world.Xmin - padding, world.Ymin - padding]
+        upper = [world.Xmax + padding, world.Ymax + padding]
+        field = SignedDistanceField.fromObstacles(world.obstacles, lower, upper, resolution)
+
+        if filename is not None:
+            if not os.path.isdir(cacheDir):
+                os.makedirs(cacheDir)
+            field.save(filename)
+
+        return field
+
+    def save(self, filename):
+        np.savez(filename, values=self.values, origin=self.origin, resolution=self.resolution)
+
+    @staticmethod
+    def load(filename):
+        data = np.load(filename)
+        return SignedDistanceField(data['values'], data['origin'], data['resolution'])
+
+    def interpolate(self, grid, points):
+        # bilinear lookup, points outside the grid use the nearest border cell
+        points = np.atleast_2d(points)
+        scaled = (points[:,0:2] - self.origin) / self.resolution
+        cell = np.clip(np.floor(scaled).astype(int), 0, np.array(grid.shape) - 2)
+        fraction = np.clip(scaled - cell, 0.0, 1.0)
+        i = cell[:,0]
+        j = cell[:,1]
+        fx = fraction[:,0]
+        fy = fraction[:,1]
+
+        return ((1-fx)*(1-fy)*grid[i,j] + fx*(1-fy)*grid[i+1,j] +
+                (1-fx)*fy*grid[i,j+1] + fx*fy*grid[i+1,j+1])
+
+    def distance(self, points):
+        # signed distance to the nearest obstacle for each (N,2) point
+        return self.interpolate(self.values, points)
+
+    def gradient(self, points):
+        # (N,2) gradient of the distance, points away from the nearest obstacle
+        return np.column_stack((self.interpolate(self.gradientX, points), self.interpolate(self.gradientY, points)))
+
+    def raycast(self, origins, directions, rayLength, tolerance=1e-3, minStep=None):
+        # sphere trace each ray, stepping by the distance to the nearest
+        # obstacle until it is within tolerance of one or passes rayLength.
+        # Steps are at least minStep, a quarter cell by default, so rays that
+        # graze an obstacle still finish. A step that ends inside an obstacle
+        # is pulled back by the (negative) distance there, so hits are off by
+        # at most minStep.
+        if minStep is None:
+            minStep = 0.25*self.resolution
+
+        origins = np.atleast_2d(origins)[:,0:2]
+        directions = np.atleast_2d(directions)[:,0:2]
+        t = np.zeros(len(origins))
+        active = np.arange(len(origins))
+
+        while len(active) > 0:
+            distances = self.distance(origins[active] + t[active,np.newaxis]*directions[active])
+            hit = distances <= tolerance
+            t[active] += np.where(hit, np.minimum(distances, 0.0), np.maximum(distances, minStep))
+            active = active[~hit & (t[active] < rayLength)]
+
+        return np.clip(t, 0.0, rayLength)
+
+    def raycastFans(self, poses, angles, rayLength):
+        # same layout as ObstacleTable.raycastFans
+        poses = np.atleast_2d(poses)
+        worldAngles = poses[:,2:3] - angles
+        origins = np.repeat(poses[:,0:2], len(angles), axis=0)
+        directions = np.column_stack((np.cos(worldAngles).ravel(), np.sin(worldAngles).ravel()))
+        return self.raycast(origins, directions, rayLength).reshape(len(poses), len(angles))
@@ -0,0 +1,105 @@
+import numpy as np
+
+from obstacles import ObstacleTable
+from lruCache import LRUCache
+
+
+class TiledWorld(object):
+
+    # An unbounded circle world generated tileSize x tileSize tiles at a time
+    # around the car. Tile (i,j) covers [i, i+1)*tileSize in x and
+    # [j, j+1)*tileSize in y, and its circles are drawn from a RandomState
+    # seeded with (randomSeed, i, j), so a tile is the same whenever and in
+    # whatever order it is built. The density matches buildCircleWorld.
+    #
+    # update(x, y) makes world.obstacles hold every tile with a circle that
+    # can reach within loadRadius of the car, i.e. the tiles within
+    # loadRadius + circleRadius of it, since circles are binned into tiles
+    # by their centers. The table is rebuilt, index included, only when that set of
+    # tiles changes, i.e. when the car crosses a tile boundary, and then only
+    # from the handful of tiles around the car. Built tiles are kept in an
+    # LRU of at most maxTiles, so driving back over old ground does not draw
+    # them again and memory stays bounded however long the run.
+    #
+    # Xmin, Xmax, Ymin, Ymax only bound the region initial states are drawn
+    # from, the obstacles go on forever.
+
+    def __init__(self, randomSeed=5, tileSize=50.0, percentObsDensity=30, circleRadius=1.75, loadRadius=20.0,
+                 maxTiles=64, startRadius=None):
+        self.randomSeed = randomSeed
+        self.tileSize = float(tileSize)
+        self.percentObsDensity = percentObsDensity
+        self.circleRadius = circleRadius
+        self.loadRadius = loadRadius
+        self.maxTiles = maxTiles
+
+        tilesPerSide = int(np.ceil(2*(loadRadius + circleRadius)/self.tileSize)) + 1
+        if maxTiles < tilesPerSide**2:
+            raise ValueError("maxTiles must be at least " + str(tilesPerSide**2) + " to hold the tiles within " +
+                             "loadRadius + circleRadius of the car")
+
+        obsScalingFactor = 1.0/12.0
+        self.numObstaclesPerTile = int(percentObsDensity/100.0 * obsScalingFactor * self.tileSize**2)
+
+        if startRadius is None:
+            startRadius = self.tileSize
+        self.Xmin = -startRadius
+        self.Xmax = startRadius
+        self.Ymin = -startRadius
+        self.Ymax = startRadius
+
+        self.visObj = None
+        self.tiles = LRUCache(maxTiles)
+        self.activeTiles = None
+        self.obstacles = ObstacleTable()
+
+    @property
+    def numObstacles(self):
+        return self.obstacles.numCircles
+
+    @property
+    def numTilesBuilt(self):
+        return self.tiles.numMisses
+
+    @property
+    def numTilesEvicted(self):
+        return self.tiles.numEvicted
+
+    def getTileIndex(self, x, y):
+        return int(np.floor(x/self.tileSize)), int(np.floor(y/self.tileSize))
+
+    def getTilesNear(self, x, y):
+        # every tile overlapping the square of half width loadRadius +
+        # circleRadius around (x,y), a circle centered just outside
+        # loadRadius still reaches into it
+        reach = self.loadRadius + self.circleRadius
+        iMin, jMin = self.getTileIndex(x - reach, y - reach)
+        iMax, jMax = self.getTileIndex(x + reach, y + reach)
+        return [(i, j) for i in xrange(iMin, iMax+1) for j in xrange(jMin, jMax+1)]
+
+    def buildTile(self, i, j):
+        # (numObstaclesPerTile,3) array of [x, y, radius]
+        rng = np.random.RandomState([self.randomSeed % 2**32, i % 2**32, j % 2**32])
+        samples = rng.rand(self.numObstaclesPerTile, 2)
+        circles = np.zeros((self.numObstaclesPerTile, 3))
+        circles[:,0] = (i + samples[:,0]) * self.tileSize
+        circles[:,1] = (j + samples[:,1]) * self.tileSize
+        circles[:,2] = self.circleRadius
+        return circles
+
+    def update(self, x, y):
+        # returns True if world.obstacles was replaced
+        keys = self.getTilesNear(x, y)
+        if keys == self.activeTiles:
+            return False
+
+        # maxTiles holds all of keys, so none of them is evicted here
+        circles = [self.tiles.get(key, lambda: self.buildTile(key[0], key[1])) for key in keys]
+        self.obstacles = ObstacleTable(circles=np.vstack(circles))
+        self.obstacles.buildIndex()
+        self.activeTiles = keys
+        return True
+
+    def getMemoryUsage(self):
+        # bytes held by the cached tiles
+        return sum(circles.nbytes for circles in self.tiles.values())
@@ -0,0 +1,178 @@
+import numpy as np
+import json
+import os
+
+
+class TrajectoryLog(object):
+
+    # Columnar on-disk log of a simulation. A log is a directory holding one
+    # .npy file per column (stateOverTime, raycastData, ...) and a
+    # header.json with the column list and any metadata, e.g. the options
+    # and simulationData. Every column shares the timestep axis as its
+    # first dimension.
+    #
+    # Rows are appended to the column files as the simulation runs. The .npy
+    # headers are written with spare room so the row count can be updated in
+    # place on flush, and the files stay readable by np.load at any point.
+    # Readers open the columns with mmap_mode='r', so opening a multi-GB log
+    # is instant and a timestep range only touches the pages it needs.
+    #
+    #   log = TrajectoryLog.create('data/run.log', metadata={'options': options})
+    #   log.addColumn('stateOverTime', rowShape=(3,))
+    #   log.append('stateOverTime', states)
+    #   log.close()
+    #
+    #   log = TrajectoryLog.open('data/run.log')
+    #   states = log.read('stateOverTime', 1000, 2000)
+
+    headerFilename = 'header.json'
+    npyHeaderLength = 128
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        self.columns = dict()
+        self.metadata = dict()
+        self.files = dict()
+        self.arrays = dict()
+
+    @staticmethod
+    def create(path, metadata=None):
+        # start a new log at path, replacing the columns of any existing log
+        if os.path.isdir(path):
+            existing = TrajectoryLog.open(path)
+            for name in existing.columns:
+                os.remove(existing.getColumnFilename(name))
+        else:
+            os.makedirs(path)
+
+        log = TrajectoryLog(path, writable=True)
+        if metadata is not None:
+            log.metadata.update(metadata)
+        log.writeHeader()
+        return log
+
+    @staticmethod
+    def open(path):
+        headerFilename = os.path.join(path, TrajectoryLog.headerFilename)
+        if not os.path.isfile(headerFilename):
+            raise ValueError("no trajectory log at " + path)
+
+        with open(headerFilename, 'r') as f:
+            header = json.load(f)
+
+        log = TrajectoryLog(path)
+        log.metadata = header['metadata']
+        for name, column in header['columns'].iteritems():
+            log.columns[str(name)] = {'dtype': str(column['dtype']),
+                                      'rowShape': tuple(column['rowShape']),
+                                      'numRows': column['numRows']}
+        return log
+
+    def getColumnFilename(self, name):
+        return os.path.join(self.path, name + '.npy')
+
+    def addColumn(self, name, dtype=np.float64, rowShape=()):
+        if not self.writable:
+            raise ValueError("trajectory log " + self.path + " is read only")
+        if name in self.columns:
+            raise ValueError("column " + name + " already exists")
+
+        self.columns[name] = {'dtype': np.dtype(dtype).str, 'rowShape': tuple(rowShape), 'numRows': 0}
+        self.files[name] = open(self.getColumnFilename(name), 'w+b')
+        self.writeNpyHeader(name)
+        self.writeHeader()
+
+    def append(self, name, rows):
+        # rows is an array of shape (N,) + rowShape, or a single row
+        column = self.columns[name]
+        rows = np.asarray(rows, dtype=column['dtype'])
+        if rows.shape == column['rowShape']:
+            rows = rows[np.newaxis]
+        if rows.shape[1:] != column['rowShape']:
+            raise ValueError("rows of shape " + str(rows.shape[1:]) + " do not match column " + name +
+                             " of shape " + str(column['rowShape']))
+
+        f = self.files[name]
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(rows).tostring())
+        column['numRows'] += len(rows)
+        self.arrays.pop(name, None)
+
+    def setMetadata(self, key, value):
+        self.metadata[key] = value
+
+    def flush(self):
+        for name in self.files:
+            self.writeNpyHeader(name)
+            self.files[name].flush()
+        self.writeHeader()
+
+    def close(self):
+        if self.writable:
+            self.flush()
+            for f in self.files.itervalues():
+                f.close()
+            self.files = dict()
+            self.writable = False
+        self.arrays = dict()
+
+    def numRows(self, name=None):
+        # rows in the given column, or in the shortest column
+        if name is not None:
+            return self.columns[name]['numRows']
+        if len(self.columns) == 0:
+            return 0
+        return min(column['numRows'] for column in self.columns.itervalues())
+
+    def read(self, name, start=None, stop=None):
+        # memory mapped rows [start, stop) of a column, read only
+        if name not in self.columns:
+            raise ValueError("trajectory log " + self.path + " has no column " + name)
+
+        if name not in self.arrays:
+            if self.writable:
+                self.writeNpyHeader(name)
+                self.files[name].flush()
+            if self.columns[name]['numRows'] == 0:
+                column = self.columns[name]
+                self.arrays[name] = np.zeros((0,) + column['rowShape'], dtype=column['dtype'])
+            else:
+                self.arrays[name] = np.load(self.getColumnFilename(name), mmap_mode='r')
+
+        return self.arrays[name][start:stop]
+
+    def writeNpyHeader(self, name):
+        # .npy format 1.0 header padded with spaces to a fixed length, so it
+        # can be rewritten in place as the row count grows
+        column = self.columns[name]
+        shape = (column['numRows'],) + column['rowShape']
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (column['dtype'], shape)
+        preambleLength = len(np.lib.format.magic(1, 0)) + 2
+        header = header.ljust(self.npyHeaderLength - preambleLength - 1) + '\n'
+
+        f = self.files[name]
+        f.seek(0)
+        f.write(np.lib.format.magic(1, 0))
+        f.write(np.uint16(len(header)).astype('<u2').tostring())
+        f.write(header)
+
+    def writeHeader(self):
+        header = {'columns': dict(), 'metadata': self.metadata}
+        for name, column in self.columns.iteritems():
+            header['columns'][name] = {'dtype': column['dtype'],
+                                       'rowShape': list(column['rowShape']),
+                                       'numRows': column['numRows']}
+
+        # write then rename so a reader never sees a partial header
+        headerFilename = os.path.join(self.path, self.headerFilename)
+        with open(headerFilename + '.tmp', 'w') as f:
+            json.dump(header, f, indent=2, sort_keys=True, default=TrajectoryLog.toJSON)
+        os.rename(headerFilename + '.tmp', headerFilename)
+
+    @staticmethod
+    def toJSON(value):
+        # numpy scalars and arrays in the metadata
+        if isinstance(value, (np.ndarray, np.generic)):
+            return value.tolist()
+        raise TypeError(repr(value) + " is not JSON serializable")
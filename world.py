@@ -1,11 +1,15 @@
 import director.vtkAll as vtk
 from director import ioUtils
 from director import filterUtils
+from director import vtkNumpy as vnp
 import director.visualization as vis
+import director.objectmodel as om
 from director.debugVis import DebugData
 
 import numpy as np
 
+from obstacles import ObstacleTable
+
 from PythonQt import QtCore, QtGui
 
 class World(object):
@@ -20,10 +24,15 @@ class World(object):
         d.addLine((2,-1,0), (2,1,0), radius=0.1)
         d.addLine((2,-1,0), (1,-2,0), radius=0.1)
         obj = vis.showPolyData(d.getPolyData(), 'world')
+
+        obstacles = ObstacleTable()
+        obstacles.addThickSegment((2,-1,0), (2,1,0), 0.1)
+        obstacles.addThickSegment((2,-1,0), (1,-2,0), 0.1)
+        obj.obstacles = obstacles
         return obj
 
     @staticmethod
-    def buildBoundaries(d, scale=1.0, boundaryType="Warehouse"):
+    def buildBoundaries(d, scale=1.0, boundaryType="Warehouse", obstacles=None):
         
         if boundaryType == "Warehouse":
             worldXmin = -20
@@ -48,7 +57,10 @@ class World(object):
         for idx, value in enumerate(listOfCorners[:-1]):
             firstEndpt = value
             secondEndpt = listOfCorners[idx+1]
-            d.addLine(firstEndpt, secondEndpt, radius=1.0)
+            if d is not None:
+                d.addLine(firstEndpt, secondEndpt, radius=1.0)
+            if obstacles is not None:
+                obstacles.addThickSegment(firstEndpt, secondEndpt, 1.0)
 
         return worldXmin, worldXmax, worldYmin, worldYmax
 
@@ -58,7 +70,8 @@ class World(object):
         print "building stick world"
 
         d = DebugData()
-        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d)
+        obstacles = ObstacleTable()
+        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, obstacles=obstacles)
         print "boundaries done"
 
         worldArea = (worldXmax-worldXmin)*(worldYmax-worldYmin)
@@ -72,22 +85,16 @@ class World(object):
         # draw random stick obstacles
         obsLength = 2.0
 
+        firstEndpts, secondEndpts = World.sampleSticks(numObstacles, worldXmin, worldXmax, worldYmin, worldYmax, obsLength)
+        obstacles.addThickSegments(firstEndpts, secondEndpts, 0.2)
 
-        for i in xrange(numObstacles):
-            firstX = worldXmin + np.random.rand()*(worldXmax-worldXmin)
-            firstY = worldYmin + np.random.rand()*(worldYmax-worldYmin)
-            firstEndpt = (firstX,firstY,0)
-            
-            randTheta = np.random.rand() * 2.0*np.pi
-            secondEndpt = (firstX+obsLength*np.cos(randTheta), firstY+obsLength*np.sin(randTheta), 0)
-
-            d.addLine(firstEndpt, secondEndpt, radius=0.2)
-
-
-        obj = vis.showPolyData(d.getPolyData(), 'world')
+        polyData = filterUtils.appendPolyData([d.getPolyData(),
+                                               World.buildSticksPolyData(firstEndpts, secondEndpts, obsLength, 0.2)])
+        obj = vis.showPolyData(polyData, 'world')
 
         world = World()
         world.visObj = obj
+        world.obstacles = obstacles
         world.Xmax = worldXmax
         world.Xmin = worldXmin
         world.Ymax = worldYmax
@@ -100,14 +107,15 @@ class World(object):
 
     @staticmethod
     def buildCircleWorld(percentObsDensity, nonRandom=False, circleRadius=3, scale=None, randomSeed=5,
-                         obstaclesInnerFraction=1.0):
+                         obstaclesInnerFraction=1.0, visualize=True, layout='uniform', minGap=2.0):
         #print "building circle world"
 
         if nonRandom:
             np.random.seed(randomSeed)
 
-        d = DebugData()
-        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, scale=scale, boundaryType="Square")
+        obstacles = ObstacleTable()
+        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(None, scale=scale, boundaryType="Square",
+                                                                           obstacles=obstacles)
         #print "boundaries done"
 
         worldArea = (worldXmax-worldXmin)*(worldYmax-worldYmin)
@@ -126,20 +134,25 @@ class World(object):
         obsYmin = worldYmin + (1-obstaclesInnerFraction)/2.0*(worldYmax - worldYmin)
         obsYmax = worldYmax - (1-obstaclesInnerFraction)/2.0*(worldYmax - worldYmin)
 
-        for i in xrange(numObstacles):
-            firstX = obsXmin + np.random.rand()*(obsXmax-obsXmin)
-            firstY = obsYmin + np.random.rand()*(obsYmax-obsYmin)
-            firstEndpt = (firstX,firstY,+0.2)
-            secondEndpt = (firstX,firstY,-0.2)
-
-            #d.addLine(firstEndpt, secondEndpt, radius=2*np.random.randn())
-            d.addLine(firstEndpt, secondEndpt, radius=circleRadius)
+        # the poissonDisk layout keeps at least minGap of free space between
+        # any two circles
+        if layout == 'uniform':
+            circleCenters = World.samplePoints(numObstacles, obsXmin, obsXmax, obsYmin, obsYmax)
+        elif layout == 'poissonDisk':
+            circleCenters = World.samplePoissonDisk(numObstacles, obsXmin, obsXmax, obsYmin, obsYmax,
+                                                    2*circleRadius + minGap)
+        else:
+            raise ValueError("unknown obstacle layout " + layout)
 
-
-        obj = vis.showPolyData(d.getPolyData(), 'world')
+        obstacles.addCircles(circleCenters, circleRadius)
+        obstacles.buildIndex()
 
         world = World()
-        world.visObj = obj
+        world.visObj = None
+        if visualize:
+            world.visObj = vis.showPolyData(World.buildWorldPolyData(obstacles), 'world')
+
+        world.obstacles = obstacles
         world.Xmax = worldXmax
         world.Xmin = worldXmin
         world.Ymax = worldYmax
@@ -149,6 +162,134 @@ class World(object):
 
         return world
 
+    @staticmethod
+    def buildWorldPolyData(obstacles):
+        # tessellate an obstacle table the same way the world builders draw it,
+        # so a world built without visualization can be shown later on
+        d = DebugData()
+
+        for x1, y1, x2, y2, radius in obstacles.tubes:
+            d.addLine((x1,y1,0), (x2,y2,0), radius=radius)
+
+        if obstacles.numCircles == 0:
+            return d.getPolyData()
+
+        return filterUtils.appendPolyData([d.getPolyData(), World.buildCirclesPolyData(obstacles.circles)])
+
+    @staticmethod
+    def samplePoints(numPoints, xmin, xmax, ymin, ymax):
+        # (numPoints,2) uniform samples, drawn x then y for each point so the
+        # layout for a given seed is the same as drawing them one at a time
+        samples = np.random.rand(numPoints, 2)
+        return np.column_stack((xmin + samples[:,0]*(xmax-xmin), ymin + samples[:,1]*(ymax-ymin)))
+
+    @staticmethod
+    def samplePoissonDisk(numPoints, xmin, xmax, ymin, ymax, minDistance, batchSize=256, maxBatches=None):
+        # (numPoints,2) uniform samples no two of which are closer than
+        # minDistance, by dart throwing in batches. Accepted points live in a
+        # grid of cells minDistance/sqrt(2) wide, which holds at most one
+        # point per cell, so a candidate is checked against the 5x5 cells
+        # around it. A candidate is also dropped if it is too close to an
+        # earlier candidate of its own batch.
+        if maxBatches is None:
+            maxBatches = 100 + 20*numPoints/batchSize
+
+        cellSize = minDistance/np.sqrt(2.0)
+        gridShape = (int(np.ceil((xmax-xmin)/cellSize)) + 4, int(np.ceil((ymax-ymin)/cellSize)) + 4)
+        grid = -np.ones(gridShape, dtype=int)
+        points = np.zeros((numPoints, 2))
+        numAccepted = 0
+        offsets = np.array([(i, j) for i in xrange(-2, 3) for j in xrange(-2, 3)])
+
+        for batch in xrange(maxBatches):
+            if numAccepted == numPoints:
+                break
+
+            candidates = World.samplePoints(batchSize, xmin, xmax, ymin, ymax)
+            cells = np.floor((candidates - [xmin, ymin])/cellSize).astype(int) + 2
+
+            neighbors = grid[cells[:,0:1] + offsets[:,0], cells[:,1:2] + offsets[:,1]]
+            neighborPoints = points[np.maximum(neighbors, 0)]
+            tooClose = (neighbors >= 0) & (np.sum((neighborPoints - candidates[:,np.newaxis,:])**2, axis=2) < minDistance**2)
+            free = ~np.any(tooClose, axis=1)
+
+            pairDistances = np.sum((candidates[:,np.newaxis,:] - candidates)**2, axis=2)
+            free &= ~np.any(np.tril(pairDistances < minDistance**2, -1), axis=1)
+
+            accepted = np.flatnonzero(free)[0:numPoints-numAccepted]
+            points[numAccepted:numAccepted+len(accepted)] = candidates[accepted]
+            grid[cells[accepted,0], cells[accepted,1]] = numAccepted + np.arange(len(accepted))
+            numAccepted += len(accepted)
+
+        if numAccepted < numPoints:
+            raise ValueError("could only place " + str(numAccepted) + " of " + str(numPoints) +
+                             " points at least " + str(minDistance) + " apart")
+
+        return points
+
+    @staticmethod
+    def sampleSticks(numSticks, xmin, xmax, ymin, ymax, length):
+        # sticks of the given length from a uniform start point in a uniform
+        # direction, drawn x, y, theta for each stick
+        samples = np.random.rand(numSticks, 3)
+        firstEndpts = np.column_stack((xmin + samples[:,0]*(xmax-xmin), ymin + samples[:,1]*(ymax-ymin)))
+        theta = samples[:,2] * 2.0*np.pi
+        secondEndpts = firstEndpts + length*np.column_stack((np.cos(theta), np.sin(theta)))
+        return firstEndpts, secondEndpts
+
+    @staticmethod
+    def buildCirclesPolyData(circles):
+        # every circle is the same capped tube DebugData draws, tessellated
+        # once at unit radius and copied to each center by vtkGlyph3D, scaled
+        # by the radius in x and y only
+        d = DebugData()
+        d.addLine((0,0,+0.2), (0,0,-0.2), radius=1.0)
+
+        centers = np.column_stack((circles[:,0:2], np.zeros(len(circles))))
+        scales = np.column_stack((circles[:,2], circles[:,2], np.ones(len(circles))))
+        return World.buildGlyphs(d.getPolyData(), centers, scales, orient=False)
+
+    @staticmethod
+    def buildSticksPolyData(firstEndpts, secondEndpts, length, radius):
+        # sticks of equal length and radius as copies of one tube along the x
+        # axis, rotated onto each stick
+        d = DebugData()
+        d.addLine((0,0,0), (length,0,0), radius=radius)
+
+        starts = np.column_stack((firstEndpts[:,0:2], np.zeros(len(firstEndpts))))
+        directions = np.column_stack((secondEndpts[:,0:2] - firstEndpts[:,0:2], np.zeros(len(firstEndpts))))
+        return World.buildGlyphs(d.getPolyData(), starts, directions, orient=True)
+
+    @staticmethod
+    def buildGlyphs(template, points, vectors, orient):
+        # one copy of template at each point. With orient the x axis of the
+        # copy is turned onto the vector, otherwise it is scaled by the vector
+        # components.
+        pointsPolyData = vnp.getVtkPolyDataFromNumpyPoints(points)
+        vnp.addNumpyToVtk(pointsPolyData, np.asarray(vectors, dtype=float), 'glyphVectors')
+        pointsPolyData.GetPointData().SetActiveVectors('glyphVectors')
+
+        glyph = vtk.vtkGlyph3D()
+        glyph.SetSourceData(template)
+        glyph.SetInputData(pointsPolyData)
+        glyph.SetVectorModeToUseVector()
+        if orient:
+            glyph.OrientOn()
+            glyph.ScalingOff()
+        else:
+            glyph.OrientOff()
+            glyph.SetScaleModeToScaleByVectorComponents()
+        glyph.Update()
+        return glyph.GetOutput()
+
+    @staticmethod
+    def showWorld(world, polyData=None):
+        om.removeFromObjectModel(om.findObjectByName('world'))
+        if polyData is None:
+            polyData = World.buildWorldPolyData(world.obstacles)
+        world.visObj = vis.showPolyData(polyData, 'world')
+        return world.visObj
+
     @staticmethod
     def buildWarehouseWorld(percentObsDensity, nonRandom=False, circleRadius=0.1, scale=None, randomSeed=5,
                          obstaclesInnerFraction=1.0):
@@ -157,7 +298,9 @@ class World(object):
             np.random.seed(randomSeed)
 
         d = DebugData()
-        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, scale=scale, boundaryType="Warehouse")
+        obstacles = ObstacleTable()
+        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, scale=scale, boundaryType="Warehouse",
+                                                                           obstacles=obstacles)
 
         numObstacles = 8
  
@@ -189,11 +332,13 @@ class World(object):
 
             #d.addLine(firstEndpt, secondEndpt, radius=2*np.random.randn())
             d.addLine(firstEndpt, secondEndpt, radius=circleRadius)
+            obstacles.addThickSegment(firstEndpt, secondEndpt, circleRadius)
 
         obj = vis.showPolyData(d.getPolyData(), 'world')
 
         world = World()
         world.visObj = obj
+        world.obstacles = obstacles
         world.Xmax = worldXmax
         world.Xmin = worldXmin
         world.Ymax = worldYmax
@@ -211,7 +356,9 @@ class World(object):
             np.random.seed(randomSeed)
 
         d = DebugData()
-        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, scale=scale, boundaryType="Warehouse")
+        obstacles = ObstacleTable()
+        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, scale=scale, boundaryType="Warehouse",
+                                                                           obstacles=obstacles)
 
         worldArea = (worldXmax-worldXmin)*(worldYmax-worldYmin)
         obsScalingFactor = 1.0/12.0
@@ -228,20 +375,16 @@ class World(object):
         obsYmin = worldYmin + (1-obstaclesInnerFraction)/2.0*(worldYmax - worldYmin)
         obsYmax = worldYmax - (1-obstaclesInnerFraction)/2.0*(worldYmax - worldYmin)
 
-        for i in xrange(numObstacles):
-            firstX = obsXmin + np.random.rand()*(obsXmax-obsXmin)
-            firstY = obsYmin + np.random.rand()*(obsYmax-obsYmin)
-            firstEndpt = (firstX,firstY,+0.2)
-            secondEndpt = (firstX,firstY,-0.2)
+        circleCenters = World.samplePoints(numObstacles, obsXmin, obsXmax, obsYmin, obsYmax)
+        obstacles.addCircles(circleCenters, circleRadius)
+        obstacles.buildIndex()
 
-            #d.addLine(firstEndpt, secondEndpt, radius=2*np.random.randn())
-            d.addLine(firstEndpt, secondEndpt, radius=circleRadius)
-
-
-        obj = vis.showPolyData(d.getPolyData(), 'world')
+        polyData = filterUtils.appendPolyData([d.getPolyData(), World.buildCirclesPolyData(obstacles.circles)])
+        obj = vis.showPolyData(polyData, 'world')
 
         world = World()
         world.visObj = obj
+        world.obstacles = obstacles
         world.Xmax = worldXmax
         world.Xmin = worldXmin
         world.Ymax = worldYmax
@@ -256,7 +399,8 @@ class World(object):
         print "building fixed triangle world"
 
         d = DebugData()
-        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d)
+        obstacles = ObstacleTable()
+        worldXmin, worldXmax, worldYmin, worldYmax = World.buildBoundaries(d, obstacles=obstacles)
         print "boundaries done"
 
         worldArea = (worldXmax-worldXmin)*(worldYmax-worldYmin)
@@ -270,22 +414,16 @@ class World(object):
         # draw random stick obstacles
         obsLength = 2.0
 
+        firstEndpts, secondEndpts = World.sampleSticks(numObstacles, worldXmin, worldXmax, worldYmin, worldYmax, obsLength)
+        obstacles.addThickSegments(firstEndpts, secondEndpts, 0.1)
 
-        for i in xrange(numObstacles):
-            firstX = worldXmin + np.random.rand()*(worldXmax-worldXmin)
-            firstY = worldYmin + np.random.rand()*(worldYmax-worldYmin)
-            firstEndpt = (firstX,firstY,0)
-            
-            randTheta = np.random.rand() * 2.0*np.pi
-            secondEndpt = (firstX+obsLength*np.cos(randTheta), firstY+obsLength*np.sin(randTheta), 0)
-
-            d.addLine(firstEndpt, secondEndpt, radius=0.1)
-
-
-        obj = vis.showPolyData(d.getPolyData(), 'world')
+        polyData = filterUtils.appendPolyData([d.getPolyData(),
+                                               World.buildSticksPolyData(firstEndpts, secondEndpts, obsLength, 0.1)])
+        obj = vis.showPolyData(polyData, 'world')
 
         world = World()
         world.visObj = obj
+        world.obstacles = obstacles
         world.Xmax = worldXmax
         world.Xmin = worldXmin
         world.Ymax = worldYmax
@@ -0,0 +1,145 @@
+from director import ioUtils
+
+import numpy as np
+import hashlib
+import json
+import os
+import tempfile
+
+from world import World
+from obstacles import ObstacleTable
+
+
+class WorldCache(object):
+
+    # On-disk cache of generated worlds, addressed by a hash of the builder
+    # and its parameters. Only worlds fully fixed by their parameters, i.e.
+    # built with nonRandom=True and a randomSeed, should go through it.
+    #
+    # Each entry is <key>.npz with the obstacle table, the world bounds and
+    # the numpy random state the builder left behind, so code that draws
+    # random numbers after the world is built sees the same sequence on a
+    # hit as on a miss. The tessellated mesh is <key>.vtp, written the first
+    # time it is needed. A vtkCellLocator cannot be written to disk, so
+    # locators are memoized per process instead, and a sweep that rebuilds
+    # the same world many times indexes its mesh only once.
+    #
+    #   cache = WorldCache('data/worlds')
+    #   world = cache.buildCircleWorld(percentObsDensity=20, nonRandom=True, randomSeed=5, ...)
+    #   locator = cache.getLocator(world)
+
+    version = 1
+    locators = dict()
+
+    def __init__(self, cacheDir='data/worlds'):
+        self.cacheDir = cacheDir
+        self.numHits = 0
+        self.numMisses = 0
+
+    @staticmethod
+    def getKey(builder, parameters):
+        key = json.dumps({'builder': builder, 'parameters': parameters, 'version': WorldCache.version},
+                         sort_keys=True)
+        return hashlib.sha1(key).hexdigest()
+
+    def getFilename(self, key, extension):
+        return os.path.join(self.cacheDir, key + extension)
+
+    def buildCircleWorld(self, visualize=True, **parameters):
+        # same arguments as World.buildCircleWorld
+        key = self.getKey('buildCircleWorld', parameters)
+        world = self.loadWorld(key)
+
+        if world is None:
+            self.numMisses += 1
+            world = World.buildCircleWorld(visualize=False, **parameters)
+            world.cacheKey = key
+            self.saveWorld(key, world)
+        else:
+            self.numHits += 1
+
+        if visualize:
+            self.showWorld(world)
+
+        return world
+
+    def loadWorld(self, key):
+        filename = self.getFilename(key, '.npz')
+        if not os.path.isfile(filename):
+            return None
+
+        data = np.load(filename)
+        numSides = int(data['numSides'])
+        obstacles = ObstacleTable(circles=data['circles'], segments=data['segments'],
+                                  numSides=None if numSides < 0 else numSides)
+        obstacles.tubes = data['tubes']
+        obstacles.buildIndex()
+
+        world = World()
+        world.visObj = None
+        world.obstacles = obstacles
+        world.Xmin, world.Xmax, world.Ymin, world.Ymax = data['bounds']
+        world.numObstacles = int(data['numObstacles'])
+        world.percentObsDensity = float(data['percentObsDensity'])
+        world.cacheKey = key
+
+        np.random.set_state(('MT19937', data['randomKeys'], int(data['randomPos']),
+                             int(data['randomHasGauss']), float(data['randomCachedGaussian'])))
+        return world
+
+    def saveWorld(self, key, world):
+        if not os.path.isdir(self.cacheDir):
+            os.makedirs(self.cacheDir)
+
+        obstacles = world.obstacles
+        _, randomKeys, randomPos, randomHasGauss, randomCachedGaussian = np.random.get_state()
+
+        # written under a temporary name of its own and renamed, so a
+        # parallel run never loads a partial entry, even when several
+        # processes write the same key at once
+        filename = self.getFilename(key, '.npz')
+        fd, tmpFilename = tempfile.mkstemp(suffix='.npz.tmp', prefix=key, dir=self.cacheDir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, circles=obstacles.circles, segments=obstacles.segments, tubes=obstacles.tubes,
+                     numSides=-1 if obstacles.numSides is None else obstacles.numSides,
+                     bounds=[world.Xmin, world.Xmax, world.Ymin, world.Ymax],
+                     numObstacles=world.numObstacles, percentObsDensity=world.percentObsDensity,
+                     randomKeys=randomKeys, randomPos=randomPos, randomHasGauss=randomHasGauss,
+                     randomCachedGaussian=randomCachedGaussian)
+        os.rename(tmpFilename, filename)
+
+    def getPolyData(self, world):
+        # the world mesh, read from the cache or tessellated and written there
+        key = getattr(world, 'cacheKey', None)
+        if key is None:
+            return World.buildWorldPolyData(world.obstacles)
+
+        filename = self.getFilename(key, '.vtp')
+        if os.path.isfile(filename):
+            return ioUtils.readPolyData(filename)
+
+        polyData = World.buildWorldPolyData(world.obstacles)
+        fd, tmpFilename = tempfile.mkstemp(suffix='.tmp.vtp', prefix=key, dir=self.cacheDir)
+        os.close(fd)
+        ioUtils.writePolyData(polyData, tmpFilename)
+        os.rename(tmpFilename, filename)
+        return polyData
+
+    def showWorld(self, world):
+        return World.showWorld(world, self.getPolyData(world))
+
+    def getLocator(self, world):
+        # cell locator over the world mesh, shared by every world with the
+        # same key in this process
+        key = getattr(world, 'cacheKey', None)
+        if key is not None and key in WorldCache.locators:
+            return WorldCache.locators[key]
+
+        if world.visObj is not None:
+            locator = World.buildCellLocator(world.visObj.polyData)
+        else:
+            locator = World.buildCellLocator(self.getPolyData(world))
+
+        if key is not None:
+            WorldCache.locators[key] = locator
+        return locator